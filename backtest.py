@@ -0,0 +1,289 @@
+# backtest.py - Replay vetorizado das regras Brandon Wendell sobre o histórico em cache
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import main
+
+# Timeframes usados pela estratégia (mesmos intervalos do ciclo ao vivo)
+TIMEFRAMES_BACKTEST = {'W1': '1wk', 'D1': '1d', 'H4': '4h', 'M15': '15m'}
+TIMEFRAMES_ZONAS = ('W1', 'D1', 'H4')
+
+PARAMETROS_PADRAO = {
+    'distancia_max': 0.008,
+    'rsi_compra_min': 40,
+    'rsi_venda_max': 60,
+    'vol_max': 0.015,
+    'fator_stop': 0.005,
+    'alvo_r': 2.0,          # alvo em múltiplos do risco até o stop
+    'max_barras': 96 * 5,   # encerra a operação após ~5 dias de M15
+}
+
+
+# ===========================
+# 📂 HISTÓRICO
+# ===========================
+def carregar_historico(ticker=main.SYMBOLS[0]):
+    """
+    Barras de cada timeframe: o histórico só-acréscimo que o ciclo ao vivo
+    grava em CACHE_DIR/historico (main.carregar_arquivo_historico), mais as
+    barras do cache de barras ainda não arquivadas. O cache sozinho só tem o
+    período do ciclo (ex.: 6 pregões de M15). Índices em UTC.
+    """
+    historico = {}
+    for tf, interval in TIMEFRAMES_BACKTEST.items():
+        df = main.carregar_arquivo_historico(ticker, interval)
+        entrada = main._carregar_entrada((ticker, interval))
+        if entrada is not None and len(entrada['barras']):
+            recente = entrada['barras'].dataframe()
+            recente = recente.tz_localize('UTC') if recente.index.tz is None else recente.tz_convert('UTC')
+            if not df.empty:
+                recente = recente[recente.index > df.index[-1]]
+            df = pd.concat([df, recente]) if not df.empty else recente
+        if not df.empty:
+            historico[tf] = df
+    return historico
+
+
+def _em_ns(indice):
+    """Instantes em ns UTC (índices sem fuso são tratados como UTC)."""
+    if indice.tz is None:
+        indice = indice.tz_localize('UTC')
+    return indice.tz_convert('UTC').as_unit('ns').asi8
+
+
+# ===========================
+# 🧮 PREPARAÇÃO (FEITA UMA VEZ POR JANELA)
+# ===========================
+def _eventos_zonas(zonas, close, media_acumulada, fechamento, window, suporte):
+    """
+    Cada swing filtrado vira um evento datado pelo fechamento da barra que o
+    confirma (index + window), o que evita olhar o futuro. A filtragem é
+    estável por prefixo, então a lista completa equivale à vista em cada
+    instante. Para o k-ésimo evento guarda a volatilidade da base formada
+    com o anterior (NaN se não há padrão W/M).
+    """
+    indices = np.array([z['index'] for z in zonas], dtype=np.int64)
+    precos = np.array([z['price'] for z in zonas], dtype=float)
+    confirmacao = indices + window
+    volatilidade = np.full(len(indices), np.nan)
+    for k in range(1, len(indices)):
+        anterior, atual = indices[k - 1], indices[k]
+        forma_base = precos[k] > precos[k - 1] if suporte else precos[k] < precos[k - 1]
+        if forma_base and atual - anterior > 5:
+            trecho = close[anterior:atual]
+            volatilidade[k] = np.nanstd(trecho, ddof=1) / media_acumulada[confirmacao[k]]
+    return {'tempo': fechamento[confirmacao], 'preco': precos, 'volatilidade': volatilidade}
+
+
+def _preparar_timeframe(df, interval, window, min_distance, tolerancia):
+    df = main.calcular_indicadores(main.normalizar_colunas(df.copy()))
+    fechamento = _em_ns(df.index + main.DURACAO_BARRA[interval])
+    close = df['close'].to_numpy(dtype=float)
+    validos = ~np.isnan(close)
+    media_acumulada = np.cumsum(np.where(validos, close, 0)) / np.maximum(np.cumsum(validos), 1)
+    zonas = main.detectar_zonas(df, window, min_distance, tolerancia)
+    return {
+        'fechamento': fechamento,
+        'close': close,
+        'rsi': df['rsi_14'].to_numpy(dtype=float),
+        'ema': df['ema_21'].to_numpy(dtype=float),
+        'suportes': _eventos_zonas(zonas['suportes'], close, media_acumulada, fechamento, window, True),
+        'resistencias': _eventos_zonas(zonas['resistencias'], close, media_acumulada, fechamento, window, False),
+    }
+
+
+def _ultimo_ate(tempos, instantes):
+    """Posição do último evento com tempo <= instante (-1 se nenhum)."""
+    return np.searchsorted(tempos, instantes, side='right') - 1
+
+
+def _alinhar(valores, posicoes, vazio=np.nan):
+    """valores[posicoes], com posição -1 resultando em `vazio`."""
+    return np.append(valores, vazio)[posicoes]
+
+
+def preparar_base(historico, window=3, min_distance=3, tolerancia=0.001):
+    """
+    Calcula indicadores, swings e o alinhamento multi-timeframe uma única
+    vez. Cada barra M15 é avaliada no seu fechamento e só enxerga barras
+    maiores já fechadas e swings já confirmados.
+    """
+    if 'M15' not in historico or 'D1' not in historico or 'H4' not in historico:
+        raise ValueError("Histórico insuficiente: M15, D1 e H4 são obrigatórios")
+
+    m15 = main.calcular_indicadores(main.normalizar_colunas(historico['M15'].copy()))
+    instantes = _em_ns(m15.index + main.DURACAO_BARRA['15m'])
+    base = {
+        'indice': m15.index,
+        'close': m15['close'].to_numpy(dtype=float),
+        'low': m15['low'].to_numpy(dtype=float),
+        'high': m15['high'].to_numpy(dtype=float),
+        'rsi': m15['rsi_14'].to_numpy(dtype=float),
+        'timeframes': {},
+    }
+    for tf in TIMEFRAMES_ZONAS:
+        if tf not in historico:
+            continue
+        prep = _preparar_timeframe(historico[tf], TIMEFRAMES_BACKTEST[tf], window, min_distance, tolerancia)
+        posicao = _ultimo_ate(prep['fechamento'], instantes)
+        base['timeframes'][tf] = {
+            'close': _alinhar(prep['close'], posicao),
+            'rsi': _alinhar(prep['rsi'], posicao),
+            'ema': _alinhar(prep['ema'], posicao),
+            'suportes': prep['suportes'],
+            'resistencias': prep['resistencias'],
+            'pos_suporte': _ultimo_ate(prep['suportes']['tempo'], instantes),
+            'pos_resistencia': _ultimo_ate(prep['resistencias']['tempo'], instantes),
+        }
+    return base
+
+
+# ===========================
+# 🎯 AVALIAÇÃO E SIMULAÇÃO
+# ===========================
+def zonas_convergentes(base, vol_max=0.015):
+    """(buy_zone, sell_zone) em cada barra M15: há W/M base com volatilidade < vol_max em algum timeframe."""
+    n = len(base['close'])
+    buy_zone = np.zeros(n, dtype=bool)
+    sell_zone = np.zeros(n, dtype=bool)
+    for tf in base['timeframes'].values():
+        with np.errstate(invalid='ignore'):
+            w_base = tf['suportes']['volatilidade'] < vol_max
+            m_base = tf['resistencias']['volatilidade'] < vol_max
+        buy_zone |= _alinhar(w_base, tf['pos_suporte'], False)
+        sell_zone |= _alinhar(m_base, tf['pos_resistencia'], False)
+    return buy_zone, sell_zone
+
+
+def avaliar_base(base, distancia_max=0.008, rsi_compra_min=40, rsi_venda_max=60, vol_max=0.015, zonas=None):
+    """
+    Código de sinal (SINAL_*) em cada barra M15, via main.avaliar_sinais.
+    zonas: saída de zonas_convergentes(base, vol_max) já calculada.
+    """
+    buy_zone, sell_zone = zonas if zonas is not None else zonas_convergentes(base, vol_max)
+    d1, h4 = base['timeframes']['D1'], base['timeframes']['H4']
+    codigo, _ = main.avaliar_sinais(
+        d1['close'], d1['ema'], d1['rsi'],
+        h4['close'], h4['ema'], h4['rsi'],
+        base['close'], base['rsi'],
+        buy_zone, sell_zone,
+        _alinhar(h4['suportes']['preco'], h4['pos_suporte']),
+        _alinhar(h4['resistencias']['preco'], h4['pos_resistencia']),
+        distancia_max=distancia_max, rsi_compra_min=rsi_compra_min, rsi_venda_max=rsi_venda_max)
+    return codigo
+
+
+def simular_operacoes(base, codigo, fator_stop=0.005, alvo_r=2.0, max_barras=96 * 5):
+    """
+    Entra no fechamento da barra com COMPRA/VENDA (stop em low·(1-f) /
+    high·(1+f), como no ciclo ao vivo) e sai no stop, no alvo (alvo_r × risco),
+    num sinal oposto ou após max_barras. Stop e alvo na mesma barra contam
+    como stop. Uma operação por vez.
+    """
+    close, low, high, indice = base['close'], base['low'], base['high'], base['indice']
+    n = len(close)
+    entradas = np.flatnonzero((codigo == main.SINAL_COMPRA) | (codigo == main.SINAL_VENDA))
+    operacoes = []
+    k = 0
+    while k < len(entradas):
+        i = entradas[k]
+        if i >= n - 1:
+            break
+        lado = 1 if codigo[i] == main.SINAL_COMPRA else -1
+        entrada = close[i]
+        stop = low[i] * (1 - fator_stop) if lado == 1 else high[i] * (1 + fator_stop)
+        risco = abs(entrada - stop)
+        alvo = entrada + lado * alvo_r * risco
+
+        fim = min(i + max_barras, n - 1)
+        janela = slice(i + 1, fim + 1)
+        bateu_stop = low[janela] <= stop if lado == 1 else high[janela] >= stop
+        bateu_alvo = high[janela] >= alvo if lado == 1 else low[janela] <= alvo
+        oposto = codigo[janela] == (main.SINAL_VENDA if lado == 1 else main.SINAL_COMPRA)
+
+        # Em empate na mesma barra vale a ordem stop, alvo, sinal oposto
+        candidatos = [(int(np.argmax(mascara)), prioridade, motivo) for prioridade, (motivo, mascara) in
+                      enumerate((('stop', bateu_stop), ('alvo', bateu_alvo), ('sinal_oposto', oposto)))
+                      if mascara.any()]
+        if candidatos:
+            deslocamento, _, motivo = min(candidatos)
+            j = i + 1 + deslocamento
+        else:
+            j, motivo = fim, 'tempo'
+        saida = {'stop': stop, 'alvo': alvo}.get(motivo, close[j])
+
+        pnl_pct = lado * (saida - entrada) / entrada * 100
+        operacoes.append({
+            'entrada_ts': indice[i],
+            'saida_ts': indice[j],
+            'lado': 'compra' if lado == 1 else 'venda',
+            'preco_entrada': entrada,
+            'stop': stop,
+            'alvo': alvo,
+            'preco_saida': saida,
+            'motivo_saida': motivo,
+            'barras': int(j - i),
+            'pnl_pct': pnl_pct,
+            'r_multiplo': lado * (saida - entrada) / risco if risco else np.nan,
+        })
+        k = np.searchsorted(entradas, j, side='right')
+    return pd.DataFrame(operacoes)
+
+
+def estatisticas(operacoes):
+    if operacoes.empty:
+        return {'operacoes': 0}
+    pnl = operacoes['pnl_pct']
+    ganhos, perdas = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+    acumulado = pnl.cumsum()
+    return {
+        'operacoes': int(len(operacoes)),
+        'compras': int((operacoes['lado'] == 'compra').sum()),
+        'vendas': int((operacoes['lado'] == 'venda').sum()),
+        'taxa_acerto': round(float((pnl > 0).mean()), 4),
+        'pnl_total_pct': round(float(pnl.sum()), 4),
+        'pnl_medio_pct': round(float(pnl.mean()), 4),
+        'r_medio': round(float(operacoes['r_multiplo'].mean()), 4),
+        'fator_lucro': round(float(ganhos / perdas), 4) if perdas > 0 else None,
+        'max_drawdown_pct': round(float((acumulado.cummax().clip(lower=0) - acumulado).max()), 4),
+        'saidas': operacoes['motivo_saida'].value_counts().to_dict(),
+    }
+
+
+def executar_backtest(historico, window=3, min_distance=3, tolerancia=0.001, **parametros):
+    parametros = {**PARAMETROS_PADRAO, **parametros}
+    base = preparar_base(historico, window, min_distance, tolerancia)
+    codigo = avaliar_base(base, parametros['distancia_max'], parametros['rsi_compra_min'],
+                          parametros['rsi_venda_max'], parametros['vol_max'])
+    operacoes = simular_operacoes(base, codigo, parametros['fator_stop'], parametros['alvo_r'],
+                                  parametros['max_barras'])
+    return operacoes, estatisticas(operacoes)
+
+
+# ===========================
+# ▶️ EXECUTAR
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backtest das regras Brandon Wendell sobre o histórico arquivado pelo ciclo ao vivo "
+                    "(CACHE_DIR/historico, só-acréscimo) completado pelo cache de barras")
+    parser.add_argument("--ticker", default=main.SYMBOLS[0])
+    parser.add_argument("--inicio", help="descarta barras anteriores (ex.: 2025-01-01)")
+    parser.add_argument("--saida", default="backtest_operacoes.csv", help="log das operações (CSV)")
+    args = parser.parse_args()
+
+    historico = carregar_historico(args.ticker)
+    if args.inicio:
+        historico = {tf: df[df.index >= pd.Timestamp(args.inicio, tz=df.index.tz)] for tf, df in historico.items()}
+    print(f"📂 Barras: {({tf: len(df) for tf, df in historico.items()})}")
+
+    inicio = time.perf_counter()
+    operacoes, stats = executar_backtest(historico)
+    print(f"⏱️ Backtest em {time.perf_counter() - inicio:.2f}s")
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+    operacoes.to_csv(args.saida, index=False)
+    print(f"💾 Operações salvas em {args.saida}")
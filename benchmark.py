@@ -0,0 +1,257 @@
+# benchmark.py - Mede o custo do ciclo com dados sintéticos (sem Yahoo, Telegram ou git)
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import main
+
+LIMITES_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_limites.json")
+
+FREQUENCIAS = {'15m': '15min', '1h': '1h', '4h': '4h', '1d': '1D', '1wk': 'W-MON'}
+
+
+# ===========================
+# 🧪 DADOS SINTÉTICOS
+# ===========================
+def gerar_ohlcv(n, freq='15min', seed=42, fim=None, preco_inicial=2000.0):
+    """OHLCV determinístico: passeio aleatório com ciclos, para formar swings e bases."""
+    rng = np.random.default_rng(seed)
+    fim = fim if fim is not None else pd.Timestamp.now(tz='UTC').floor('15min')
+    indice = pd.date_range(end=fim, periods=n, freq=freq)
+    passo = np.arange(n)
+    retornos = rng.normal(0, 0.002, n) + 0.0008 * np.sin(passo / 40) + 0.0004 * np.sin(passo / 7)
+    close = preco_inicial * np.exp(np.cumsum(retornos))
+    abertura = np.concatenate([[close[0]], close[:-1]])
+    amplitude = np.abs(rng.normal(0, 0.001, n)) * close
+    return pd.DataFrame({
+        'Open': abertura,
+        'High': np.maximum(abertura, close) + amplitude,
+        'Low': np.minimum(abertura, close) - amplitude,
+        'Close': close,
+        'Volume': rng.integers(100, 10_000, n),
+    }, index=indice)
+
+
+class FonteSintetica:
+    """
+    Substituto local de yf.download (mesma assinatura e formato de colunas).
+    atrasos: {ticker: segundos} de latência real; falhas: tickers que levantam erro.
+    """
+
+    def __init__(self, seed=42, atrasos=None, falhas=()):
+        self.seed = seed
+        self.atrasos = atrasos or {}
+        self.falhas = set(falhas)
+        self.chamadas = 0
+
+    def __call__(self, tickers, period=None, interval='1d', start=None, **kwargs):
+        self.chamadas += 1
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        atraso = max((self.atrasos.get(t, 0) for t in tickers), default=0)
+        if atraso:
+            threading.Event().wait(atraso)  # time.sleep é neutralizado no ambiente isolado
+        if self.falhas & set(tickers):
+            raise ConnectionError(f"fonte sintética indisponível: {sorted(self.falhas & set(tickers))}")
+        return pd.concat([self._gerar(ticker, period, interval, start) for ticker in tickers], axis=1)
+
+    def _gerar(self, ticker, period, interval, start):
+        duracao = main.DURACAO_BARRA[interval]
+        fim = main.relogio.timestamp("UTC").floor(duracao if duracao < pd.Timedelta(days=1) else 'D')
+        if start is not None:
+            n = int((fim - pd.Timestamp(start).tz_convert('UTC')) / duracao) + 1
+        else:
+            n = int(pd.Timedelta(days=main._periodo_em_dias(period)) / duracao)
+        semente = zlib.crc32(f"{self.seed}|{ticker}|{interval}|{n}".encode())
+        df = gerar_ohlcv(max(n, 1), FREQUENCIAS[interval], semente, fim)
+        df.columns = pd.MultiIndex.from_product([df.columns, [ticker]])
+        return df
+
+
+@contextlib.contextmanager
+def ambiente_isolado(fonte):
+    """Troca Yahoo, esperas, Telegram, git e armazenamento por stubs locais."""
+    originais = {
+        'download': main.yf.download,
+        'sleep': time.sleep,
+        'telegram': main.enviar_telegram,
+        'enfileirar': main.sincronizador_git.enfileirar,
+        'armazem': main.armazem_sinais,
+        'cache_dir': main.CACHE_DIR,
+        'saude': main.saude_fontes,
+    }
+    diretorio = tempfile.mkdtemp(prefix="bench_")
+    main.yf.download = fonte
+    time.sleep = lambda segundos: None
+    main.enviar_telegram = lambda msg, **kwargs: None
+    main.sincronizador_git.enfileirar = lambda linha, mensagem: None
+    main.armazem_sinais = main.ArmazemSinais(":memory:")
+    main.CACHE_DIR = diretorio
+    main.saude_fontes = main.SaudeFontes()
+    try:
+        yield
+    finally:
+        # O download que perdeu para o hedge continua e grava no cache: espera antes de devolver o CACHE_DIR
+        main.aguardar_tentativas()
+        main.yf.download = originais['download']
+        time.sleep = originais['sleep']
+        main.enviar_telegram = originais['telegram']
+        main.sincronizador_git.enfileirar = originais['enfileirar']
+        main.armazem_sinais = originais['armazem']
+        main.CACHE_DIR = originais['cache_dir']
+        main.saude_fontes = originais['saude']
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def limpar_estado():
+    main._cache_barras.clear()
+    main._indicadores.clear()
+    main._ultimo_ciclo.clear()
+    main._indices_zonas.clear()
+    main._indices_zonas_alterados.clear()
+    # Inclui o arquivo histórico (CACHE_DIR/historico): o ciclo frio parte do zero
+    shutil.rmtree(main.CACHE_DIR, ignore_errors=True)
+    os.makedirs(main.CACHE_DIR, exist_ok=True)
+
+
+# ===========================
+# ⏱️ MEDIÇÃO
+# ===========================
+def medir(func, repeticoes, preparar=None):
+    tempos = []
+    for _ in range(repeticoes):
+        if preparar is not None:
+            preparar()
+        with contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            func()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    return {
+        'mediana_ms': round(statistics.median(tempos), 3),
+        'min_ms': round(min(tempos), 3),
+        'max_ms': round(max(tempos), 3),
+        'repeticoes': repeticoes,
+    }
+
+
+def executar_benchmarks(barras=20_000, repeticoes=5, seed=42, processos=0):
+    fonte = FonteSintetica(seed)
+    resultados = {}
+    motor_original = main.motor_analise
+    main.motor_analise = main.MotorAnalise(processos)
+    if main.motor_analise.ativo:
+        # Como em loop_monitoramento: os workers sobem antes do primeiro ciclo medido
+        resultados['aquecimento_motor'] = medir(main.motor_analise.aquecer, 1)
+    with ambiente_isolado(fonte):
+        df = main.normalizar_colunas(gerar_ohlcv(barras, seed=seed))
+        zonas = main.detectar_zonas(df)
+
+        resultados['detectar_zonas'] = medir(lambda: main.detectar_zonas(df), repeticoes)
+        resultados['detectar_padroes_zona'] = medir(lambda: main.detectar_padroes_zona(df, zonas, 'M15'), repeticoes)
+        resultados['indicadores_lote'] = medir(lambda: main.calcular_indicadores(df.copy()), repeticoes)
+
+        indice = main.IndiceZonas()
+        for i, (tf, janela) in enumerate((('W1', 7), ('D1', 5), ('H4', 3)) * 20):
+            indice.atualizar(tf, main.detectar_zonas(df.iloc[i * 300:i * 300 + 20_000 // 3], window=janela))
+        precos = df['close'].to_numpy()[::20]
+        resultados['indice_zonas_consultas'] = medir(
+            lambda: [main.zonas_de_referencia(indice, preco) for preco in precos], repeticoes)
+        resultados['indice_zonas_consultas']['zonas'] = len(indice)
+        resultados['indice_zonas_consultas']['consultas'] = len(precos)
+
+        main.indicadores_ultima_barra(df.iloc[:-1], 'BENCH', 'm15')
+        resultados['indicadores_incremental'] = medir(
+            lambda: main.indicadores_ultima_barra(df, 'BENCH', 'm15'), repeticoes)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            tfs = {**main.TIMEFRAMES_ESTRUTURAIS, **main.TIMEFRAMES_INDICADORES}
+            barras_ciclo = main.baixar_timeframes(tfs)[main.NAME]
+            zonas_estruturais = main.analisar_zonas_estruturais(barras_ciclo)
+        dados = {}
+        for key in main.TIMEFRAMES_INDICADORES:
+            linha = main.calcular_indicadores(barras_ciclo[key][0].copy()).iloc[-1].copy()
+            linha['divergencia'] = None
+            dados[key] = linha
+        m15 = dados['m15']
+        resultados['montar_mensagem'] = medir(lambda: main.montar_mensagem(
+            dados, zonas_estruturais, main.SINAIS_TEXTO[main.SINAL_COMPRA], {'confianca': 'alta'},
+            True, True, m15['low'] * 0.995, m15['high'] * 1.005), repeticoes)
+
+        resultados['ciclo_frio'] = medir(main.analisar_xauusd, repeticoes, preparar=limpar_estado)
+        chamadas = fonte.chamadas
+        resultados['ciclo_quente'] = medir(main.analisar_xauusd, repeticoes, preparar=main._ultimo_ciclo.clear)
+        resultados['ciclo_quente']['downloads_por_ciclo'] = (fonte.chamadas - chamadas) / repeticoes
+        resultados['ciclo_sem_mudanca'] = medir(main.analisar_xauusd, repeticoes)
+
+        watchlist = {f"ATIVO{i:02d}": [f"SINT{i:02d}"] for i in range(20)}
+        chamadas = fonte.chamadas
+        resultados['ciclo_watchlist_frio'] = medir(lambda: main.analisar_watchlist(watchlist), repeticoes,
+                                                   preparar=limpar_estado)
+        resultados['ciclo_watchlist_frio']['downloads_por_ciclo'] = (fonte.chamadas - chamadas) / repeticoes
+    main.motor_analise.encerrar()
+    main.motor_analise = motor_original
+
+    # Principal lento: o hedge entrega o fallback em ~HEDGE_APOS
+    lenta = FonteSintetica(seed, atrasos={main.SYMBOLS[0]: 1.0})
+    hedge_original = main.HEDGE_APOS
+    main.HEDGE_APOS = 0.1
+    with ambiente_isolado(lenta):
+        resultados['download_hedge'] = medir(lambda: main.download_robusto('5d', '15m'), repeticoes,
+                                             preparar=limpar_estado)
+    main.HEDGE_APOS = hedge_original
+
+    return {
+        'gerado_em': pd.Timestamp.now(tz='UTC').isoformat(),
+        'ambiente': {'python': platform.python_version(), 'pandas': pd.__version__,
+                     'numpy': np.__version__, 'maquina': platform.machine()},
+        'parametros': {'barras': barras, 'repeticoes': repeticoes, 'seed': seed, 'processos': processos},
+        'resultados': resultados,
+    }
+
+
+def verificar_limites(relatorio, limites):
+    """Lista de regressões: medianas acima do limite (ms) definido para cada benchmark."""
+    regressoes = []
+    for nome, limite in limites.items():
+        medido = relatorio['resultados'].get(nome)
+        if medido is not None and medido['mediana_ms'] > limite:
+            regressoes.append({'benchmark': nome, 'mediana_ms': medido['mediana_ms'], 'limite_ms': limite})
+    return regressoes
+
+
+# ===========================
+# ▶️ EXECUTAR
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do ciclo de análise com dados sintéticos")
+    parser.add_argument("--barras", type=int, default=20_000, help="barras da série usada nos micro-benchmarks")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--processos", type=int, default=0, help="workers do motor de análise (0 = no processo)")
+    parser.add_argument("--saida", help="grava o relatório JSON neste arquivo")
+    parser.add_argument("--limites", default=LIMITES_PADRAO, help="JSON {benchmark: mediana máxima em ms}")
+    args = parser.parse_args()
+
+    relatorio = executar_benchmarks(args.barras, args.repeticoes, args.seed, args.processos)
+    if os.path.exists(args.limites):
+        with open(args.limites) as f:
+            relatorio['regressoes'] = verificar_limites(relatorio, json.load(f))
+
+    saida = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w") as f:
+            f.write(saida)
+    print(saida)
+    sys.exit(1 if relatorio.get('regressoes') else 0)
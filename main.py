@@ -6,10 +6,26 @@ import requests
 import time
 from datetime import datetime
 import os
+import re
+import json
+import bisect
+import hashlib
+import math
+import queue
+import random
+import sys
 import warnings
+import shutil
 import subprocess
-from threading import Thread
-from flask import Flask, jsonify
+import tempfile
+import sqlite3
+from threading import Thread, Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context, shared_memory
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from flask import Flask, Response, request
 
 # Suprimir warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -21,269 +37,2685 @@ np.NaN = np.nan
 SYMBOLS = ["GC=F", "XAUUSD=X"]  # Fallback
 NAME = "XAUUSD"
 CHECK_INTERVAL = 15 * 60  # 15 minutos
+AGENDAR_POR_FECHAMENTO = os.getenv("AGENDAR_POR_FECHAMENTO", "1") == "1"  # acorda no fechamento da barra M15
+GRACA_FECHAMENTO = int(os.getenv("GRACA_FECHAMENTO", 20))  # segundos após o fechamento, até o Yahoo publicar a barra
 CSV_FILE = "sinais_xauusd.csv"
+SINAIS_DB = os.getenv("SINAIS_DB", "sinais_xauusd.db")
+
+# 📋 Watchlist: {nome: [ticker principal, fallbacks...]} (JSON em WATCHLIST_ARQUIVO)
+WATCHLIST_ARQUIVO = os.getenv("WATCHLIST_ARQUIVO", "")
+TAMANHO_LOTE = int(os.getenv("TAMANHO_LOTE", 50))  # tickers por chamada ao yf.download
+
+
+def _carregar_watchlist():
+    if WATCHLIST_ARQUIVO and os.path.exists(WATCHLIST_ARQUIVO):
+        with open(WATCHLIST_ARQUIVO) as f:
+            return {nome: list(tickers) for nome, tickers in json.load(f).items()}
+    return {NAME: SYMBOLS}
+
+
+WATCHLIST = _carregar_watchlist()
 
 # 📞 Telegram
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")  # aponte para um servidor local nos testes
+TELEGRAM_TAXA = float(os.getenv("TELEGRAM_TAXA", 0.5))  # mensagens por segundo no chat
+TELEGRAM_RAJADA = int(os.getenv("TELEGRAM_RAJADA", 3))
+TELEGRAM_JANELA_LOTE = float(os.getenv("TELEGRAM_JANELA_LOTE", 2))  # segundos para juntar relatórios do ciclo
+TELEGRAM_LIMITE_TEXTO = 4096
+
+# 🌐 GitHub (para salvar o CSV)
+GITHUB_REPO_URL = f"https://{os.getenv('GITHUB_TOKEN')}@github.com/carpatia77/bwsystem-railway.git"
+GITHUB_BRANCH = "main"
+GIT_SYNC_JANELA = int(os.getenv("GIT_SYNC_JANELA", 60 * 60))  # agrupa sinais em um commit por janela
+GIT_SYNC_MAX_LINHAS = int(os.getenv("GIT_SYNC_MAX_LINHAS", 20))  # ...ou a cada N sinais
+
+# 🗄️ Cache de barras (OHLCV)
+CACHE_DIR = os.getenv("CACHE_DIR", "cache_barras")
+CACHE_TTL_MAX = int(os.getenv("CACHE_TTL_MAX", 10 * 60))  # mantém a barra em formação atualizada
+MAX_BARRAS_BUFFER = int(os.getenv("MAX_BARRAS_BUFFER", 20000))  # teto de barras guardadas por (ticker, intervalo)
+ARQUIVAR_HISTORICO = os.getenv("ARQUIVAR_HISTORICO", "1") == "1"  # histórico só-acréscimo para backtest/otimizador
+
+# ⚡ Downloads concorrentes
+MAX_DOWNLOADS_CONCORRENTES = int(os.getenv("MAX_DOWNLOADS_CONCORRENTES", 4))
+PRAZO_CICLO = int(os.getenv("PRAZO_CICLO", 5 * 60))  # segundos por ciclo
+PRAZO_DOWNLOAD = int(os.getenv("PRAZO_DOWNLOAD", 90))  # teto de cada download_robusto, com retries e esperas
+
+# 🩺 Saúde das fontes
+CIRCUITO_FALHAS = int(os.getenv("CIRCUITO_FALHAS", 3))  # falhas seguidas que tiram o ticker da rota
+CIRCUITO_PAUSA = int(os.getenv("CIRCUITO_PAUSA", 5 * 60))  # dobra a cada reincidência, até 1h
+HEDGE_APOS = float(os.getenv("HEDGE_APOS", 8))  # segundos até disparar o fallback em paralelo (0 = desligado)
+
+# 🕒 Timeframes de cada etapa da análise
+TIMEFRAMES_ESTRUTURAIS = {
+    'W1': {'interval': '1wk', 'period': '5y', 'nome': 'W1'},
+    'D1': {'interval': '1d', 'period': '2y', 'nome': 'D1'},
+    'H4': {'interval': '4h', 'period': '6mo', 'nome': 'H4'}
+}
+TIMEFRAMES_INDICADORES = {
+    'w1': {'interval': '1wk', 'period': '5y', 'nome': 'W1'},
+    'd1': {'interval': '1d', 'period': '3mo', 'nome': 'D1'},
+    'h4': {'interval': '4h', 'period': '3mo', 'nome': 'H4'},
+    'm15': {'interval': '15m', 'period': '6d', 'nome': 'M15'}
+}
+TIMEFRAMES_OBRIGATORIOS = ('d1', 'h4', 'm15')  # W1 é opcional
+
+# 🧱 Índice de zonas (todos os swings de W1/D1/H4, persistidos em CACHE_DIR)
+TOLERANCIA_CONFLUENCIA = float(os.getenv("TOLERANCIA_CONFLUENCIA", 0.002))  # ±0,2% do preço
+PESOS_CONFLUENCIA = {'W1': 3, 'D1': 2, 'H4': 1}
+# "recente": último suporte/resistência do H4 (igual ao backtest); "indice": zona mais próxima do preço
+ZONA_REFERENCIA = os.getenv("ZONA_REFERENCIA", "recente")
+
+# 🌐 Servidor web (waitress; cada cliente do /stream ocupa uma thread)
+PORTA_WEB = 8080
+WEB_THREADS = int(os.getenv("WEB_THREADS", 32))
+# Cada cliente do /stream prende uma thread enquanto está conectado: o resto fica para /status e /metrics
+MAX_ASSINANTES_STREAM = max(1, min(int(os.getenv("MAX_ASSINANTES_STREAM", WEB_THREADS - 8)), WEB_THREADS - 1))
+
+# 📏 Métricas (/metrics)
+METRICAS_ATIVAS = os.getenv("METRICAS_ATIVAS", "1") == "1"
+
+# 🧮 Motor de análise em processos (0/1 = no próprio processo)
+PROCESSOS_ANALISE = int(os.getenv("PROCESSOS_ANALISE", 0))
+
+# 🔄 Reamostragem local (H4/D1 a partir de 1h, W1 a partir de 1d)
+MODO_REAMOSTRAGEM = os.getenv("MODO_REAMOSTRAGEM", "0") == "1"
+SESSAO_TZ = "America/New_York"
+SESSAO_INICIO_HORA = 18  # sessão do COMEX abre às 18:00 (NY)
+REAMOSTRAGEM = {
+    '4h': {'base': '1h', 'periodo_base': '720d', 'regra': '4h'},
+    '1d': {'base': '1h', 'periodo_base': '720d', 'regra': '1D'},
+    '1wk': {'base': '1d', 'periodo_base': '5y', 'regra': 'W-MON'},
+}
+
+# ===========================
+# ⏱️ RELÓGIO (INJETÁVEL)
+# ===========================
+class Relogio:
+    """Relógio do sistema. O ciclo consulta a hora e espera sempre por aqui."""
+
+    def time(self):
+        return time.time()
+
+    def agora(self):
+        return datetime.fromtimestamp(self.time())
+
+    def timestamp(self, tz=None):
+        return pd.Timestamp.fromtimestamp(self.time(), tz=tz)
+
+    def dormir(self, segundos):
+        time.sleep(segundos)
+
+
+class RelogioSimulado(Relogio):
+    """Só anda quando alguém dorme: esperas instantâneas e execução determinística."""
+
+    def __init__(self, inicio):
+        self._agora = float(inicio)
+
+    def time(self):
+        return self._agora
+
+    def dormir(self, segundos):
+        self._agora += max(0.0, segundos)
+
+    def avancar_para(self, instante):
+        self._agora = max(self._agora, float(instante))
+
+
+relogio = Relogio()
+
+# ===========================
+# 📏 MÉTRICAS (FORMATO PROMETHEUS)
+# ===========================
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+DESCRICAO_METRICAS = {
+    'bw_ciclo_duracao_segundos': ('histogram', 'Duração de um ciclo completo de análise'),
+    'bw_etapa_duracao_segundos': ('histogram', 'Tempo gasto em cada etapa do ciclo'),
+    'bw_download_duracao_segundos': ('histogram', 'Latência de cada tentativa de download'),
+    'bw_download_tentativas_total': ('counter', 'Tentativas de download por intervalo e ticker'),
+    'bw_download_falhas_total': ('counter', 'Tentativas de download que levantaram erro'),
+    'bw_download_fallback_total': ('counter', 'Downloads resolvidos por um ticker de fallback'),
+    'bw_http_erros_total': ('counter', 'Respostas HTTP 429/5xx recebidas do Yahoo'),
+    'bw_circuito_aberto_total': ('counter', 'Vezes em que um ticker saiu da rota pelo disjuntor'),
+    'bw_download_hedge_total': ('counter', 'Pedidos em paralelo ao fallback por latência alta'),
+    'bw_cache_acessos_total': ('counter', 'Consultas ao cache de barras por resultado'),
+    'bw_telegram_duracao_segundos': ('histogram', 'Latência de envio ao Telegram'),
+    'bw_telegram_falhas_total': ('counter', 'Envios ao Telegram que falharam'),
+    'bw_telegram_suprimidos_total': ('counter', 'Relatórios iguais ao último enviado, descartados'),
+    'bw_telegram_limitados_total': ('counter', 'Respostas 429 do Telegram (retry_after respeitado)'),
+    'bw_telegram_lotes_total': ('counter', 'Mensagens entregues, cada uma com um ou mais relatórios'),
+    'bw_git_sync_duracao_segundos': ('histogram', 'Duração de cada sincronização com o GitHub'),
+    'bw_git_sync_falhas_total': ('counter', 'Sincronizações com o GitHub que falharam'),
+    'bw_ciclos_sem_mudanca_total': ('counter', 'Análises puladas porque nenhuma barra mudou'),
+    'bw_timeframes_reaproveitados_total': ('counter', 'Zonas de timeframes inalterados reaproveitadas'),
+    'bw_stream_recusados_total': ('counter', 'Conexões ao /stream recusadas (503) por excesso de assinantes'),
+}
+
+
+class Metricas:
+    """Contadores e histogramas em memória, exportados no formato texto do Prometheus."""
+
+    def __init__(self, ativas=True, buckets=BUCKETS_PADRAO):
+        self.ativas = ativas
+        self.buckets = buckets
+        self._contadores = {}
+        self._histogramas = {}
+        self._lock = Lock()
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        if not self.ativas:
+            return
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        if not self.ativas:
+            return
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            contagens, soma, total = self._histogramas.get(chave, ([0] * len(self.buckets), 0.0, 0))
+            contagens = [c + (valor <= limite) for c, limite in zip(contagens, self.buckets)]
+            self._histogramas[chave] = (contagens, soma + valor, total + 1)
+
+    def medir(self, nome, **rotulos):
+        """Context manager que observa a duração do bloco (nulo se desativadas)."""
+        if not self.ativas:
+            return nullcontext()
+        return self._medir(nome, rotulos)
+
+    @contextmanager
+    def _medir(self, nome, rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def cronometrar(self, nome, **rotulos):
+        """Decorator equivalente a medir()."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.medir(nome, **rotulos):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def exportar(self):
+        def formatar(rotulos, extra=()):
+            pares = list(rotulos) + list(extra)
+            if not pares:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pares) + "}"
+
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = dict(self._histogramas)
+        linhas = []
+        nomes = sorted({nome for nome, _ in contadores} | {nome for nome, _ in histogramas})
+        for nome in nomes:
+            tipo, descricao = DESCRICAO_METRICAS.get(nome, ('untyped', nome))
+            linhas.append(f"# HELP {nome} {descricao}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for (n, rotulos), valor in sorted(contadores.items()):
+                if n == nome:
+                    linhas.append(f"{nome}{formatar(rotulos)} {valor}")
+            for (n, rotulos), (contagens, soma, total) in sorted(histogramas.items()):
+                if n != nome:
+                    continue
+                for limite, contagem in zip(self.buckets, contagens):
+                    linhas.append(f"{nome}_bucket{formatar(rotulos, [('le', limite)])} {contagem}")
+                linhas.append(f"{nome}_bucket{formatar(rotulos, [('le', '+Inf')])} {total}")
+                linhas.append(f"{nome}_sum{formatar(rotulos)} {soma}")
+                linhas.append(f"{nome}_count{formatar(rotulos)} {total}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas(ativas=METRICAS_ATIVAS)
+
+# ===========================
+# 🌐 SERVIDOR WEB LEVE (Flask)
+# ===========================
+app = Flask(__name__)
+
+
+def _json_float(valor):
+    """float JSON-seguro (NaN/None viram null)."""
+    if valor is None:
+        return None
+    valor = float(valor)
+    return None if math.isnan(valor) else valor
+
+
+class EstadoPublicado:
+    """
+    Último estado publicado pelo ciclo de análise: sinal, indicadores por
+    timeframe e zonas de cada ativo. O JSON e o ETag são gerados na
+    publicação, então /status responde em O(1); cada publicação também é
+    entregue às filas dos assinantes do /stream.
+    """
+
+    def __init__(self, extras=None, max_fila=100, max_assinantes=None):
+        self.extras = extras  # campos calculados na publicação (ex.: saúde das fontes)
+        self.max_fila = max_fila
+        self.max_assinantes = max_assinantes
+        self._ativos = {}
+        self._corpo = None
+        self._etag = None
+        self._versao = 0
+        self._assinantes = set()
+        self._lock = Lock()
+
+    def _serializar(self, ativos):
+        principal = ativos.get(NAME) or next(iter(ativos.values()), None)
+        estado = {"status": "running", "last_signal": principal['sinal'] if principal else "Aguardando sinal"}
+        if principal:
+            estado.update(price=principal['preco'], timestamp=principal['timestamp'])
+        estado['instruments'] = ativos
+        if self.extras is not None:
+            estado.update(self.extras())
+        corpo = json.dumps(estado, ensure_ascii=False, default=str)
+        return corpo, hashlib.sha1(corpo.encode()).hexdigest()[:20]
+
+    def publicar(self, nome, dados):
+        self.publicar_lote({nome: dados})
+
+    def publicar_lote(self, itens):
+        """
+        Publica vários ativos ({nome: dados}) de uma vez: o JSON e o ETag são
+        gerados uma vez por lote, fora do lock que o /status usa; cada ativo
+        continua virando um evento do /stream.
+        """
+        if not itens:
+            return
+        eventos = [json.dumps({'instrument': nome, **dados}, ensure_ascii=False, default=str)
+                   for nome, dados in itens.items()]
+        with self._lock:
+            self._ativos.update(itens)
+            ativos = dict(self._ativos)
+            self._versao += 1
+            versao = self._versao
+            for fila in self._assinantes:
+                for evento in eventos:
+                    if fila.full():
+                        # Assinante lento perde o evento mais antigo, não trava o ciclo
+                        try:
+                            fila.get_nowait()
+                        except queue.Empty:
+                            pass
+                    fila.put_nowait(evento)
+        corpo, etag = self._serializar(ativos)
+        with self._lock:
+            # Uma publicação mais nova pode ter terminado antes: não a sobrescreve
+            if self._versao == versao:
+                self._corpo, self._etag = corpo, etag
+
+    def snapshot(self):
+        """(json, etag) do último estado."""
+        with self._lock:
+            if self._corpo is None:
+                self._corpo, self._etag = self._serializar(dict(self._ativos))
+            return self._corpo, self._etag
+
+    def assinar(self):
+        """Fila de eventos de um novo assinante, ou None se já há max_assinantes conectados."""
+        fila = queue.Queue(maxsize=self.max_fila)
+        with self._lock:
+            if self.max_assinantes is not None and len(self._assinantes) >= self.max_assinantes:
+                return None
+            self._assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    @property
+    def assinantes(self):
+        return len(self._assinantes)
+
+
+def memoria_residente():
+    """(RSS atual, pico de RSS) em bytes; None onde o sistema não informa."""
+    atual = pico = None
+    try:
+        with open('/proc/self/statm') as f:
+            atual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        pico *= 1 if sys.platform == 'darwin' else 1024  # KiB no Linux
+    except ImportError:
+        pass
+    return atual, pico
+
+
+def relatorio_memoria():
+    """Memória do processo e do estado mantido entre ciclos (publicado no /status)."""
+    mb = lambda valor: round(valor / 2**20, 1) if valor is not None else None
+    atual, pico = memoria_residente()
+    buffers = [entrada['barras'] for entrada in list(_cache_barras.values())]
+    return {
+        'rss_mb': mb(atual),
+        'rss_pico_mb': mb(pico),
+        'barras': {'series': len(buffers), 'linhas': sum(len(b) for b in buffers),
+                   'mb': mb(sum(b.nbytes for b in buffers))},
+        'indicadores': len(_indicadores),
+        'zonas': sum(len(indice) for indice in list(_indices_zonas.values())),
+    }
+
+
+estado_publicado = EstadoPublicado(extras=lambda: {"sources": saude_fontes.resumo(), "memory": relatorio_memoria()},
+                                   max_assinantes=MAX_ASSINANTES_STREAM)
+
+
+@app.route('/')
+def home():
+    return "<h1>🧠 Brandon Wendell System - GitHub Sync</h1><p>Status: Em execução</p>"
+
+@app.route('/status')
+def status():
+    corpo, etag = estado_publicado.snapshot()
+    resposta = Response(corpo, mimetype="application/json")
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
+
+@app.route('/stream')
+def stream():
+    """Server-sent events: um evento 'sinal' por ativo analisado (até MAX_ASSINANTES_STREAM clientes)."""
+    fila = estado_publicado.assinar()
+    if fila is None:
+        metricas.incrementar('bw_stream_recusados_total')
+        return Response(json.dumps({"error": "limite de assinantes do /stream atingido"}), status=503,
+                        mimetype="application/json", headers={'Retry-After': '30'})
+
+    def eventos():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento = fila.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: sinal\ndata: {evento}\n\n"
+        finally:
+            estado_publicado.cancelar(fila)
+
+    resposta = Response(eventos(), mimetype="text/event-stream",
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Libera a vaga mesmo se o cliente cair antes do primeiro evento (o gerador nem chega a rodar)
+    resposta.call_on_close(lambda: estado_publicado.cancelar(fila))
+    return resposta
+
+@app.route('/metrics')
+def metrics():
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+# ===========================
+# 📡 FUNÇÕES DE APOIO
+# ===========================
+class BaldeTokens:
+    """Limite de taxa: `taxa` envios por segundo, com rajadas de até `capacidade`."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = float(capacidade)
+        self.atualizado = time.monotonic()
+        self.bloqueado_ate = 0.0
+
+    def bloquear(self, segundos):
+        """Pausa todos os envios (ex.: retry_after do Telegram)."""
+        self.bloqueado_ate = max(self.bloqueado_ate, time.monotonic() + segundos)
+        self.tokens = 0.0
+        self.atualizado = self.bloqueado_ate
+
+    def aguardar(self):
+        while True:
+            agora = time.monotonic()
+            if agora < self.bloqueado_ate:
+                time.sleep(self.bloqueado_ate - agora)
+                continue
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.taxa)
+
+
+class NotificadorTelegram:
+    """
+    Entrega as mensagens fora do ciclo de análise, numa sessão HTTP
+    keep-alive. Relatórios que chegam juntos são agrupados em uma mensagem;
+    o envio respeita um balde de tokens e o retry_after dos 429; um
+    relatório igual ao último da mesma chave (ex.: o mesmo sinal do mesmo
+    ativo) é descartado.
+    """
+
+    def __init__(self, token=TELEGRAM_TOKEN, chat_id=TELEGRAM_CHAT_ID, base_url=TELEGRAM_API_URL,
+                 taxa=TELEGRAM_TAXA, rajada=TELEGRAM_RAJADA, janela_lote=TELEGRAM_JANELA_LOTE, max_tentativas=5):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url.rstrip('/')
+        self.janela_lote = janela_lote
+        self.max_tentativas = max_tentativas
+        self.balde = BaldeTokens(taxa, rajada)
+        self.sessao = requests.Session()
+        self.fila = queue.Queue()
+        self._ultimos = {}  # chave -> hash do último conteúdo enfileirado
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def ativo(self):
+        return bool(self.token and self.chat_id)
+
+    def enviar(self, msg, chave=None, conteudo=None):
+        """
+        Enfileira msg. Com chave, o hash de conteudo (ou da própria msg) é
+        comparado ao último da mesma chave; se for igual, nada é enviado.
+        Retorna False quando a mensagem é descartada.
+        """
+        if not self.ativo:
+            print("ℹ️ Telegram desativado")
+            return False
+        assinatura = None
+        if chave is not None:
+            assinatura = hashlib.sha256((conteudo if conteudo is not None else msg).encode()).hexdigest()
+            with self._lock:
+                if self._ultimos.get(chave) == assinatura:
+                    metricas.incrementar('bw_telegram_suprimidos_total')
+                    print(f"🔕 Telegram: {chave} sem mudança, relatório não reenviado")
+                    return False
+                self._ultimos[chave] = assinatura
+        self.iniciar()
+        self.fila.put((msg, chave, assinatura))
+        return True
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._executar, daemon=True, name="telegram")
+            self._thread.start()
+
+    def parar(self, timeout=None):
+        """Entrega o que estiver na fila e encerra o worker."""
+        self.fila.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _executar(self):
+        encerrar = False
+        while not encerrar:
+            item = self.fila.get()
+            if item is None:
+                break
+            lote = [item]
+            # Junta o que chegar na janela (os relatórios de um mesmo ciclo)
+            limite = time.monotonic() + self.janela_lote
+            while True:
+                try:
+                    item = self.fila.get(timeout=max(0, limite - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    encerrar = True
+                    break
+                lote.append(item)
+            for partes in self._agrupar(lote):
+                if not self._entregar("\n\n".join(msg for msg, _, _ in partes)):
+                    self._esquecer(partes)
+
+    @staticmethod
+    def _agrupar(lote):
+        """Divide o lote em mensagens de até TELEGRAM_LIMITE_TEXTO caracteres, sem cortar relatórios."""
+        grupos, atual, tamanho = [], [], 0
+        for item in lote:
+            extra = len(item[0]) + (2 if atual else 0)
+            if atual and tamanho + extra > TELEGRAM_LIMITE_TEXTO:
+                grupos.append(atual)
+                atual, tamanho, extra = [], 0, len(item[0])
+            atual.append(item)
+            tamanho += extra
+        if atual:
+            grupos.append(atual)
+        return grupos
+
+    def _esquecer(self, partes):
+        """Relatórios não entregues voltam a ser elegíveis no próximo ciclo."""
+        with self._lock:
+            for _, chave, assinatura in partes:
+                if chave is not None and self._ultimos.get(chave) == assinatura:
+                    del self._ultimos[chave]
+
+    def _entregar(self, texto):
+        url = f"{self.base_url}/bot{self.token}/sendMessage"
+        data = {"chat_id": self.chat_id, "text": texto, "parse_mode": "HTML"}
+        resposta = None
+        for tentativa in range(self.max_tentativas):
+            self.balde.aguardar()
+            try:
+                with metricas.medir('bw_telegram_duracao_segundos'):
+                    resposta = self.sessao.post(url, data=data, timeout=10)
+            except Exception as e:
+                print(f"❌ Falha ao enviar Telegram ({tentativa+1}/{self.max_tentativas}): {e}")
+                time.sleep(min(2 ** tentativa + random.uniform(0, 1), 60))
+                continue
+            if resposta.ok:
+                metricas.incrementar('bw_telegram_lotes_total')
+                print("✅ Telegram enviado")
+                return True
+            if resposta.status_code == 429:
+                try:
+                    espera = float(resposta.json().get('parameters', {}).get('retry_after', 1))
+                except ValueError:
+                    espera = float(resposta.headers.get('Retry-After', 1))
+                metricas.incrementar('bw_telegram_limitados_total')
+                print(f"⏳ Telegram limitou o envio, aguardando {espera:.0f}s")
+                self.balde.bloquear(espera)
+                continue
+            if resposta.status_code < 500:
+                break  # erro do pedido (ex.: HTML inválido): repetir não resolve
+            print(f"❌ Telegram respondeu {resposta.status_code} ({tentativa+1}/{self.max_tentativas})")
+            time.sleep(min(2 ** tentativa + random.uniform(0, 1), 60))
+        metricas.incrementar('bw_telegram_falhas_total')
+        print(f"❌ Telegram não entregou a mensagem ({resposta.status_code if resposta is not None else 'sem resposta'})")
+        return False
+
+
+notificador_telegram = NotificadorTelegram()
+
+
+def enviar_telegram(msg, chave=None, conteudo=None):
+    return notificador_telegram.enviar(msg, chave, conteudo)
+
+# ===========================
+# 💾 ARMAZÉM DE SINAIS (SQLite)
+# ===========================
+CABECALHO_CSV = "timestamp,symbol,preco,sinal,tendencia,rsi_m15,stop_loss,zona_tipo,confianca\n"
+COLUNAS_SINAIS = ('timestamp', 'symbol', 'preco', 'sinal', 'tendencia', 'rsi_m15', 'stop_loss', 'zona_tipo', 'confianca')
+
+
+def _formatar_linha_csv(sinal):
+    stop_loss_str = f"{sinal['stop_loss']:.2f}" if sinal['stop_loss'] is not None else "N/A"
+    row = f"{sinal['timestamp']},{sinal['symbol']},{sinal['preco']:.2f},"
+    row += f"{sinal['sinal']},{sinal['tendencia']},{sinal['rsi_m15']:.2f},"
+    row += f"{stop_loss_str},{sinal['zona_tipo']},{sinal['confianca']}\n"
+    return row
+
+
+class ArmazemSinais:
+    """
+    Sinais em SQLite (modo WAL), indexados por timestamp e por
+    (symbol, timestamp): inserção O(1), último sinal e consultas por
+    intervalo em O(log n). O CSV passa a ser apenas uma exportação.
+    """
+
+    def __init__(self, caminho=SINAIS_DB):
+        self.caminho = caminho
+        self._conexao = None
+        self._lock = Lock()
+
+    def _conectar(self):
+        if self._conexao is None:
+            self._conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conexao.row_factory = sqlite3.Row
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS sinais (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    symbol TEXT NOT NULL,
+                    preco REAL,
+                    sinal TEXT,
+                    tendencia TEXT,
+                    rsi_m15 REAL,
+                    stop_loss REAL,
+                    zona_tipo TEXT,
+                    confianca TEXT,
+                    UNIQUE (symbol, timestamp)
+                );
+                CREATE INDEX IF NOT EXISTS idx_sinais_timestamp ON sinais (timestamp);
+            """)
+        return self._conexao
+
+    def inserir(self, sinal):
+        valores = tuple(sinal.get(coluna) for coluna in COLUNAS_SINAIS)
+        with self._lock:
+            conexao = self._conectar()
+            conexao.execute(
+                f"INSERT OR IGNORE INTO sinais ({', '.join(COLUNAS_SINAIS)}) VALUES ({', '.join('?' * len(COLUNAS_SINAIS))})",
+                valores)
+            conexao.commit()
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return [dict(linha) for linha in self._conectar().execute(sql, parametros)]
+
+    def ultimo(self, symbol=None):
+        if symbol is None:
+            linhas = self._consultar("SELECT * FROM sinais ORDER BY timestamp DESC LIMIT 1")
+        else:
+            linhas = self._consultar(
+                "SELECT * FROM sinais WHERE symbol = ? ORDER BY timestamp DESC LIMIT 1", (symbol,))
+        return linhas[0] if linhas else None
+
+    def intervalo(self, inicio, fim, symbol=None):
+        """Sinais com inicio <= timestamp < fim, em ordem cronológica."""
+        sql = "SELECT * FROM sinais WHERE timestamp >= ? AND timestamp < ?"
+        parametros = [str(pd.Timestamp(inicio)), str(pd.Timestamp(fim))]
+        if symbol is not None:
+            sql += " AND symbol = ?"
+            parametros.append(symbol)
+        return self._consultar(sql + " ORDER BY timestamp", parametros)
+
+    def importar_csv(self, caminho):
+        """Importa o histórico de um CSV no formato antigo (linhas já existentes são ignoradas)."""
+        if not os.path.exists(caminho):
+            return 0
+        log = pd.read_csv(caminho, dtype=str, keep_default_na=False)
+        if log.empty:
+            return 0
+
+        def numero(valor):
+            try:
+                return float(valor)
+            except (TypeError, ValueError):
+                return None
+
+        registros = [tuple(
+            numero(linha[coluna]) if coluna in ('preco', 'rsi_m15', 'stop_loss') else linha[coluna]
+            for coluna in COLUNAS_SINAIS) for _, linha in log.iterrows()]
+        with self._lock:
+            conexao = self._conectar()
+            antes = conexao.total_changes
+            conexao.executemany(
+                f"INSERT OR IGNORE INTO sinais ({', '.join(COLUNAS_SINAIS)}) VALUES ({', '.join('?' * len(COLUNAS_SINAIS))})",
+                registros)
+            conexao.commit()
+            importados = conexao.total_changes - antes
+        if importados:
+            print(f"📥 {importados} sinais importados de {caminho}")
+        return importados
+
+    def exportar_csv(self, caminho):
+        with self._lock:
+            cursor = self._conectar().execute(f"SELECT {', '.join(COLUNAS_SINAIS)} FROM sinais ORDER BY timestamp")
+            with open(caminho + ".tmp", "w") as f:
+                f.write(CABECALHO_CSV)
+                for linha in cursor:
+                    sinal = dict(zip(COLUNAS_SINAIS, linha))
+                    if sinal['preco'] is None or sinal['rsi_m15'] is None:
+                        continue
+                    f.write(_formatar_linha_csv(sinal))
+        os.replace(caminho + ".tmp", caminho)
+
+
+armazem_sinais = ArmazemSinais()
+
+
+# Criar CSV
+def criar_csv():
+    armazem_sinais.importar_csv(CSV_FILE)
+    if not os.path.exists(CSV_FILE):
+        with open(CSV_FILE, "w") as f:
+            f.write(CABECALHO_CSV)
+        print("✅ Arquivo CSV criado")
+        # Commit inicial
+        sincronizador_git.enfileirar(None, "📊 CSV inicial criado")
+
+def salvar_sinal(sinal_data):
+    sinal = {
+        'timestamp': str(pd.Timestamp(relogio.agora())),
+        'symbol': sinal_data['symbol'],
+        'preco': float(sinal_data['preco']),
+        'sinal': sinal_data['sinal'],
+        'tendencia': sinal_data['tendencia'],
+        'rsi_m15': float(sinal_data['rsi_m15']),
+        'stop_loss': float(sinal_data['stop_loss']) if sinal_data['stop_loss'] is not None else None,
+        'zona_tipo': sinal_data.get('zona_tipo', 'N/A'),
+        'confianca': sinal_data.get('confianca', 'N/A')
+    }
+    armazem_sinais.inserir(sinal)
+    print(f"💾 Sinal salvo: {sinal_data['sinal']}")
+    
+    # ✅ Enviar para o GitHub em segundo plano (o CSV é exportado antes do commit)
+    sincronizador_git.enfileirar(_formatar_linha_csv(sinal), f"📊 Sinal gerado: {sinal_data['sinal']} | {sinal_data['preco']:.2f}")
+    return sinal
+
+# ===========================
+# 🔁 SALVAR CSV NO GITHUB (EM SEGUNDO PLANO)
+# ===========================
+class SincronizadorGit:
+    """
+    Recebe os sinais numa fila e os agrupa em um único commit por janela
+    (ou a cada max_linhas sinais). O push acontece fora do loop de análise,
+    com novas tentativas e backoff; a configuração do git é feita uma vez.
+    """
+
+    def __init__(self, arquivo=CSV_FILE, repo_dir='.', remoto=GITHUB_REPO_URL, branch=GITHUB_BRANCH,
+                 janela=GIT_SYNC_JANELA, max_linhas=GIT_SYNC_MAX_LINHAS, max_tentativas=5, preparar=None):
+        self.arquivo = arquivo
+        self.preparar = preparar  # chamado antes do commit (ex.: exportar o CSV)
+        self.repo_dir = repo_dir
+        self.remoto = remoto
+        self.branch = branch
+        self.janela = janela
+        self.max_linhas = max_linhas
+        self.max_tentativas = max_tentativas
+        self.fila = queue.Queue()
+        self._thread = None
+        self._configurado = False
+        self._push_pendente = False
+
+    def enfileirar(self, linha, mensagem):
+        self.fila.put((linha, mensagem))
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self._executar, daemon=True, name="git-sync")
+            self._thread.start()
+
+    def parar(self, timeout=None):
+        """Envia o que estiver pendente e encerra o worker."""
+        self.fila.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _git(self, *args):
+        return subprocess.run(['git', *args], cwd=self.repo_dir, capture_output=True, text=True)
+
+    def _configurar(self):
+        if self._configurado:
+            return
+        if not os.path.exists(os.path.join(self.repo_dir, '.git')):
+            print("⚠️ Diretório .git não encontrado. Clonando o repositório...")
+            subprocess.run(['git', 'clone', self.remoto, self.repo_dir], check=True)
+        self._git('config', 'user.email', 'render@render.com')
+        self._git('config', 'user.name', 'Render Bot')
+        self._configurado = True
+
+    def _executar(self):
+        pendentes = []
+        inicio_janela = None
+        encerrar = False
+        while not encerrar:
+            espera = self.janela if inicio_janela is None else max(0, inicio_janela + self.janela - time.monotonic())
+            try:
+                item = self.fila.get(timeout=espera)
+                if item is None:
+                    encerrar = True
+                else:
+                    pendentes.append(item)
+                    inicio_janela = inicio_janela or time.monotonic()
+            except queue.Empty:
+                pass
+
+            janela_vencida = inicio_janela is not None and time.monotonic() - inicio_janela >= self.janela
+            if pendentes and (encerrar or janela_vencida or len(pendentes) >= self.max_linhas):
+                self.sincronizar(pendentes)
+                pendentes = []
+                inicio_janela = None
+            elif self._push_pendente:
+                self._push()
+
+    def sincronizar(self, pendentes):
+        """Um commit para todos os sinais pendentes (nada é feito se o CSV não mudou)."""
+        inicio = time.monotonic()
+        try:
+            self._configurar()
+            if self.preparar is not None:
+                self.preparar()
+            self._git('add', self.arquivo)
+            if self._git('diff', '--cached', '--quiet', '--', self.arquivo).returncode == 0:
+                print("ℹ️ CSV sem alterações, commit ignorado")
+                return
+            linhas = [linha for linha, _ in pendentes if linha]
+            mensagem = pendentes[-1][1] if len(pendentes) == 1 else \
+                f"📊 {len(linhas)} sinais | último: {pendentes[-1][1]}"
+            resultado = self._git('commit', '-m', mensagem)
+            if resultado.returncode != 0:
+                metricas.incrementar('bw_git_sync_falhas_total', etapa='commit')
+                print(f"❌ Erro no git commit: {resultado.stderr.strip()}")
+                return
+            self._push_pendente = True
+            if not self._push():
+                metricas.incrementar('bw_git_sync_falhas_total', etapa='push')
+        except Exception as e:
+            metricas.incrementar('bw_git_sync_falhas_total', etapa='erro')
+            print(f"❌ Falha ao enviar CSV para o GitHub: {e}")
+        finally:
+            duracao = time.monotonic() - inicio
+            metricas.observar('bw_git_sync_duracao_segundos', duracao)
+            print(f"⏱️ Sincronização git: {duracao:.1f}s")
+
+    def _push(self):
+        for tentativa in range(self.max_tentativas):
+            resultado = self._git('push', self.remoto, f"HEAD:{self.branch}")
+            if resultado.returncode == 0:
+                self._push_pendente = False
+                print("✅ CSV enviado para o GitHub com sucesso!")
+                return True
+            espera = min(2 ** tentativa + random.uniform(0, 1), 60)
+            print(f"❌ Erro no git push ({tentativa+1}/{self.max_tentativas}), nova tentativa em {espera:.1f}s")
+            time.sleep(espera)
+        return False
+
+
+sincronizador_git = SincronizadorGit(preparar=lambda: armazem_sinais.exportar_csv(CSV_FILE))
+
+# ===========================
+# 🗄️ CACHE DE BARRAS (OHLCV)
+# ===========================
+DURACAO_BARRA = {
+    '15m': pd.Timedelta(minutes=15),
+    '1h': pd.Timedelta(hours=1),
+    '4h': pd.Timedelta(hours=4),
+    '1d': pd.Timedelta(days=1),
+    '1wk': pd.Timedelta(weeks=1),
+}
+
+COLUNAS_BARRAS = ('open', 'high', 'low', 'close', 'volume')
+REGISTRO_HISTORICO = np.dtype([('tempo', '<i8')] + [(coluna, '<f4') for coluna in COLUNAS_BARRAS])
+
+
+class BufferBarras:
+    """
+    Barras OHLCV de um (ticker, intervalo) com capacidade fixa: instantes em
+    int64 (ns, UTC quando o índice tem fuso) e valores em float32. O
+    armazenamento tem o dobro da capacidade; quando enche, as barras vivas
+    voltam para o início (O(1) amortizado por barra), então a janela é
+    sempre contígua e dataframe() entrega vistas, sem cópia dos valores.
+    As vistas valem até o próximo mesclar() do mesmo buffer.
+    """
+
+    def __init__(self, capacidade, tz=None):
+        self.capacidade = max(1, int(capacidade))
+        self.tz = tz
+        self._tempos = np.empty(2 * self.capacidade, dtype=np.int64)
+        self._valores = np.empty((2 * self.capacidade, len(COLUNAS_BARRAS)), dtype=np.float32)
+        self._inicio = 0
+        self._fim = 0
+
+    def __len__(self):
+        return self._fim - self._inicio
+
+    @property
+    def nbytes(self):
+        return self._tempos.nbytes + self._valores.nbytes
+
+    @classmethod
+    def de_dataframe(cls, df, capacidade):
+        barras = cls(capacidade, str(df.index.tz) if getattr(df.index, 'tz', None) is not None else None)
+        barras.mesclar(df)
+        return barras
+
+    def _indice(self, tempos):
+        indice = pd.DatetimeIndex(tempos.astype('datetime64[ns]'))
+        return indice.tz_localize('UTC').tz_convert(self.tz) if self.tz else indice
+
+    def ultimo_instante(self):
+        return self._indice(self._tempos[self._fim - 1:self._fim])[0] if len(self) else None
+
+    def registros(self):
+        """Cópia das barras vivas como array estruturado (formato REGISTRO_HISTORICO)."""
+        registros = np.empty(len(self), dtype=REGISTRO_HISTORICO)
+        registros['tempo'] = self._tempos[self._inicio:self._fim]
+        for i, coluna in enumerate(COLUNAS_BARRAS):
+            registros[coluna] = self._valores[self._inicio:self._fim, i]
+        return registros
+
+    def mesclar(self, df):
+        """Acrescenta as barras de df; as que já existem a partir de df.index[0] são substituídas."""
+        if df.empty:
+            return
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        indice = pd.DatetimeIndex(df.index)
+        if self.tz and indice.tz is None:
+            indice = indice.tz_localize(self.tz)
+        elif not self.tz and indice.tz is not None:
+            indice = indice.tz_convert('UTC').tz_localize(None)
+        tempos = indice.as_unit('ns').asi8
+        valores = df.reindex(columns=list(COLUNAS_BARRAS)).to_numpy(dtype=np.float32)[-self.capacidade:]
+        tempos = tempos[-self.capacidade:]
+        n = len(tempos)
+
+        corte = self._inicio + int(np.searchsorted(self._tempos[self._inicio:self._fim], tempos[0]))
+        manter_desde = max(self._inicio, corte - (self.capacidade - n))
+        if corte + n > len(self._tempos):
+            # Sem espaço no fim: as barras mantidas voltam para o início
+            mantidas = corte - manter_desde
+            self._tempos[:mantidas] = self._tempos[manter_desde:corte]
+            self._valores[:mantidas] = self._valores[manter_desde:corte]
+            manter_desde, corte = 0, mantidas
+        self._tempos[corte:corte + n] = tempos
+        self._valores[corte:corte + n] = valores
+        self._inicio, self._fim = manter_desde, corte + n
+
+    def descartar_antes(self, instante):
+        """Esquece as barras anteriores a instante (o início da janela do período)."""
+        instante = pd.Timestamp(instante)
+        if self.tz:
+            instante = instante.tz_convert('UTC')
+        self._inicio += int(np.searchsorted(self._tempos[self._inicio:self._fim], instante.as_unit('ns').value))
+
+    def dataframe(self):
+        """DataFrame sobre as barras vivas. Os valores são vistas somente leitura do buffer."""
+        valores = self._valores[self._inicio:self._fim]
+        valores.flags.writeable = False
+        return pd.DataFrame(valores, index=self._indice(self._tempos[self._inicio:self._fim]),
+                            columns=list(COLUNAS_BARRAS), copy=False)
+
+    def __getstate__(self):
+        # Só a janela viva; também é o formato do cache em disco (ver _persistir_entrada)
+        return {'capacidade': self.capacidade, 'tz': self.tz,
+                'tempos': self._tempos[self._inicio:self._fim].copy(),
+                'valores': self._valores[self._inicio:self._fim].copy()}
+
+    def __setstate__(self, estado):
+        self.__init__(estado['capacidade'], estado['tz'])
+        n = min(len(estado['tempos']), self.capacidade)
+        self._tempos[:n] = estado['tempos'][-n:] if n else []
+        self._valores[:n] = estado['valores'][-n:] if n else []
+        self._fim = n
+
+    @classmethod
+    def de_estado(cls, estado):
+        """Reconstrói o buffer a partir de __getstate__()."""
+        barras = cls.__new__(cls)
+        barras.__setstate__(estado)
+        return barras
+
+
+def capacidade_barras(interval, periodo):
+    """Barras que cabem no período (com folga para meses de 31 dias), limitado a MAX_BARRAS_BUFFER."""
+    duracao = DURACAO_BARRA.get(interval)
+    if duracao is None:
+        return MAX_BARRAS_BUFFER
+    return min(MAX_BARRAS_BUFFER, math.ceil(pd.Timedelta(days=_periodo_em_dias(periodo) * 1.1) / duracao) + 16)
+
+
+_cache_barras = {}  # (ticker, interval) -> {'barras': BufferBarras, 'periodo': ..., 'atualizado_em': ...}
+_cache_locks = {}
+_cache_locks_guard = Lock()
+
+
+def normalizar_colunas(df):
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+    df.columns = df.columns.str.lower().str.strip()
+    return df
+
+
+def _periodo_em_dias(period):
+    if period.endswith('mo'):
+        return int(period[:-2]) * 30
+    if period.endswith('y'):
+        return int(period[:-1]) * 365
+    if period.endswith('d'):
+        return int(period[:-1])
+    raise ValueError(f"Período não suportado: {period}")
+
+
+def _inicio_periodo(indice, period):
+    """Primeiro instante do período pedido (mesma semântica do yfinance)."""
+    if period.endswith('d'):
+        # No yfinance, 'Nd' significa N pregões, não N dias corridos
+        return indice.normalize().unique()[-int(period[:-1]):][0]
+    agora = relogio.timestamp(indice.tz)
+    if period.endswith('mo'):
+        return agora - pd.DateOffset(months=int(period[:-2]))
+    return agora - pd.DateOffset(years=int(period[:-1]))
+
+
+def _recortar_periodo(df, period):
+    """Recorta o DataFrame (índice ordenado) ao período pedido, como fatia de linhas."""
+    if df.empty:
+        return df
+    return df.iloc[df.index.searchsorted(_inicio_periodo(df.index, period)):]
+
+
+def _arquivo_cache(ticker, interval):
+    nome = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{ticker}_{interval}")
+    return os.path.join(CACHE_DIR, f"{nome}.pkl")
+
+
+def _lock_cache(chave):
+    with _cache_locks_guard:
+        return _cache_locks.setdefault(chave, Lock())
+
+
+def _carregar_entrada(chave):
+    entrada = _cache_barras.get(chave)
+    if entrada is None:
+        caminho = _arquivo_cache(*chave)
+        if os.path.exists(caminho):
+            try:
+                entrada = pd.read_pickle(caminho)
+                if 'buffer' in entrada:
+                    entrada['barras'] = BufferBarras.de_estado(entrada.pop('buffer'))
+                elif 'df' in entrada:
+                    # Formato antigo (DataFrame inteiro): converte para o buffer
+                    df = entrada.pop('df')
+                    entrada['barras'] = BufferBarras.de_dataframe(df, capacidade_barras(chave[1], entrada['periodo']))
+                _cache_barras[chave] = entrada
+            except Exception as e:
+                print(f"⚠️ Cache corrompido ({os.path.basename(caminho)}): {e}")
+    return entrada
+
+
+def _persistir_entrada(chave, entrada):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        caminho = _arquivo_cache(*chave)
+        # Só dados simples (dict de arrays): o pickle de BufferBarras gravado por
+        # `python main.py` referencia __main__ e não carrega em backtest/otimizador
+        dados = {campo: valor for campo, valor in entrada.items() if campo != 'barras'}
+        dados['buffer'] = entrada['barras'].__getstate__()
+        pd.to_pickle(dados, caminho + ".tmp")
+        os.replace(caminho + ".tmp", caminho)
+    except Exception as e:
+        print(f"⚠️ Falha ao gravar cache em disco: {e}")
+
+
+def _arquivo_historico(ticker, interval):
+    nome = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{ticker}_{interval}")
+    return os.path.join(CACHE_DIR, "historico", f"{nome}.bin")
+
+
+def arquivar_barras(ticker, interval, barras):
+    """
+    Acrescenta ao histórico em disco de (ticker, interval) as barras fechadas
+    do buffer (todas menos a última) posteriores à última já arquivada. Ao
+    contrário do cache, o arquivo nunca é recortado ao período do ciclo: é
+    ele que dá ao backtest e ao otimizador meses/anos de barras.
+    """
+    if not ARQUIVAR_HISTORICO or len(barras) < 2:
+        return
+    caminho = _arquivo_historico(ticker, interval)
+    tamanho = REGISTRO_HISTORICO.itemsize
+    try:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "ab+") as f:
+            # Um registro incompleto (processo interrompido no meio da escrita) é descartado
+            completos = f.seek(0, os.SEEK_END) // tamanho
+            f.truncate(completos * tamanho)
+            registros = barras.registros()[:-1]
+            if completos:
+                f.seek((completos - 1) * tamanho)
+                ultimo = np.frombuffer(f.read(tamanho), dtype=REGISTRO_HISTORICO)[0]['tempo']
+                registros = registros[registros['tempo'] > ultimo]
+            f.write(registros.tobytes())
+    except Exception as e:
+        print(f"⚠️ Falha ao arquivar histórico ({ticker} {interval}): {e}")
+
+
+def carregar_arquivo_historico(ticker, interval):
+    """Todo o histórico arquivado de (ticker, interval), com índice em UTC (vazio se não há arquivo)."""
+    caminho = _arquivo_historico(ticker, interval)
+    if not os.path.exists(caminho):
+        return pd.DataFrame(columns=list(COLUNAS_BARRAS), dtype=np.float32)
+    dados = np.fromfile(caminho, dtype=REGISTRO_HISTORICO,
+                        count=os.path.getsize(caminho) // REGISTRO_HISTORICO.itemsize)
+    indice = pd.DatetimeIndex(dados['tempo'].astype('datetime64[ns]')).tz_localize('UTC')
+    df = pd.DataFrame({coluna: dados[coluna] for coluna in COLUNAS_BARRAS}, index=indice)
+    return df[~df.index.duplicated(keep='last')].sort_index()
+
+
+def _utc(ts):
+    return ts.tz_convert('UTC') if ts.tzinfo is not None else ts.tz_localize('UTC')
+
+
+def _separar_por_ticker(df, tickers):
+    """Divide o retorno de um yf.download com vários tickers em {ticker: df}."""
+    if isinstance(df.columns, pd.MultiIndex):
+        for nivel in range(df.columns.nlevels):
+            valores = set(df.columns.get_level_values(nivel))
+            if valores & set(tickers):
+                return {t: df.xs(t, axis=1, level=nivel) for t in tickers if t in valores}
+    return {tickers[0]: df} if len(tickers) == 1 else {}
+
+
+def _baixar_yahoo(tickers, session=None, **kwargs):
+    """Uma chamada ao yf.download por lote de até TAMANHO_LOTE tickers."""
+    resultado = {}
+    for inicio in range(0, len(tickers), TAMANHO_LOTE):
+        lote = tickers[inicio:inicio + TAMANHO_LOTE]
+        df = yf.download(lote if len(lote) > 1 else lote[0], progress=False, session=session, **kwargs)
+        for ticker, parte in _separar_por_ticker(df, lote).items():
+            resultado[ticker] = normalizar_colunas(parte.copy()).dropna(how='all')
+    return resultado
+
+
+def baixar_com_cache_lote(tickers, period, interval, session=None):
+    """
+    Consulta o cache (ticker, interval) de cada ticker antes de ir ao Yahoo.
+    Entradas válidas por uma barra (limitado a CACHE_TTL_MAX); ao expirar,
+    baixa apenas as barras desde o último timestamp armazenado. Os tickers
+    que precisam de dados são agrupados em chamadas multi-ticker.
+    Retorna {ticker: df} (tickers sem dados ficam de fora); os DataFrames
+    são vistas do BufferBarras de cada ticker.
+    """
+    validade = min(DURACAO_BARRA.get(interval, pd.Timedelta(seconds=CACHE_TTL_MAX)),
+                   pd.Timedelta(seconds=CACHE_TTL_MAX))
+    tickers = list(dict.fromkeys(tickers))
+    locks = [_lock_cache((ticker, interval)) for ticker in sorted(tickers)]
+    for lock in locks:
+        lock.acquire()
+    try:
+        resultado = {}
+        incrementais = {}
+        completos = []
+        periodo_completo = period
+        for ticker in tickers:
+            entrada = _carregar_entrada((ticker, interval))
+            cobre_periodo = entrada is not None and len(entrada['barras']) > 0 and \
+                _periodo_em_dias(entrada['periodo']) >= _periodo_em_dias(period)
+
+            if cobre_periodo and relogio.time() - entrada['atualizado_em'] < validade.total_seconds():
+                metricas.incrementar('bw_cache_acessos_total', resultado='hit', interval=interval)
+                print(f"🗄️ Cache: {ticker} ({interval})")
+                resultado[ticker] = _recortar_periodo(entrada['barras'].dataframe(), period)
+                continue
+
+            if cobre_periodo:
+                ultimo = entrada['barras'].ultimo_instante()
+                if (relogio.timestamp(ultimo.tz) - ultimo).days < _periodo_em_dias(entrada['periodo']) / 2:
+                    incrementais[ticker] = entrada
+                    continue
+            completos.append(ticker)
+            if entrada is not None and _periodo_em_dias(entrada['periodo']) > _periodo_em_dias(periodo_completo):
+                periodo_completo = entrada['periodo']
+
+        novos = {}
+        if incrementais:
+            inicio = min(_utc(entrada['barras'].ultimo_instante()) for entrada in incrementais.values())
+            baixados = _baixar_yahoo(list(incrementais), session, start=inicio, interval=interval)
+            for ticker, entrada in incrementais.items():
+                novo = baixados.get(ticker, pd.DataFrame())
+                metricas.incrementar('bw_cache_acessos_total', resultado='incremental', interval=interval)
+                print(f"🗄️ Cache incremental: {ticker} ({interval}) +{len(novo)} barras")
+                entrada['barras'].mesclar(novo)
+                novos[ticker] = (entrada['barras'], entrada['periodo'])
+        if completos:
+            for ticker in completos:
+                metricas.incrementar('bw_cache_acessos_total', resultado='completo', interval=interval)
+            baixados = _baixar_yahoo(completos, session, period=periodo_completo, interval=interval)
+            for ticker, df in baixados.items():
+                if not df.empty:
+                    novos[ticker] = (BufferBarras.de_dataframe(df, capacidade_barras(interval, periodo_completo)),
+                                     periodo_completo)
+
+        for ticker, (barras, periodo) in novos.items():
+            if not len(barras):
+                continue
+            arquivar_barras(ticker, interval, barras)
+            df = barras.dataframe()
+            barras.descartar_antes(_inicio_periodo(df.index, periodo))
+            entrada = {'barras': barras, 'periodo': periodo, 'atualizado_em': relogio.time()}
+            _cache_barras[(ticker, interval)] = entrada
+            _persistir_entrada((ticker, interval), entrada)
+            resultado[ticker] = _recortar_periodo(barras.dataframe(), period)
+        return resultado
+    finally:
+        for lock in locks:
+            lock.release()
+
+# ===========================
+# 🔍 DOWNLOAD ROBUSTO
+# ===========================
+class SaudeFontes:
+    """
+    Saúde de cada ticker: taxa de sucesso e latência em média móvel
+    exponencial, com a taxa voltando a 1 conforme o tempo passa sem falhas.
+    Após `limite_falhas` falhas seguidas o disjuntor tira o ticker da rota
+    por `pausa` segundos (dobrando a cada reincidência); vencida a pausa,
+    a próxima tentativa decide se ele volta.
+    """
+
+    def __init__(self, limite_falhas=CIRCUITO_FALHAS, pausa=CIRCUITO_PAUSA, pausa_max=3600,
+                 alfa=0.3, recuperacao=30 * 60):
+        self.limite_falhas = limite_falhas
+        self.pausa = pausa
+        self.pausa_max = pausa_max
+        self.alfa = alfa
+        self.recuperacao = recuperacao
+        self._estado = {}
+        self._lock = Lock()
+
+    def _ticker(self, ticker):
+        return self._estado.setdefault(ticker, {
+            'sucesso': 1.0, 'latencia': None, 'falhas_seguidas': 0,
+            'aberto_ate': 0.0, 'pausa': self.pausa, 'atualizado': time.monotonic()
+        })
+
+    def _sucesso(self, estado, agora):
+        decorrido = agora - estado['atualizado']
+        return 1 - (1 - estado['sucesso']) * math.exp(-decorrido / self.recuperacao)
+
+    def registrar(self, ticker, ok, duracao=None):
+        with self._lock:
+            agora = time.monotonic()
+            estado = self._ticker(ticker)
+            estado['sucesso'] = (1 - self.alfa) * self._sucesso(estado, agora) + self.alfa * (1.0 if ok else 0.0)
+            estado['atualizado'] = agora
+            if duracao is not None:
+                estado['latencia'] = duracao if estado['latencia'] is None else \
+                    (1 - self.alfa) * estado['latencia'] + self.alfa * duracao
+            if ok:
+                estado['falhas_seguidas'] = 0
+                estado['aberto_ate'] = 0.0
+                estado['pausa'] = self.pausa
+                return
+            estado['falhas_seguidas'] += 1
+            # aberto_ate > 0: já estava fora da rota e a tentativa de retorno falhou
+            if estado['falhas_seguidas'] >= self.limite_falhas or estado['aberto_ate'] > 0:
+                estado['aberto_ate'] = agora + estado['pausa']
+                metricas.incrementar('bw_circuito_aberto_total', ticker=ticker)
+                print(f"🔌 {ticker} fora da rota por {estado['pausa']:.0f}s ({estado['falhas_seguidas']} falhas seguidas)")
+                estado['pausa'] = min(estado['pausa'] * 2, self.pausa_max)
+
+    def disponivel(self, ticker):
+        with self._lock:
+            return time.monotonic() >= self._ticker(ticker)['aberto_ate']
+
+    def ordenar(self, tickers):
+        """Tickers disponíveis, do mais saudável ao menos (empates mantêm a ordem configurada)."""
+        with self._lock:
+            agora = time.monotonic()
+            disponiveis = [t for t in tickers if agora >= self._ticker(t)['aberto_ate']]
+            return sorted(disponiveis, key=lambda t: -round(self._sucesso(self._estado[t], agora), 1))
+
+    def resumo(self):
+        with self._lock:
+            agora = time.monotonic()
+            return {ticker: {
+                'sucesso': round(self._sucesso(estado, agora), 3),
+                'latencia_s': round(estado['latencia'], 3) if estado['latencia'] is not None else None,
+                'falhas_seguidas': estado['falhas_seguidas'],
+                'circuito': 'aberto' if agora < estado['aberto_ate'] else
+                            'teste' if estado['aberto_ate'] > 0 else 'fechado'
+            } for ticker, estado in self._estado.items()}
+
+
+saude_fontes = SaudeFontes()
+_pool_fontes = ThreadPoolExecutor(max_workers=2 * MAX_DOWNLOADS_CONCORRENTES, thread_name_prefix="fonte")
+_tentativas_em_andamento = set()
+_tentativas_lock = Lock()
+_sessao_yahoo = None
+_sessao_lock = Lock()
+
+
+def sessao_downloads():
+    """Sessão HTTP única (pool de conexões keep-alive) para todos os downloads."""
+    global _sessao_yahoo
+    with _sessao_lock:
+        if _sessao_yahoo is None:
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            sessao = requests.Session()
+            # Poucas repetições no nível HTTP: quem decide fallback e espera é download_robusto_lote
+            retry_strategy = Retry(
+                total=2,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"]
+            )
+            adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=8,
+                                  pool_maxsize=2 * MAX_DOWNLOADS_CONCORRENTES)
+            sessao.mount("http://", adapter)
+            sessao.mount("https://", adapter)
+            user_agent = f'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{random.randint(80, 120)}.0.0.0 Safari/537.36'
+            sessao.headers.update({'User-Agent': user_agent})
+
+            def contar_erros_http(resposta, *args, **kwargs):
+                if resposta.status_code == 429 or resposta.status_code >= 500:
+                    metricas.incrementar('bw_http_erros_total', codigo=resposta.status_code)
+            sessao.hooks['response'].append(contar_erros_http)
+            _sessao_yahoo = sessao
+        return _sessao_yahoo
+
+
+def _tentar_lote(tickers, period, interval):
+    """Uma tentativa em lote; atualiza a saúde de cada ticker. Retorna só os dfs válidos."""
+    rotulo = tickers[0] if len(tickers) == 1 else f"{len(tickers)} tickers"
+    print(f"📥 {rotulo} ({interval})...")
+    for ticker in tickers:
+        metricas.incrementar('bw_download_tentativas_total', interval=interval, ticker=ticker)
+    inicio = time.monotonic()
+    try:
+        with metricas.medir('bw_download_duracao_segundos', interval=interval,
+                            ticker=tickers[0] if len(tickers) == 1 else 'lote'):
+            baixados = baixar_com_cache_lote(tickers, period, interval, sessao_downloads())
+    except Exception as e:
+        for ticker in tickers:
+            metricas.incrementar('bw_download_falhas_total', interval=interval, ticker=ticker)
+            saude_fontes.registrar(ticker, False, time.monotonic() - inicio)
+        print(f"❌ Falha com {rotulo}: {e}")
+        return {}
+    duracao = time.monotonic() - inicio
+    validos = {}
+    for ticker in tickers:
+        df = baixados.get(ticker)
+        ok = df is not None and not df.empty and len(df) >= 15
+        saude_fontes.registrar(ticker, ok, duracao)
+        if ok:
+            validos[ticker] = df
+    return validos
+
+
+def _submeter_tentativa(tickers, period, interval):
+    """_tentar_lote no pool de fontes, registrado até terminar (ver aguardar_tentativas)."""
+    futuro = _pool_fontes.submit(_tentar_lote, tickers, period, interval)
+    with _tentativas_lock:
+        _tentativas_em_andamento.add(futuro)
+
+    def esquecer(f):
+        with _tentativas_lock:
+            _tentativas_em_andamento.discard(f)
+
+    futuro.add_done_callback(esquecer)
+    return futuro
+
+
+def aguardar_tentativas(timeout=None):
+    """
+    Espera as tentativas que ainda estão rodando, inclusive as que perderam
+    para o hedge e seguem gravando no cache. Retorna quantas não terminaram.
+    """
+    with _tentativas_lock:
+        pendentes = list(_tentativas_em_andamento)
+    _, nao_terminadas = wait(pendentes, timeout=timeout)
+    return len(nao_terminadas)
+
+
+def _download_robusto_lote(instrumentos, period, interval, max_attempts=6, prazo=None):
+    """
+    instrumentos: {nome: [ticker principal, fallbacks...]}. Cada instrumento
+    segue seus tickers disponíveis, do mais saudável ao menos; em cada nível
+    os pendentes são baixados em lote. Se o lote demorar mais que HEDGE_APOS,
+    o nível seguinte é pedido em paralelo e vale o que chegar primeiro.
+    Retorna {nome: (df, ticker_usado)}.
+    prazo: instante (time.monotonic) após o qual não há novas tentativas nem
+    esperas; nunca passa de PRAZO_DOWNLOAD segundos a partir da chamada.
+    """
+    limite = time.monotonic() + PRAZO_DOWNLOAD
+    prazo = limite if prazo is None else min(prazo, limite)
+
+    def restante():
+        return prazo - time.monotonic()
+
+    rotas = {}
+    for nome, tickers in instrumentos.items():
+        rotas[nome] = saude_fontes.ordenar(tickers)
+        if not rotas[nome]:
+            print(f"🔌 {nome}: todos os tickers estão fora da rota ({interval})")
+    pendentes = {nome for nome, rota in rotas.items() if rota}
+    resultado = {}
+    niveis = max((len(rota) for rota in rotas.values()), default=0)
+
+    for tentativa in range(max_attempts):
+        nivel = 0
+        while pendentes and nivel < niveis:
+            candidatos = {nome: rotas[nome][nivel] for nome in pendentes if nivel < len(rotas[nome])}
+            if not candidatos:
+                nivel += 1
+                continue
+            if restante() <= 0:
+                print(f"⌛ Prazo do download esgotado ({interval})")
+                return resultado
+
+            print(f"🔁 Tentativa {tentativa+1}/{max_attempts} - nível {nivel+1} ({interval})")
+            futuros = {_submeter_tentativa(list(dict.fromkeys(candidatos.values())),
+                                           period, interval): (nivel, candidatos)}
+            if HEDGE_APOS > 0:
+                wait(futuros, timeout=max(0, min(HEDGE_APOS, restante())))
+                reserva = {nome: rotas[nome][nivel + 1] for nome in candidatos if nivel + 1 < len(rotas[nome])}
+                if not any(f.done() for f in futuros) and reserva and restante() > 0:
+                    metricas.incrementar('bw_download_hedge_total', interval=interval)
+                    print(f"🪁 Latência alta em {interval}: pedindo o fallback em paralelo")
+                    futuros[_submeter_tentativa(list(dict.fromkeys(reserva.values())),
+                                                period, interval)] = (nivel + 1, reserva)
+            niveis_usados = [n for n, _ in futuros.values()]
+
+            while futuros and any(nome in pendentes for _, c in futuros.values() for nome in c):
+                concluidos, _ = wait(futuros, timeout=max(0, restante()), return_when=FIRST_COMPLETED)
+                if not concluidos:
+                    print(f"⌛ Prazo do download esgotado ({interval})")
+                    return resultado
+                for futuro in concluidos:
+                    nivel_futuro, grupo = futuros.pop(futuro)
+                    baixados = futuro.result()
+                    for nome, ticker in grupo.items():
+                        if nome in pendentes and ticker in baixados:
+                            if ticker != instrumentos[nome][0]:
+                                metricas.incrementar('bw_download_fallback_total', interval=interval, ticker=ticker)
+                            resultado[nome] = (baixados[ticker], ticker)
+                            pendentes.discard(nome)
+            if len(candidatos) == 1 and not pendentes:
+                print(f"✅ Sucesso com {resultado[next(iter(candidatos))][1]}")
+            elif len(candidatos) > 1:
+                print(f"✅ {len(resultado)}/{len(instrumentos)} ativos com dados ({interval})")
+            if not pendentes:
+                return resultado
+
+            nivel = max(niveis_usados) + 1
+            relogio.dormir(max(0, min(random.uniform(2, 5), restante())))
+
+        # A saúde mudou durante a tentativa: reordena as rotas e desiste de quem ficou sem ticker
+        for nome in list(pendentes):
+            rotas[nome] = saude_fontes.ordenar(instrumentos[nome])
+            if not rotas[nome]:
+                print(f"🔌 {nome}: todos os tickers estão fora da rota ({interval})")
+                pendentes.discard(nome)
+        if tentativa < max_attempts - 1 and pendentes:
+            espera = min((2 ** tentativa) + random.uniform(0, 10), max(0, restante()))
+            print(f"🔁 Esperando {espera:.1f}s...")
+            relogio.dormir(espera)
+
+    if pendentes:
+        print(f"❌ Falha crítica: Não foi possível baixar dados ({', '.join(sorted(pendentes))}).")
+    return resultado
+
+
+# ===========================
+# 🎞️ GRAVAÇÃO E REPRODUÇÃO DE DADOS DE MERCADO
+# ===========================
+def _nome_seguro(texto):
+    return re.sub(r'[^A-Za-z0-9]+', '_', texto).strip('_')
+
+
+class GravadorMercado:
+    """
+    Grava cada resultado de download_robusto_lote em `diretorio`. Cada
+    captura é um .npz comprimido só com as barras a partir da última barra
+    da captura anterior da mesma chave (ticker, interval, period); o índice
+    capturas.jsonl guarda instante, chave, arquivo e início da janela.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+        self._anteriores = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _continua(anterior, df):
+        """True se df só acrescenta barras a anterior (a última barra pode ter mudado)."""
+        ultimo = anterior.index[-1]
+        if df.index[0] < anterior.index[0] or df.index[-1] < ultimo or list(df.columns) != list(anterior.columns):
+            return False
+        comum = anterior[(anterior.index >= df.index[0]) & (anterior.index < ultimo)]
+        return comum.equals(df[df.index < ultimo])
+
+    def registrar(self, resultado, period, interval, instante):
+        with self._lock:
+            por_ticker = {}
+            for nome, (df, ticker) in resultado.items():
+                por_ticker.setdefault(ticker, (df, []))[1].append(nome)
+            for ticker, (df, nomes) in sorted(por_ticker.items()):
+                chave = (ticker, interval, period)
+                anterior = self._anteriores.get(chave)
+                completo = anterior is None or not self._continua(anterior, df)
+                delta = df if completo else df[df.index >= anterior.index[-1]]
+                arquivo = f"{_nome_seguro(ticker)}_{interval}_{period}_{int(instante * 1000)}.npz"
+                np.savez_compressed(
+                    os.path.join(self.diretorio, arquivo),
+                    indice=pd.DatetimeIndex(delta.index).as_unit('ns').asi8,
+                    valores=delta.to_numpy(dtype=float),
+                    colunas=np.array(list(delta.columns), dtype=str),
+                    tz=np.array(str(df.index.tz) if df.index.tz is not None else ''))
+                linha = {'instante': instante, 'nomes': sorted(nomes), 'ticker': ticker, 'interval': interval,
+                         'period': period, 'arquivo': arquivo, 'completo': completo,
+                         'inicio': int(pd.DatetimeIndex(df.index[:1]).as_unit('ns').asi8[0])}
+                with open(os.path.join(self.diretorio, "capturas.jsonl"), "a") as f:
+                    f.write(json.dumps(linha) + "\n")
+                self._anteriores[chave] = df.copy()  # df pode ser vista de um BufferBarras
+
+
+class ReprodutorMercado:
+    """
+    Devolve, para cada instante, a última captura gravada por GravadorMercado
+    até ele. As capturas de cada chave são reaplicadas em ordem; voltar no
+    tempo reconstrói a partir da última captura completa.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        with open(os.path.join(diretorio, "capturas.jsonl")) as f:
+            capturas = sorted((json.loads(linha) for linha in f if linha.strip()), key=lambda c: c['instante'])
+        self._por_chave = {}
+        self._por_nome = {}
+        for captura in capturas:
+            lista = self._por_chave.setdefault((captura['ticker'], captura['interval'], captura['period']), [])
+            captura['posicao'] = len(lista)
+            lista.append(captura)
+            for nome in captura['nomes']:
+                self._por_nome.setdefault((nome, captura['interval'], captura['period']), []).append(captura)
+        self.instantes = [captura['instante'] for captura in capturas]
+        self._reconstruidos = {}
+
+    def ciclos(self, intervalo_minimo=60):
+        """Instante final de cada ciclo gravado (capturas separadas por menos de intervalo_minimo)."""
+        ciclos = []
+        for instante in self.instantes:
+            if ciclos and instante - ciclos[-1] < intervalo_minimo:
+                ciclos[-1] = instante
+            else:
+                ciclos.append(instante)
+        return ciclos
+
+    def _ler(self, captura):
+        with np.load(os.path.join(self.diretorio, captura['arquivo'])) as dados:
+            indice = pd.to_datetime(dados['indice'], utc=True)
+            tz = str(dados['tz'])
+            indice = indice.tz_convert(tz) if tz else indice.tz_localize(None)
+            return pd.DataFrame(dados['valores'], index=indice, columns=[str(c) for c in dados['colunas']])
+
+    def _reconstruir(self, captura):
+        chave = (captura['ticker'], captura['interval'], captura['period'])
+        lista = self._por_chave[chave]
+        posicao, df = self._reconstruidos.get(chave, (-1, None))
+        if posicao > captura['posicao'] or df is None:
+            posicao = max(i for i in range(captura['posicao'] + 1) if lista[i]['completo']) - 1
+            df = None
+        for atual in lista[posicao + 1:captura['posicao'] + 1]:
+            delta = self._ler(atual)
+            if atual['completo'] or df is None:
+                df = delta
+            else:
+                df = pd.concat([df[df.index < delta.index[0]], delta])
+            df = df[df.index >= pd.Timestamp(atual['inicio'], tz='UTC')]
+        self._reconstruidos[chave] = (captura['posicao'], df)
+        return df
+
+    def consultar(self, instrumentos, period, interval, instante):
+        """Mesmo contrato de download_robusto_lote: {nome: (df, ticker)} como estava em `instante`."""
+        resultado = {}
+        for nome in instrumentos:
+            capturas = self._por_nome.get((nome, interval, period))
+            recortar = False
+            if capturas is None:
+                # Período não gravado: usa o maior gravado para o intervalo e recorta
+                candidatos = [(_periodo_em_dias(p), c) for (n, i, p), c in self._por_nome.items()
+                              if n == nome and i == interval]
+                if not candidatos or max(candidatos, key=lambda x: x[0])[0] < _periodo_em_dias(period):
+                    continue
+                capturas, recortar = max(candidatos, key=lambda x: x[0])[1], True
+            posicao = bisect.bisect_right([c['instante'] for c in capturas], instante) - 1
+            if posicao < 0:
+                continue
+            df = self._reconstruir(capturas[posicao])
+            resultado[nome] = (_recortar_periodo(df, period) if recortar else df, capturas[posicao]['ticker'])
+        return resultado
+
+
+gravador_mercado = None
+reprodutor_mercado = None
+
+
+def download_robusto_lote(instrumentos, period, interval, max_attempts=6, prazo=None):
+    """
+    Ponto único de entrada dos dados de mercado: em reprodução devolve o que
+    foi gravado para o instante do relógio; com gravador ativo, grava o
+    resultado. Ver _download_robusto_lote.
+    """
+    if reprodutor_mercado is not None:
+        return reprodutor_mercado.consultar(instrumentos, period, interval, relogio.time())
+    resultado = _download_robusto_lote(instrumentos, period, interval, max_attempts, prazo)
+    if gravador_mercado is not None and resultado:
+        try:
+            gravador_mercado.registrar(resultado, period, interval, relogio.time())
+        except Exception as e:
+            print(f"⚠️ Falha ao gravar captura ({interval}): {e}")
+    return resultado
+
+
+def reproduzir_gravacao(diretorio, instrumentos=None):
+    """
+    Roda um ciclo de análise por ciclo gravado em `diretorio`, com relógio
+    simulado: sem rede, sem esperas, sem Telegram e sem git. Estado de
+    indicadores/zonas começa vazio, então duas reproduções dão o mesmo
+    resultado. Retorna [(instante, {nome: sinal})].
+    """
+    global relogio, reprodutor_mercado, armazem_sinais, notificador_telegram, sincronizador_git
+    global estado_publicado, CACHE_DIR
+    reprodutor = ReprodutorMercado(diretorio)
+    ciclos = reprodutor.ciclos()
+    if not ciclos:
+        return []
+    if instrumentos is None:
+        instrumentos = {}
+        for (nome, _, _), capturas in reprodutor._por_nome.items():
+            instrumentos.setdefault(nome, sorted({c['ticker'] for c in capturas}))
+    originais = (relogio, reprodutor_mercado, armazem_sinais, notificador_telegram, sincronizador_git,
+                 estado_publicado, CACHE_DIR)
+    temporario = tempfile.mkdtemp(prefix="reproducao_")
+    relogio = RelogioSimulado(ciclos[0])
+    reprodutor_mercado = reprodutor
+    armazem_sinais = ArmazemSinais(os.path.join(temporario, "sinais.db"))
+    notificador_telegram = NotificadorTelegram(token="")
+    sincronizador_git = SincronizadorGit(arquivo=os.path.join(temporario, "sinais.csv"))  # nunca iniciado
+    estado_publicado = EstadoPublicado()
+    CACHE_DIR = temporario
+    _indicadores.clear()
+    _indices_zonas.clear()
+    _indices_zonas_alterados.clear()
+    _ultimo_ciclo.clear()
+    historico = []
+    try:
+        for instante in ciclos:
+            relogio.avancar_para(instante)
+            historico.append((instante, analisar_watchlist(instrumentos)))
+    finally:
+        (relogio, reprodutor_mercado, armazem_sinais, notificador_telegram, sincronizador_git,
+         estado_publicado, CACHE_DIR) = originais
+        shutil.rmtree(temporario, ignore_errors=True)
+        _indicadores.clear()
+        _indices_zonas.clear()
+        _indices_zonas_alterados.clear()
+        _ultimo_ciclo.clear()
+    return historico
+
+
+def download_robusto(period, interval, max_attempts=6, prazo=None):
+    """Download do ativo principal (NAME/SYMBOLS); retorna (df, ticker_usado)."""
+    resultado = download_robusto_lote({NAME: SYMBOLS}, period, interval, max_attempts, prazo)
+    return resultado.get(NAME, (pd.DataFrame(), None))
+
+# ===========================
+# ⚡ DOWNLOAD CONCORRENTE DOS TIMEFRAMES
+# ===========================
+_pool_downloads = ThreadPoolExecutor(max_workers=MAX_DOWNLOADS_CONCORRENTES, thread_name_prefix="download")
+
+
+def baixar_timeframes(timeframes, prazo=None, instrumentos=None):
+    """
+    Baixa os timeframes em paralelo (no máximo MAX_DOWNLOADS_CONCORRENTES).
+    Cada intervalo é baixado uma única vez para todos os instrumentos, no
+    maior período pedido; os demais períodos são recortes. Retorna
+    {nome: {chave: (df, ticker)}} apenas com o que ficou pronto antes do prazo.
+    """
+    if prazo is None:
+        prazo = time.monotonic() + PRAZO_CICLO
+    instrumentos = instrumentos or {NAME: SYMBOLS}
+
+    maior_periodo = {}
+    for config in timeframes.values():
+        atual = maior_periodo.get(config['interval'])
+        if atual is None or _periodo_em_dias(config['period']) > _periodo_em_dias(atual):
+            maior_periodo[config['interval']] = config['period']
+
+    futuros = {
+        _pool_downloads.submit(download_robusto_lote, instrumentos, period, interval, prazo=prazo): interval
+        for interval, period in maior_periodo.items()
+    }
+    concluidos, pendentes = wait(futuros, timeout=max(0, prazo - time.monotonic()))
+    for futuro in pendentes:
+        print(f"⌛ Download de {futuros[futuro]} não terminou dentro do prazo")
+
+    por_intervalo = {}
+    for futuro in concluidos:
+        try:
+            por_intervalo[futuros[futuro]] = futuro.result()
+        except Exception as e:
+            print(f"❌ Erro no download ({futuros[futuro]}): {e}")
+
+    resultado = {nome: {} for nome in instrumentos}
+    for key, config in timeframes.items():
+        for nome, (df, ticker) in por_intervalo.get(config['interval'], {}).items():
+            resultado[nome][key] = (_recortar_periodo(df, config['period']), ticker)
+    return resultado
+
+# ===========================
+# 🔄 REAMOSTRAGEM LOCAL DOS TIMEFRAMES
+# ===========================
+def reamostrar_ohlcv(df, regra):
+    """
+    Agrega barras OHLCV para um timeframe maior, alinhado à abertura da
+    sessão (SESSAO_INICIO_HORA em SESSAO_TZ). Barras diárias recebem a data
+    do pregão, barras semanais a segunda-feira, como no Yahoo.
+    """
+    if df.empty:
+        return df
+    agregacao = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'}
+    if 'volume' in df.columns:
+        agregacao['volume'] = 'sum'
+    tz_original = df.index.tz
+    if regra.startswith('W'):
+        agregado = df.resample(regra, label='left', closed='left').agg(agregacao)
+    else:
+        # Desloca o relógio para que a abertura da sessão caia à meia-noite
+        deslocamento = pd.Timedelta(hours=24 - SESSAO_INICIO_HORA)
+        indice = df.index.tz_localize('UTC') if tz_original is None else df.index
+        sessao = df.set_axis(indice.tz_convert(SESSAO_TZ) + deslocamento)
+        agregado = sessao.resample(regra, label='left', closed='left').agg(agregacao)
+        if regra != '1D':
+            agregado.index = agregado.index - deslocamento
+        agregado.index = agregado.index.tz_convert(tz_original) if tz_original is not None \
+            else agregado.index.tz_localize(None)
+    return agregado.dropna(subset=['close'])
+
+
+def baixar_timeframes_reamostrados(timeframes, prazo=None, instrumentos=None):
+    """
+    Mesmo contrato de baixar_timeframes, mas só baixa as séries base
+    (15m, 1h, 1d) e constrói H4/D1/W1 localmente.
+    """
+    bases = {}
+    for key, config in timeframes.items():
+        origem = REAMOSTRAGEM.get(config['interval'])
+        if origem is None:
+            bases[key] = config
+        else:
+            bases[f"base_{origem['base']}"] = {'interval': origem['base'], 'period': origem['periodo_base']}
+    resultado = {}
+    for nome, barras_base in baixar_timeframes(bases, prazo, instrumentos).items():
+        resultado[nome] = {}
+        for key, config in timeframes.items():
+            origem = REAMOSTRAGEM.get(config['interval'])
+            if origem is None:
+                if key in barras_base:
+                    resultado[nome][key] = barras_base[key]
+                continue
+            chave_base = f"base_{origem['base']}"
+            if chave_base not in barras_base:
+                continue
+            df, ticker = barras_base[chave_base]
+            df = reamostrar_ohlcv(normalizar_colunas(df), origem['regra'])
+            resultado[nome][key] = (_recortar_periodo(df, config['period']), ticker)
+    return resultado
+
+
+def relatorio_reamostragem(timeframes=None):
+    """Compara barras reamostradas com as baixadas diretamente do Yahoo."""
+    timeframes = timeframes or TIMEFRAMES_ESTRUTURAIS
+    diretas = baixar_timeframes(timeframes)[NAME]
+    reamostradas = baixar_timeframes_reamostrados(timeframes)[NAME]
+    relatorio = {}
+    for key in timeframes:
+        if key not in diretas or key not in reamostradas:
+            relatorio[key] = {'erro': 'dados indisponíveis'}
+            continue
+        direta = normalizar_colunas(diretas[key][0])
+        local = reamostradas[key][0]
+        colunas = ['open', 'high', 'low', 'close']
+        direta_comum, local_comum = direta[colunas].align(local[colunas], join='inner', axis=0)
+        item = {'barras_diretas': len(direta), 'barras_reamostradas': len(local), 'barras_comuns': len(direta_comum)}
+        if len(direta_comum):
+            desvio = (local_comum - direta_comum).abs() / direta_comum
+            for coluna in colunas:
+                item[f'{coluna}_desvio_medio_pct'] = round(float(desvio[coluna].mean() * 100), 4)
+                item[f'{coluna}_desvio_max_pct'] = round(float(desvio[coluna].max() * 100), 4)
+        relatorio[key] = item
+        print(f"🔄 {key}: {item}")
+    return relatorio
+
+# ===========================
+# 🔍 DETECÇÃO DE ZONAS ESTRUTURAIS
+# ===========================
+def _extremo_deslizante(x, tamanho, func):
+    """
+    Mínimo/máximo em janela deslizante em O(n) (van Herk / Gil-Werman),
+    independente do tamanho da janela. Opera no último eixo, então aceita
+    várias séries empilhadas (shape [..., n]). Retorna n - tamanho + 1 valores.
+    """
+    n = x.shape[-1]
+    if n < tamanho:
+        return np.empty(x.shape[:-1] + (0,))
+    neutro = np.inf if func is np.minimum else -np.inf
+    x = np.where(np.isnan(x), neutro, x)
+    blocos = -(-n // tamanho)
+    preenchimento = np.full(x.shape[:-1] + (blocos * tamanho - n,), neutro)
+    xb = np.concatenate([x, preenchimento], axis=-1).reshape(x.shape[:-1] + (blocos, tamanho))
+    prefixo = func.accumulate(xb, axis=-1).reshape(x.shape[:-1] + (-1,))
+    sufixo = func.accumulate(xb[..., ::-1], axis=-1)[..., ::-1].reshape(x.shape[:-1] + (-1,))
+    inicio = np.arange(n - tamanho + 1)
+    return func(sufixo[..., inicio], prefixo[..., inicio + tamanho - 1])
+
+
+def detectar_swings(lows, highs, window=3):
+    """
+    Máscaras booleanas de swing low / swing high (barra igual ao extremo da
+    janela centrada de 2*window+1). Aceita uma série (n,) ou um lote (k, n).
+    """
+    lows = np.asarray(lows, dtype=float)
+    highs = np.asarray(highs, dtype=float)
+    swing_low = np.zeros(lows.shape, dtype=bool)
+    swing_high = np.zeros(highs.shape, dtype=bool)
+    n = lows.shape[-1]
+    if n < 2 * window + 1:
+        return swing_low, swing_high
+    centro = slice(window, n - window)
+    swing_low[..., centro] = lows[..., centro] == _extremo_deslizante(lows, 2 * window + 1, np.minimum)
+    swing_high[..., centro] = highs[..., centro] == _extremo_deslizante(highs, 2 * window + 1, np.maximum)
+    return swing_low, swing_high
+
+
+def filtrar_proximos(indices, precos, min_distance=3, tolerancia=0.001):
+    """Remove swings a menos de min_distance barras ou tolerancia de preço do último mantido."""
+    if len(indices) == 0:
+        return []
+    mantidos = [0]
+    ultimo_idx, ultimo_preco = indices[0], precos[0]
+    for k in range(1, len(indices)):
+        if indices[k] - ultimo_idx >= min_distance and \
+           abs(precos[k] - ultimo_preco) / ultimo_preco > tolerancia:
+            mantidos.append(k)
+            ultimo_idx, ultimo_preco = indices[k], precos[k]
+    return mantidos
+
+
+def zonas_em_arrays(lows, highs, window=3, min_distance=3, tolerancia=0.001):
+    """Núcleo de detectar_zonas: ((posições, preços) dos suportes, (posições, preços) das resistências)."""
+    swing_low, swing_high = detectar_swings(lows, highs, window)
+
+    def filtrar(mascara, valores):
+        indices = np.flatnonzero(mascara)
+        precos = valores[indices]
+        mantidos = filtrar_proximos(indices.tolist(), precos.tolist(), min_distance, tolerancia)
+        return indices[mantidos], precos[mantidos]
+
+    return filtrar(swing_low, lows), filtrar(swing_high, highs)
+
+
+def montar_zonas(indice, suportes, resistencias):
+    """Converte a saída de zonas_em_arrays nas listas de zonas, com o candle de cada uma."""
+    def montar(arrays, tipo):
+        indices, precos = arrays
+        return [{
+            'index': int(i),
+            'price': preco,
+            'type': tipo,
+            'candle': candle
+        } for i, preco, candle in zip(indices, precos, indice[indices])]
+
+    return {
+        'suportes': montar(suportes, 'support'),
+        'resistencias': montar(resistencias, 'resistance')
+    }
+
+
+def detectar_zonas(df, window=3, min_distance=3, tolerancia=0.001):
+    lows = df['low'].to_numpy(dtype=float)
+    highs = df['high'].to_numpy(dtype=float)
+    return montar_zonas(df.index, *zonas_em_arrays(lows, highs, window, min_distance, tolerancia))
+
+def detectar_padroes_zona(df, zonas, tf, vol_max=0.015, vol_alta=0.01):
+    padroes = []
+    suportes = zonas['suportes']
+    resistencias = zonas['resistencias']
+    if len(suportes) >= 2:
+        ultimo = suportes[-1]
+        penultimo = suportes[-2]
+        if ultimo['price'] > penultimo['price'] and ultimo['index'] - penultimo['index'] > 5:
+            volatilidade = df['close'].iloc[penultimo['index']:ultimo['index']].std() / df['close'].mean()
+            if volatilidade < vol_max:
+                confianca = 'alta' if volatilidade < vol_alta else 'média'
+                padroes.append({
+                    'tipo': 'W_base',
+                    'zona': ultimo['price'],
+                    'confianca': confianca,
+                    'periodo': f"{penultimo['candle'].strftime('%d/%m')} → {ultimo['candle'].strftime('%d/%m')}",
+                    'tf': tf
+                })
+    if len(resistencias) >= 2:
+        ultimo = resistencias[-1]
+        penultimo = resistencias[-2]
+        if ultimo['price'] < penultimo['price'] and ultimo['index'] - penultimo['index'] > 5:
+            volatilidade = df['close'].iloc[penultimo['index']:ultimo['index']].std() / df['close'].mean()
+            if volatilidade < vol_max:
+                confianca = 'alta' if volatilidade < vol_alta else 'média'
+                padroes.append({
+                    'tipo': 'M_base',
+                    'zona': ultimo['price'],
+                    'confianca': confianca,
+                    'periodo': f"{penultimo['candle'].strftime('%d/%m')} → {ultimo['candle'].strftime('%d/%m')}",
+                    'tf': tf
+                })
+    return padroes
+
+def analisar_zonas_estruturais(barras=None, zonas_calculadas=None, reaproveitadas=None):
+    """
+    zonas_calculadas: {chave: {'arrays': saída de zonas_em_arrays, 'padroes': ...}} do motor de análise.
+    reaproveitadas: {chave: resultado do ciclo anterior} de timeframes sem barra nova.
+    """
+    zonas_calculadas = zonas_calculadas or {}
+    reaproveitadas = reaproveitadas or {}
+    if barras is None:
+        baixar = baixar_timeframes_reamostrados if MODO_REAMOSTRAGEM else baixar_timeframes
+        barras = baixar(TIMEFRAMES_ESTRUTURAIS)[NAME]
+    resultados = {}
+    for key, config in TIMEFRAMES_ESTRUTURAIS.items():
+        if key in reaproveitadas:
+            metricas.incrementar('bw_timeframes_reaproveitados_total', tf=key)
+            resultados[key] = reaproveitadas[key]
+            continue
+        try:
+            if key not in barras:
+                continue
+            df, ticker_usado = barras[key]
+            if df.empty or len(df) < 10:
+                continue
+            if isinstance(df.columns, pd.MultiIndex):
+                df.columns = df.columns.get_level_values(0)
+            df.columns = df.columns.str.lower().str.strip()
+            with metricas.medir('bw_etapa_duracao_segundos', etapa='zonas', tf=key):
+                if key in zonas_calculadas:
+                    zonas = montar_zonas(df.index, *zonas_calculadas[key]['arrays'])
+                    padroes = zonas_calculadas[key]['padroes']
+                else:
+                    zonas = detectar_zonas(df)
+                    padroes = detectar_padroes_zona(df, zonas, config['nome'])
+            resultados[key] = {
+                'zonas': zonas,
+                'padroes': padroes,
+                'suporte_recente': zonas['suportes'][-1]['price'] if zonas['suportes'] else None,
+                'resistencia_recente': zonas['resistencias'][-1]['price'] if zonas['resistencias'] else None,
+                'ticker': ticker_usado
+            }
+        except Exception as e:
+            print(f"❌ Erro na análise de zonas ({key}): {e}")
+            continue
+    return resultados
+
+# ===========================
+# 🧱 ÍNDICE DE ZONAS MULTITIMEFRAME
+# ===========================
+class IndiceZonas:
+    """
+    Zonas de todos os timeframes estruturais de um ativo, em listas
+    ordenadas por preço (uma por tipo). Cada timeframe recalculado é
+    sincronizado com a sua detecção atual sem mexer nos outros; vizinhança
+    e confluência são consultas O(log n) via bisect.
+    """
+
+    TIPOS = ('support', 'resistance')
+
+    def __init__(self):
+        self._precos = {tipo: [] for tipo in self.TIPOS}
+        self._zonas = {tipo: [] for tipo in self.TIPOS}
+        self._vistas = set()
+
+    def __len__(self):
+        return len(self._vistas)
+
+    def inserir(self, preco, tf, tipo, candle):
+        """Insere uma zona; devolve False se ela (tf, tipo, candle) já estava no índice."""
+        chave = (tf, tipo, str(candle))
+        if chave in self._vistas:
+            return False
+        self._vistas.add(chave)
+        precos = self._precos[tipo]
+        posicao = bisect.bisect_right(precos, preco)
+        precos.insert(posicao, preco)
+        self._zonas[tipo].insert(posicao, {'price': preco, 'tf': tf, 'type': tipo, 'candle': str(candle)})
+        return True
+
+    def atualizar(self, tf, zonas):
+        """Incorpora a saída de detectar_zonas de um timeframe; retorna quantas zonas eram novas."""
+        return sum(self.inserir(float(zona['price']), tf, zona['type'], zona['candle'])
+                   for zona in zonas['suportes'] + zonas['resistencias'])
+
+    def substituir(self, tf, zonas):
+        """
+        Deixa no índice exatamente as zonas do tf presentes em zonas (saída de
+        detectar_zonas): entram as novas e saem as que a detecção atual não
+        traz mais — swings que dependiam da barra em formação, os trocados
+        por filtrar_proximos e os que saíram da janela. Retorna quantas mudaram.
+        """
+        atuais = {(zona['type'], str(zona['candle'])): float(zona['price'])
+                  for zona in zonas['suportes'] + zonas['resistencias']}
+        removidas = 0
+        for tipo in self.TIPOS:
+            manter = [i for i, zona in enumerate(self._zonas[tipo])
+                      if zona['tf'] != tf or atuais.get((zona['type'], zona['candle'])) == zona['price']]
+            if len(manter) == len(self._zonas[tipo]):
+                continue
+            for i in set(range(len(self._zonas[tipo]))) - set(manter):
+                zona = self._zonas[tipo][i]
+                self._vistas.discard((zona['tf'], zona['type'], zona['candle']))
+            removidas += len(self._zonas[tipo]) - len(manter)
+            self._zonas[tipo] = [self._zonas[tipo][i] for i in manter]
+            self._precos[tipo] = [self._precos[tipo][i] for i in manter]
+        return removidas + sum(self.inserir(preco, tf, tipo, candle) for (tipo, candle), preco in atuais.items())
+
+    def abaixo(self, preco, tipo='support'):
+        """Zona do tipo mais próxima em ou abaixo de preco."""
+        posicao = bisect.bisect_right(self._precos[tipo], preco)
+        return self._zonas[tipo][posicao - 1] if posicao else None
+
+    def acima(self, preco, tipo='resistance'):
+        """Zona do tipo mais próxima em ou acima de preco."""
+        posicao = bisect.bisect_left(self._precos[tipo], preco)
+        return self._zonas[tipo][posicao] if posicao < len(self._precos[tipo]) else None
+
+    def vizinhas(self, preco, tolerancia=TOLERANCIA_CONFLUENCIA):
+        """Zonas (dos dois tipos) a até tolerancia * preco de distância."""
+        minimo, maximo = preco * (1 - tolerancia), preco * (1 + tolerancia)
+        vizinhas = []
+        for tipo in self.TIPOS:
+            precos = self._precos[tipo]
+            vizinhas += self._zonas[tipo][bisect.bisect_left(precos, minimo):bisect.bisect_right(precos, maximo)]
+        return vizinhas
+
+    def confluencia(self, preco, tolerancia=TOLERANCIA_CONFLUENCIA):
+        """Timeframes com zona perto de preco e a soma dos seus pesos (cada timeframe conta uma vez)."""
+        tfs = sorted({zona['tf'] for zona in self.vizinhas(preco, tolerancia)},
+                     key=lambda tf: -PESOS_CONFLUENCIA.get(tf, 1))
+        return {'score': sum(PESOS_CONFLUENCIA.get(tf, 1) for tf in tfs), 'timeframes': tfs}
+
+    def to_list(self):
+        return [[zona['price'], zona['tf'], zona['type'], zona['candle']]
+                for tipo in self.TIPOS for zona in self._zonas[tipo]]
+
+    @classmethod
+    def from_list(cls, dados):
+        indice = cls()
+        for preco, tf, tipo, candle in dados:
+            indice.inserir(preco, tf, tipo, candle)
+        return indice
+
+
+_indices_zonas = {}
+_indices_zonas_alterados = set()
+_indices_zonas_lock = Lock()
+
+
+def _arquivo_zonas():
+    return os.path.join(CACHE_DIR, "zonas.json")
+
+
+def indice_zonas(nome):
+    """Índice de zonas do ativo (carregado do disco na primeira consulta)."""
+    with _indices_zonas_lock:
+        if not _indices_zonas and os.path.exists(_arquivo_zonas()):
+            try:
+                with open(_arquivo_zonas()) as f:
+                    for ativo, dados in json.load(f).items():
+                        _indices_zonas[ativo] = IndiceZonas.from_list(dados)
+            except Exception as e:
+                print(f"⚠️ Índice de zonas ignorado: {e}")
+        return _indices_zonas.setdefault(nome, IndiceZonas())
+
+
+def marcar_zonas_alteradas(nome):
+    with _indices_zonas_lock:
+        _indices_zonas_alterados.add(nome)
+
+
+def salvar_zonas():
+    """Grava o índice de todos os ativos, se algum mudou desde a última gravação."""
+    with _indices_zonas_lock:
+        if not _indices_zonas_alterados:
+            return
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            estado = {nome: indice.to_list() for nome, indice in _indices_zonas.items()}
+            with open(_arquivo_zonas() + ".tmp", "w") as f:
+                json.dump(estado, f)
+            os.replace(_arquivo_zonas() + ".tmp", _arquivo_zonas())
+            _indices_zonas_alterados.clear()
+        except Exception as e:
+            print(f"⚠️ Falha ao gravar o índice de zonas: {e}")
+
+
+def zonas_de_referencia(indice, preco):
+    """Suporte abaixo e resistência acima mais próximos do preço, com a confluência de cada um."""
+    referencias = {}
+    for lado, zona in (('suporte', indice.abaixo(preco)), ('resistencia', indice.acima(preco))):
+        if zona is not None:
+            referencias[lado] = {**zona, 'confluencia': indice.confluencia(zona['price'])}
+    return referencias
+
+# ===========================
+# 📈 INDICADORES (RSI-14 / EMA-21)
+# ===========================
+def calcular_indicadores(df):
+    """Cálculo em lote sobre todo o histórico (referência do motor incremental)."""
+    delta = df['close'].diff()
+    gain = delta.where(delta > 0, 0)
+    loss = (-delta).where(delta < 0, 0)
+    avg_gain = gain.rolling(14).mean()
+    avg_loss = loss.rolling(14).mean()
+    rs = avg_gain / avg_loss
+    df['rsi_14'] = 100 - (100 / (1 + rs))
+    df['ema_21'] = df['close'].ewm(span=21).mean()
+    return df
+
+
+class IndicadorIncremental:
+    """
+    Estado do RSI-14 (médias simples de ganhos/perdas) e da EMA-21
+    (ewm adjust=True) de um (ticker, timeframe). Cada barra fechada custa
+    O(1); a barra em formação é avaliada sem alterar o estado.
+    """
+
+    def __init__(self, periodo_rsi=14, span_ema=21):
+        self.periodo_rsi = periodo_rsi
+        self.span_ema = span_ema
+        self.ganhos = deque(maxlen=periodo_rsi)
+        self.perdas = deque(maxlen=periodo_rsi)
+        self.ultimo_close = math.nan
+        self.ema_num = 0.0
+        self.ema_den = 0.0
+        self.rsi = math.nan
+        self.ema = math.nan
+        self.barras_validas = 0  # barras com RSI e EMA definidos (o que sobra do dropna)
+        self.ultimo_ts = None
+
+    def _calcular(self, close):
+        delta = close - self.ultimo_close
+        ganho = delta if delta > 0 else 0.0  # NaN vira 0, como delta.where(...)
+        perda = -delta if delta < 0 else 0.0
+        if len(self.ganhos) >= self.periodo_rsi - 1:
+            janela = self.periodo_rsi - 1
+            media_ganho = (sum(list(self.ganhos)[-janela:]) + ganho) / self.periodo_rsi
+            media_perda = (sum(list(self.perdas)[-janela:]) + perda) / self.periodo_rsi
+            if media_perda == 0:
+                rsi = math.nan if media_ganho == 0 else 100.0
+            else:
+                rsi = 100 - (100 / (1 + media_ganho / media_perda))
+        else:
+            rsi = math.nan
+
+        decaimento = 1 - 2 / (self.span_ema + 1)
+        ema_num = self.ema_num * decaimento
+        ema_den = self.ema_den * decaimento
+        if not math.isnan(close):
+            ema_num += close
+            ema_den += 1.0
+        ema = ema_num / ema_den if ema_den > 0 else math.nan
+        return ganho, perda, ema_num, ema_den, rsi, ema
+
+    def _incorporar(self, close):
+        ganho, perda, self.ema_num, self.ema_den, self.rsi, self.ema = self._calcular(close)
+        self.ganhos.append(ganho)
+        self.perdas.append(perda)
+        self.ultimo_close = close
+        if not math.isnan(self.rsi) and not math.isnan(self.ema):
+            self.barras_validas += 1
+
+    def atualizar(self, ts, close):
+        """Incorpora uma barra fechada."""
+        self._incorporar(float(close))
+        self.ultimo_ts = pd.Timestamp(ts)
+
+    @classmethod
+    def reconstruir(cls, closes, ultimo_ts):
+        """Estado após todas as barras fechadas de closes (igual a atualizar barra a barra)."""
+        ind = cls()
+        for close in closes:
+            ind._incorporar(float(close))
+        ind.ultimo_ts = pd.Timestamp(ultimo_ts)
+        return ind
+
+    def espiar(self, close):
+        """(rsi, ema) de uma barra ainda em formação, sem alterar o estado."""
+        _, _, _, _, rsi, ema = self._calcular(float(close))
+        return rsi, ema
+
+    def to_dict(self):
+        return {
+            'periodo_rsi': self.periodo_rsi,
+            'span_ema': self.span_ema,
+            'ganhos': list(self.ganhos),
+            'perdas': list(self.perdas),
+            'ultimo_close': self.ultimo_close,
+            'ema_num': self.ema_num,
+            'ema_den': self.ema_den,
+            'rsi': self.rsi,
+            'ema': self.ema,
+            'barras_validas': self.barras_validas,
+            'ultimo_ts': self.ultimo_ts.isoformat() if self.ultimo_ts is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, dados):
+        ind = cls(dados['periodo_rsi'], dados['span_ema'])
+        ind.ganhos.extend(dados['ganhos'])
+        ind.perdas.extend(dados['perdas'])
+        ind.ultimo_close = dados['ultimo_close']
+        ind.ema_num = dados['ema_num']
+        ind.ema_den = dados['ema_den']
+        ind.rsi = dados['rsi']
+        ind.ema = dados['ema']
+        ind.barras_validas = dados['barras_validas']
+        ind.ultimo_ts = pd.Timestamp(dados['ultimo_ts']) if dados['ultimo_ts'] else None
+        return ind
+
+
+_indicadores = {}
+_indicadores_lock = Lock()
+
+
+def _arquivo_indicadores():
+    return os.path.join(CACHE_DIR, "indicadores.json")
+
+
+def _carregar_indicadores():
+    if _indicadores or not os.path.exists(_arquivo_indicadores()):
+        return
+    try:
+        with open(_arquivo_indicadores()) as f:
+            for chave, dados in json.load(f).items():
+                _indicadores[chave] = IndicadorIncremental.from_dict(dados)
+    except Exception as e:
+        print(f"⚠️ Estado dos indicadores ignorado: {e}")
+
+
+def salvar_indicadores():
+    with _indicadores_lock:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            estado = {chave: ind.to_dict() for chave, ind in _indicadores.items()}
+            with open(_arquivo_indicadores() + ".tmp", "w") as f:
+                json.dump(estado, f)
+            os.replace(_arquivo_indicadores() + ".tmp", _arquivo_indicadores())
+        except Exception as e:
+            print(f"⚠️ Falha ao gravar estado dos indicadores: {e}")
+
+
+def _estado_valido(ind, fechadas):
+    return ind is not None and ind.ultimo_ts in fechadas
+
+
+def estado_indicador(ticker, tf):
+    """Estado atual do motor incremental de (ticker, tf) em to_dict(), ou None."""
+    with _indicadores_lock:
+        _carregar_indicadores()
+        ind = _indicadores.get(f"{ticker}|{tf}")
+        return ind.to_dict() if ind is not None else None
+
 
-# 🌐 GitHub (para salvar o CSV)
-GITHUB_REPO_URL = f"https://{os.getenv('GITHUB_TOKEN')}@github.com/carpatia77/bwsystem-railway.git"
-GITHUB_BRANCH = "main"
+def instalar_indicadores(estados):
+    """Instala estados calculados fora do processo ({(ticker, tf): to_dict()})."""
+    with _indicadores_lock:
+        for (ticker, tf), estado in estados.items():
+            _indicadores[f"{ticker}|{tf}"] = IndicadorIncremental.from_dict(estado)
 
-# ===========================
-# 🌐 SERVIDOR WEB LEVE (Flask)
-# ===========================
-app = Flask(__name__)
 
-@app.route('/')
-def home():
-    return "<h1>🧠 Brandon Wendell System - GitHub Sync</h1><p>Status: Em execução</p>"
+def avancar_indicador(ind, close):
+    """
+    Leva ind até a penúltima barra de close (série com todas as barras, a
+    última ainda em formação) e avalia a barra em formação. Sem estado ou
+    com lacuna no histórico, reconstrói a partir da série inteira.
+    Retorna (ind, (rsi, ema, rsi_anterior, close_anterior, barras_validas)).
+    """
+    fechadas = close.iloc[:-1]
+    if not _estado_valido(ind, fechadas.index):
+        ind = (IndicadorIncremental.reconstruir(fechadas.to_numpy(dtype=float), fechadas.index[-1])
+               if len(fechadas) else IndicadorIncremental())
+    else:
+        for ts, valor in fechadas[fechadas.index > ind.ultimo_ts].items():
+            ind.atualizar(ts, valor)
+    rsi, ema = ind.espiar(close.iloc[-1])
+    validas = ind.barras_validas + (0 if math.isnan(rsi) or math.isnan(ema) else 1)
+    return ind, (rsi, ema, ind.rsi, ind.ultimo_close, validas)
 
-@app.route('/status')
-def status():
-    if os.path.exists(CSV_FILE):
-        try:
-            log = pd.read_csv(CSV_FILE)
-            ultimo = log.iloc[-1]
-            return jsonify({
-                "status": "running",
-                "last_signal": ultimo['sinal'],
-                "price": ultimo['preco'],
-                "timestamp": ultimo['timestamp']
-            })
-        except:
-            pass
-    return jsonify({"status": "running", "last_signal": "Aguardando sinal"})
+
+def indicadores_ultima_barra(df, ticker, tf):
+    """
+    Atualiza o motor incremental de (ticker, tf) com as barras fechadas
+    novas de df (todas menos a última) e avalia a barra em formação.
+    Retorna (rsi, ema, rsi_anterior, close_anterior, barras_validas).
+    """
+    chave = f"{ticker}|{tf}"
+    with _indicadores_lock:
+        _carregar_indicadores()
+        _indicadores[chave], valores = avancar_indicador(_indicadores.get(chave), df['close'])
+        return valores
 
 # ===========================
-# 📡 FUNÇÕES DE APOIO
+# 🧮 MOTOR DE ANÁLISE EM PROCESSOS
 # ===========================
-def enviar_telegram(msg):
-    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
-        print("ℹ️ Telegram desativado")
-        return
+def _abrir_memoria(nome):
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        data = {"chat_id": TELEGRAM_CHAT_ID, "text": msg, "parse_mode": "HTML"}
-        requests.post(url, data=data, timeout=10)
-        print("✅ Telegram enviado")
-    except Exception as e:
-        print(f"❌ Falha ao enviar Telegram: {e}")
+        return shared_memory.SharedMemory(name=nome, track=False)
+    except TypeError:
+        # Python < 3.13: workers do forkserver usam o resource_tracker do pai,
+        # e o registro repetido é ignorado; o unlink fica com quem criou
+        return shared_memory.SharedMemory(name=nome)
 
-# Criar CSV
-def criar_csv():
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, "w") as f:
-            f.write("timestamp,symbol,preco,sinal,tendencia,rsi_m15,stop_loss,zona_tipo,confianca\n")
-        print("✅ Arquivo CSV criado")
-        # Commit inicial
-        commit_csv_para_github("📊 CSV inicial criado")
 
-def salvar_sinal(sinal_data):
-    with open(CSV_FILE, "a") as f:
-        stop_loss_str = f"{sinal_data['stop_loss']:.2f}" if sinal_data['stop_loss'] is not None else "N/A"
-        zona_str = sinal_data.get('zona_tipo', 'N/A')
-        confianca_str = sinal_data.get('confianca', 'N/A')
-        row = f"{pd.Timestamp.now()},{sinal_data['symbol']},{sinal_data['preco']:.2f},"
-        row += f"{sinal_data['sinal']},{sinal_data['tendencia']},{sinal_data['rsi_m15']:.2f},"
-        row += f"{stop_loss_str},{zona_str},{confianca_str}\n"
-        f.write(row)
-    print(f"💾 Sinal salvo: {sinal_data['sinal']}")
-    
-    # ✅ Enviar para o GitHub após salvar
-    commit_csv_para_github(f"📊 Sinal gerado: {sinal_data['sinal']} | {sinal_data['preco']:.2f}")
+def _indice_tempos(tempos, tz):
+    indice = pd.DatetimeIndex(tempos.view('M8[ns]'))
+    return indice.tz_localize('UTC').tz_convert(tz) if tz is not None else indice
 
-# ===========================
-# 🔁 SALVAR CSV NO GITHUB
-# ===========================
-def commit_csv_para_github(mensagem_commit="📊 Atualização automática do sinal XAUUSD"):
+
+def _executar_tarefas(nome_memoria, total, tarefas):
     """
-    Faz git add, commit e push do CSV para o GitHub
+    Executado nos workers. Lê as barras (high, low, close, timestamp ns) do
+    bloco compartilhado sem copiá-las e devolve só o resultado compacto:
+    zonas em arrays com os padrões de cada timeframe estrutural, e estado
+    e valores da última barra de cada timeframe de indicadores.
     """
+    memoria = _abrir_memoria(nome_memoria)
     try:
-        # Configurar git
-        subprocess.run(['git', 'config', '--global', 'user.email', 'render@render.com'], check=True)
-        subprocess.run(['git', 'config', '--global', 'user.name', 'Render Bot'], check=True)
+        precos = np.ndarray((3, total), dtype=np.float64, buffer=memoria.buf)
+        tempos = np.ndarray((total,), dtype=np.int64, buffer=memoria.buf, offset=precos.nbytes)
+        resultados = []
+        for tarefa in tarefas:
+            inicio, fim = tarefa['inicio'], tarefa['inicio'] + tarefa['n']
+            # cópia: os objetos pandas não podem sobreviver ao close() do bloco
+            close = pd.Series(precos[2, inicio:fim].copy(),
+                              index=_indice_tempos(tempos[inicio:fim].copy(), tarefa['tz']))
+            if tarefa['tipo'] == 'zonas':
+                # indexação avançada: os arrays devolvidos já são cópias
+                arrays = zonas_em_arrays(precos[1, inicio:fim], precos[0, inicio:fim])
+                zonas = montar_zonas(close.index, *arrays)
+                tf = TIMEFRAMES_ESTRUTURAIS[tarefa['chave'][1]]['nome']
+                resultado = {'arrays': arrays, 'padroes': detectar_padroes_zona(close.to_frame('close'), zonas, tf)}
+            else:
+                estado = tarefa['estado']
+                ind, valores = avancar_indicador(IndicadorIncremental.from_dict(estado) if estado else None, close)
+                resultado = {'estado': ind.to_dict(), 'valores': valores}
+            resultados.append((tarefa['tipo'], tarefa['chave'], resultado))
+        del precos, tempos
+        return resultados
+    finally:
+        memoria.close()
 
-        # Verificar se estamos no diretório do repo
-        if not os.path.exists('.git'):
-            print("⚠️ Diretório .git não encontrado. Clonando o repositório...")
-            subprocess.run(['git', 'clone', GITHUB_REPO_URL, '/app'], check=True)
-            os.chdir('/app')
 
-        # Adicionar e commitar
-        subprocess.run(['git', 'add', CSV_FILE], check=True)
-        subprocess.run(['git', 'commit', '-m', mensagem_commit], check=True)
+def _aquecer_worker():
+    return os.getpid()
 
-        # Enviar para o GitHub
-        subprocess.run(['git', 'push', GITHUB_REPO_URL, GITHUB_BRANCH], check=True)
 
-        print("✅ CSV enviado para o GitHub com sucesso!")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erro no git: {e}")
-    except Exception as e:
-        print(f"❌ Falha ao enviar CSV para o GitHub: {e}")
+class MotorAnalise:
+    """
+    Distribui o trabalho de CPU de cada (instrumento, timeframe) por um pool
+    de processos: detecção de zonas e padrões nos timeframes estruturais, e
+    atualização incremental (ou reconstrução) dos indicadores nos demais. As
+    barras do ciclo vão num único bloco de memória compartilhada; os estados
+    dos indicadores vão junto de cada tarefa e voltam atualizados. O índice
+    de zonas e a montagem do sinal ficam no processo principal.
+    """
+
+    def __init__(self, processos=PROCESSOS_ANALISE, min_tarefas=2):
+        self.processos = processos
+        self.min_tarefas = min_tarefas
+        self._pool = None
+
+    @property
+    def ativo(self):
+        return self.processos > 1
+
+    def _executor(self):
+        if self._pool is None:
+            # forkserver evita herdar as threads (Flask, git, downloads) via fork
+            metodo = 'forkserver' if sys.platform != 'win32' else 'spawn'
+            contexto = get_context(metodo)
+            if metodo == 'forkserver':
+                # pandas e este módulo são importados uma vez no servidor, não em cada worker
+                contexto.set_forkserver_preload(sorted({'__main__', __name__}))
+            self._pool = ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto)
+        return self._pool
+
+    def aquecer(self):
+        """
+        Sobe o pool antes do primeiro ciclo. O forkserver importa pandas e
+        este módulo uma vez; os workers seguintes saem dele em milissegundos.
+        """
+        if not self.ativo:
+            return
+        inicio = time.perf_counter()
+        try:
+            self._executor().submit(_aquecer_worker).result()
+        except Exception as e:
+            print(f"⚠️ Motor de análise indisponível, calculando no processo principal: {e}")
+            return
+        print(f"🧮 Motor de análise pronto em {time.perf_counter() - inicio:.1f}s ({self.processos} processos)")
+
+    def encerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _planejar(self, barras):
+        series, tarefas = [], []
+        total = 0
+        for nome, por_chave in barras.items():
+            for key, (df, ticker) in por_chave.items():
+                if df.empty or not {'high', 'low', 'close'} <= set(normalizar_colunas(df).columns):
+                    continue
+                if key in TIMEFRAMES_ESTRUTURAIS and len(df) >= 10:
+                    tarefa = {'tipo': 'zonas', 'chave': (nome, key)}
+                elif key in TIMEFRAMES_INDICADORES and len(df) >= 15:
+                    tarefa = {'tipo': 'indicadores', 'chave': (ticker, key), 'estado': estado_indicador(ticker, key)}
+                else:
+                    continue
+                tz = str(df.index.tz) if getattr(df.index, 'tz', None) is not None else None
+                tarefa.update(inicio=total, n=len(df), tz=tz)
+                tarefas.append(tarefa)
+                series.append(df)
+                total += len(df)
+        return series, tarefas, total
+
+    def executar(self, barras):
+        """
+        barras: {nome: {chave: (df, ticker)}}. Retorna {'zonas': {nome: {chave:
+        {'arrays', 'padroes'}}}, 'indicadores': {(ticker, tf): {'estado',
+        'valores'}}}; vazio quando o motor está desligado ou há pouco trabalho
+        (o ciclo calcula no próprio processo).
+        """
+        calculado = {'zonas': {}, 'indicadores': {}}
+        if not self.ativo:
+            return calculado
+        series, tarefas, total = self._planejar(barras)
+        if len(tarefas) < self.min_tarefas:
+            return calculado
+
+        memoria = shared_memory.SharedMemory(create=True, size=max(1, 32 * total))
+        try:
+            precos = np.ndarray((3, total), dtype=np.float64, buffer=memoria.buf)
+            tempos = np.ndarray((total,), dtype=np.int64, buffer=memoria.buf, offset=precos.nbytes)
+            for tarefa, df in zip(tarefas, series):
+                inicio, fim = tarefa['inicio'], tarefa['inicio'] + tarefa['n']
+                precos[0, inicio:fim] = df['high'].to_numpy(dtype=float)
+                precos[1, inicio:fim] = df['low'].to_numpy(dtype=float)
+                precos[2, inicio:fim] = df['close'].to_numpy(dtype=float)
+                tempos[inicio:fim] = pd.DatetimeIndex(df.index).as_unit('ns').asi8
+            del precos, tempos
+
+            # Poucos lotes por worker: amortiza o IPC sem desbalancear
+            tamanho = max(1, math.ceil(len(tarefas) / (self.processos * 4)))
+            futuros = [self._executor().submit(_executar_tarefas, memoria.name, total, tarefas[i:i + tamanho])
+                       for i in range(0, len(tarefas), tamanho)]
+            for futuro in futuros:
+                for tipo, chave, resultado in futuro.result():
+                    if tipo == 'zonas':
+                        calculado['zonas'].setdefault(chave[0], {})[chave[1]] = resultado
+                    else:
+                        calculado['indicadores'][chave] = resultado
+        except Exception as e:
+            print(f"⚠️ Motor de análise indisponível, calculando no processo principal: {e}")
+            return {'zonas': {}, 'indicadores': {}}
+        finally:
+            memoria.close()
+            memoria.unlink()
+        return calculado
+
+
+motor_analise = MotorAnalise()
 
 # ===========================
-# 🔍 DOWNLOAD ROBUSTO
+# 🧭 REGRAS DE DECISÃO (FUNÇÃO PURA)
 # ===========================
-def download_robusto(period, interval, max_attempts=6):
-    import random
-    from requests import Session
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
-
-    session = Session()
-    retry_strategy = Retry(
-        total=max_attempts,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+SINAL_AGUARDAR = 0
+SINAL_COMPRA = 1
+SINAL_AGUARDAR_SUPORTE = 2
+SINAL_NAO_COMPRAR = 3
+SINAL_VENDA = -1
+SINAL_AGUARDAR_RESISTENCIA = -2
+SINAL_NAO_VENDER = -3
 
-    for tentativa in range(max_attempts):
-        for ticker in SYMBOLS:
-            try:
-                user_agent = f'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{random.randint(80, 120)}.0.0.0 Safari/537.36'
-                session.headers.update({'User-Agent': user_agent})
+SINAIS_TEXTO = {
+    SINAL_AGUARDAR: "⚪ AGUARDAR: Estrutura de mercado não confirmada",
+    SINAL_COMPRA: "🟢 COMPRA: Zona de Acumulação (W Base) Confirmada",
+    SINAL_AGUARDAR_SUPORTE: "🟡 AGUARDAR: Preço distante da zona de suporte estrutural",
+    SINAL_NAO_COMPRAR: "❌ NÃO COMPRAR: Momentum muito fraco (RSI < 40)",
+    SINAL_VENDA: "🔴 VENDA: Zona de Distribuição (M Base) Confirmada",
+    SINAL_AGUARDAR_RESISTENCIA: "🟡 AGUARDAR: Preço distante da zona de resistência estrutural",
+    SINAL_NAO_VENDER: "❌ NÃO VENDER: Momentum muito forte (RSI > 60)",
+}
 
-                print(f"📥 Tentativa {tentativa+1}/{max_attempts} - {ticker} ({interval})...")
-                df = yf.download(ticker, period=period, interval=interval, progress=False, session=session)
 
-                if not df.empty and len(df) >= 15:
-                    print(f"✅ Sucesso com {ticker}")
-                    return df, ticker
+def _valor_ou_nan(valor):
+    return np.nan if valor is None else float(valor)
 
-            except Exception as e:
-                print(f"❌ Falha com {ticker}: {e}")
-                continue
 
-            time.sleep(random.uniform(2, 5))
+def avaliar_sinais(d1_close, d1_ema, d1_rsi, h4_close, h4_ema, h4_rsi, m15_close, m15_rsi,
+                   buy_zone, sell_zone, suporte_h4, resistencia_h4,
+                   distancia_max=0.008, rsi_compra_min=40, rsi_venda_max=60):
+    """
+    Regras Brandon Wendell sem efeitos colaterais. Aceita escalares ou
+    arrays NumPy (uma posição por barra), o que permite o mesmo código no
+    ciclo ao vivo e no backtest. Suporte/resistência ausentes devem vir
+    como NaN. Retorna (codigo SINAL_*, tendencia 1/-1/0).
+    """
+    d1_close, d1_ema, d1_rsi, h4_close, h4_ema, h4_rsi, m15_close, m15_rsi, suporte_h4, resistencia_h4 = (
+        np.asarray(x, dtype=float) for x in
+        (d1_close, d1_ema, d1_rsi, h4_close, h4_ema, h4_rsi, m15_close, m15_rsi, suporte_h4, resistencia_h4))
+    buy_zone = np.asarray(buy_zone, dtype=bool)
+    sell_zone = np.asarray(sell_zone, dtype=bool)
+
+    d1_bullish = (d1_rsi > 50) & (d1_close > d1_ema)
+    d1_bearish = (d1_rsi < 50) & (d1_close < d1_ema)
+    h4_bullish = (h4_rsi > 50) & (h4_close > h4_ema)
+    h4_bearish = (h4_rsi < 50) & (h4_close < h4_ema)
 
-        if tentativa < max_attempts - 1:
-            wait = (2 ** tentativa) + random.uniform(0, 10)
-            print(f"🔁 Esperando {wait:.1f}s...")
-            time.sleep(wait)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distancia_suporte = np.where(np.isnan(suporte_h4) | (suporte_h4 == 0), 1,
+                                     np.abs(m15_close - suporte_h4) / suporte_h4)
+        distancia_resistencia = np.where(np.isnan(resistencia_h4) | (resistencia_h4 == 0), 1,
+                                         np.abs(m15_close - resistencia_h4) / resistencia_h4)
 
-    print("❌ Falha crítica: Não foi possível baixar dados.")
-    return pd.DataFrame(), None
+    contexto_compra = d1_bullish & h4_bullish & buy_zone
+    contexto_venda = ~contexto_compra & d1_bearish & h4_bearish & sell_zone
+    perto_suporte = distancia_suporte < distancia_max
+    perto_resistencia = distancia_resistencia < distancia_max
+
+    codigo = np.select(
+        [contexto_compra & perto_suporte & (m15_rsi >= rsi_compra_min),
+         contexto_compra & (distancia_suporte >= distancia_max),
+         contexto_compra,
+         contexto_venda & perto_resistencia & (m15_rsi <= rsi_venda_max),
+         contexto_venda & (distancia_resistencia >= distancia_max),
+         contexto_venda],
+        [SINAL_COMPRA, SINAL_AGUARDAR_SUPORTE, SINAL_NAO_COMPRAR,
+         SINAL_VENDA, SINAL_AGUARDAR_RESISTENCIA, SINAL_NAO_VENDER],
+        default=SINAL_AGUARDAR)
+    tendencia = np.select([d1_bullish & h4_bullish, d1_bearish & h4_bearish], [1, -1], default=0)
+    return codigo, tendencia
 
 # ===========================
-# 🔍 DETECÇÃO DE ZONAS ESTRUTURAIS
+# 📝 MENSAGEM DO TELEGRAM
 # ===========================
-def detectar_zonas(df, window=3, min_distance=3):
-    swing_lows = []
-    swing_highs = []
-    for i in range(window, len(df) - window):
-        low = df['low'].iloc[i]
-        high = df['high'].iloc[i]
-        if low == df['low'].iloc[i-window:i+window+1].min():
-            swing_lows.append({
-                'index': i,
-                'price': low,
-                'type': 'support',
-                'candle': df.index[i]
-            })
-        if high == df['high'].iloc[i-window:i+window+1].max():
-            swing_highs.append({
-                'index': i,
-                'price': high,
-                'type': 'resistance',
-                'candle': df.index[i]
-            })
-
-    def filtrar_proximos(zonas):
-        if not zonas:
-            return []
-        zonas_ordenadas = sorted(zonas, key=lambda x: x['index'])
-        filtradas = [zonas_ordenadas[0]]
-        for zona in zonas_ordenadas[1:]:
-            ultima = filtradas[-1]
-            if abs(zona['index'] - ultima['index']) >= min_distance and \
-               abs(zona['price'] - ultima['price']) / ultima['price'] > 0.001:
-                filtradas.append(zona)
-        return filtradas
+def tendencia_descricao(preco, ema, rsi):
+    if preco > ema and rsi > 50:
+        return "🟢 Bullish (momentum positivo)"
+    elif preco < ema and rsi < 50:
+        return "🔴 Bearish (momentum negativo)"
+    else:
+        return "🟡 Neutro (sem direção clara)"
 
-    return {
-        'suportes': filtrar_proximos(swing_lows),
-        'resistencias': filtrar_proximos(swing_highs)
-    }
 
-def detectar_padroes_zona(df, zonas, tf):
-    padroes = []
-    suportes = zonas['suportes']
-    resistencias = zonas['resistencias']
-    if len(suportes) >= 2:
-        ultimo = suportes[-1]
-        penultimo = suportes[-2]
-        if ultimo['price'] > penultimo['price'] and ultimo['index'] - penultimo['index'] > 5:
-            volatilidade = df['close'].iloc[penultimo['index']:ultimo['index']].std() / df['close'].mean()
-            if volatilidade < 0.015:
-                confianca = 'alta' if volatilidade < 0.01 else 'média'
-                padroes.append({
-                    'tipo': 'W_base',
-                    'zona': ultimo['price'],
-                    'confianca': confianca,
-                    'periodo': f"{penultimo['candle'].strftime('%d/%m')} → {ultimo['candle'].strftime('%d/%m')}",
-                    'tf': tf
-                })
-    if len(resistencias) >= 2:
-        ultimo = resistencias[-1]
-        penultimo = resistencias[-2]
-        if ultimo['price'] < penultimo['price'] and ultimo['index'] - penultimo['index'] > 5:
-            volatilidade = df['close'].iloc[penultimo['index']:ultimo['index']].std() / df['close'].mean()
-            if volatilidade < 0.015:
-                confianca = 'alta' if volatilidade < 0.01 else 'média'
-                padroes.append({
-                    'tipo': 'M_base',
-                    'zona': ultimo['price'],
-                    'confianca': confianca,
-                    'periodo': f"{penultimo['candle'].strftime('%d/%m')} → {ultimo['candle'].strftime('%d/%m')}",
-                    'tf': tf
-                })
-    return padroes
+def montar_mensagem(dados, zonas_estruturais, sinal, zona_info,
+                    buy_zone_convergente, sell_zone_convergente, stop_buy, stop_sell, nome=NAME):
+    w1 = dados.get('w1')
+    d1 = dados['d1']
+    h4 = dados['h4']
+    m15 = dados['m15']
+    w1_rsi = float(w1['rsi_14']) if w1 is not None else None
+    d1_rsi = float(d1['rsi_14'])
+    h4_rsi = float(h4['rsi_14'])
+    m15_rsi = float(m15['rsi_14'])
+    preco_atual = m15['close']
 
-def analisar_zonas_estruturais():
-    timeframes = {
-        'W1': {'interval': '1wk', 'period': '5y', 'nome': 'W1'},
-        'D1': {'interval': '1d', 'period': '2y', 'nome': 'D1'},
-        'H4': {'interval': '4h', 'period': '6mo', 'nome': 'H4'}
-    }
-    resultados = {}
-    for key, config in timeframes.items():
-        try:
-            df, ticker_usado = download_robusto(config['period'], config['interval'])
-            if df.empty or len(df) < 10:
-                continue
-            if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.get_level_values(0)
-            df.columns = df.columns.str.lower().str.strip()
-            zonas = detectar_zonas(df)
-            padroes = detectar_padroes_zona(df, zonas, config['nome'])
-            resultados[key] = {
-                'df': df,
-                'zonas': zonas,
-                'padroes': padroes,
-                'suporte_recente': zonas['suportes'][-1]['price'] if zonas['suportes'] else None,
-                'resistencia_recente': zonas['resistencias'][-1]['price'] if zonas['resistencias'] else None,
-                'ticker': ticker_usado
-            }
-        except Exception as e:
-            print(f"❌ Erro na análise de zonas ({key}): {e}")
-            continue
-    return resultados
+    w1_tendencia = tendencia_descricao(w1['close'], w1['ema_21'], w1_rsi) if w1 is not None else "N/A"
+    d1_tendencia = tendencia_descricao(d1['close'], d1['ema_21'], d1_rsi)
+    h4_tendencia = tendencia_descricao(h4['close'], h4['ema_21'], h4_rsi)
+    m15_tendencia = tendencia_descricao(m15['close'], m15['ema_21'], m15_rsi)
+
+    msg = f"🪙 <b>{nome}</b> | Análise Estrutural\n"
+    msg += f"{'='*40}\n"
+    msg += "📊 <b>TENDÊNCIAS POR TIMEFRAME</b>\n"
+    if w1 is not None:
+        msg += f"• W1: {w1_tendencia} (RSI={w1_rsi:.1f})\n"
+    msg += f"• D1: {d1_tendencia} (RSI={d1_rsi:.1f})\n"
+    msg += f"• H4: {h4_tendencia} (RSI={h4_rsi:.1f})\n"
+    msg += f"• M15: {m15_tendencia} (RSI={m15_rsi:.1f})\n"
+    msg += f"\n🎯 <b>{sinal}</b>\n"
+    msg += f"💰 Preço atual: <b>{preco_atual:.2f}</b>\n"
+    
+    if buy_zone_convergente:
+        msg += f"\n🔍 <b>ZONA DE ACUMULAÇÃO (W BASE)</b>\n"
+        msg += "• Estrutura de suporte identificada\n"
+        msg += "• Alta probabilidade de reversão\n"
+    
+    if sell_zone_convergente:
+        msg += f"\n🔍 <b>ZONA DE DISTRIBUIÇÃO (M BASE)</b>\n"
+        msg += "• Estrutura de resistência identificada\n"
+        msg += "• Alta probabilidade de reversão\n"
+    
+    if "COMPRA" in sinal:
+        suporte = zona_info.get('zona_preco')
+        if suporte is None:
+            suporte = zonas_estruturais.get('H4', {}).get('suporte_recente')
+        msg += f"\n✅ <b>RECOMENDAÇÃO DE COMPRA</b>\n"
+        if suporte is not None:
+            msg += f"• Entrar próximo a <b>{suporte:.2f}</b>\n"
+        msg += f"• Stop-loss: {stop_buy:.2f}\n"
+        msg += f"• Confiança: <b>{zona_info.get('confianca', 'média').upper()}</b>\n"
+        if 'confluencia' in zona_info:
+            confluencia = zona_info['confluencia']
+            msg += f"• Confluência: {'+'.join(confluencia['timeframes']) or '—'} (score {confluencia['score']})\n"
+    elif "VENDA" in sinal:
+        resistencia = zona_info.get('zona_preco')
+        if resistencia is None:
+            resistencia = zonas_estruturais.get('H4', {}).get('resistencia_recente')
+        msg += f"\n✅ <b>RECOMENDAÇÃO DE VENDA</b>\n"
+        if resistencia is not None:
+            msg += f"• Entrar próximo a <b>{resistencia:.2f}</b>\n"
+        msg += f"• Stop-loss: {stop_sell:.2f}\n"
+        msg += f"• Confiança: <b>{zona_info.get('confianca', 'média').upper()}</b>\n"
+        if 'confluencia' in zona_info:
+            confluencia = zona_info['confluencia']
+            msg += f"• Confluência: {'+'.join(confluencia['timeframes']) or '—'} (score {confluencia['score']})\n"
+    elif "AGUARDAR" in sinal:
+        msg += f"\nℹ️ <b>ESTRATÉGIA</b>\n"
+        msg += "• Não force entrada\n"
+        msg += "• Aguarde o preço retornar à zona\n"
+    
+    msg += f"\n📌 Fonte: Brandon Wendell + Análise Estrutural\n"
+    msg += f"⏱️ Atualizado: {relogio.agora().strftime('%H:%M %d/%m')}"
+    return msg
 
 # ===========================
 # 🔍 ANÁLISE MULTITIMEFRAME (PRINCIPAL)
 # ===========================
-def analisar_xauusd():
-    print(f"\n🪙 {datetime.now().strftime('%H:%M:%S')} | Análise Estrutural: {NAME}")
-    
-    zonas_estruturais = analisar_zonas_estruturais()
+def analisar_instrumento(nome, barras, zonas_calculadas=None, reaproveitadas=None, indicadores_calculados=None):
+    """
+    Análise estrutural de um instrumento a partir das barras já baixadas
+    ({chave: (df, ticker)}). indicadores_calculados: {(ticker, tf): {'valores':
+    ...}} do motor de análise. Retorna sinal, mensagem e registro, ou None.
+    """
+    indicadores_calculados = indicadores_calculados or {}
+    if any(key not in barras for key in TIMEFRAMES_OBRIGATORIOS):
+        print(f"⚠️ Dados insuficientes ({nome}). Aguardando próxima verificação.")
+        return None
+
+    zonas_estruturais = analisar_zonas_estruturais(barras, zonas_calculadas, reaproveitadas)
     if not zonas_estruturais:
         print("⚠️ Falha ao analisar zonas estruturais")
         return None
@@ -295,17 +2727,12 @@ def analisar_xauusd():
     buy_zone_convergente = any(p['tipo'] == 'W_base' for p in w1_padroes + d1_padroes + h4_padroes)
     sell_zone_convergente = any(p['tipo'] == 'M_base' for p in w1_padroes + d1_padroes + h4_padroes)
     
-    timeframes = {
-        'w1': {'interval': '1wk', 'period': '5y', 'nome': 'W1'},
-        'd1': {'interval': '1d', 'period': '3mo', 'nome': 'D1'},
-        'h4': {'interval': '4h', 'period': '3mo', 'nome': 'H4'},
-        'm15': {'interval': '15m', 'period': '6d', 'nome': 'M15'}
-    }
-    
     dados = {}
-    for key, config in timeframes.items():
+    for key in TIMEFRAMES_INDICADORES:
         try:
-            df, ticker_usado = download_robusto(config['period'], config['interval'])
+            if key not in barras:
+                continue
+            df, ticker_usado = barras[key]
             if df.empty or len(df) < 15:
                 continue
 
@@ -313,38 +2740,42 @@ def analisar_xauusd():
                 df.columns = df.columns.get_level_values(0)
             df.columns = df.columns.str.lower().str.strip()
 
-            delta = df['close'].diff()
-            gain = delta.where(delta > 0, 0)
-            loss = (-delta).where(delta < 0, 0)
-            avg_gain = gain.rolling(14).mean()
-            avg_loss = loss.rolling(14).mean()
-            rs = avg_gain / avg_loss
-            df['rsi_14'] = 100 - (100 / (1 + rs))
-            df['ema_21'] = df['close'].ewm(span=21).mean()
-            df.dropna(inplace=True)
-
-            if df.empty:
-                continue
+            if (ticker_usado, key) in indicadores_calculados:
+                rsi, ema, rsi_anterior, close_anterior, validas = \
+                    indicadores_calculados[(ticker_usado, key)]['valores']
+            else:
+                with metricas.medir('bw_etapa_duracao_segundos', etapa='indicadores', tf=key):
+                    rsi, ema, rsi_anterior, close_anterior, validas = \
+                        indicadores_ultima_barra(df, ticker_usado, key)
+            posicao = len(df) - 1
+            if math.isnan(rsi) or math.isnan(ema):
+                # RSI indefinido na barra atual: recorre ao cálculo em lote, só sobre os fechamentos
+                calculado = calcular_indicadores(df[['close']].astype(float))
+                calculado = calculado[df.notna().all(axis=1)].dropna()
+                if len(calculado) < 2:
+                    continue
+                rsi, ema = calculado['rsi_14'].iloc[-1], calculado['ema_21'].iloc[-1]
+                rsi_anterior, close_anterior = calculado['rsi_14'].iloc[-2], calculado['close'].iloc[-2]
+                validas = len(calculado)
+                posicao = df.index.get_loc(calculado.index[-1])
 
-            df['divergencia'] = None
-            if key == 'm15':
-                close = df['close'].tail(5).values
-                rsi_vals = df['rsi_14'].tail(5).values
-                if len(close) == 5:
-                    if close[-1] < close[-2] and rsi_vals[-1] > rsi_vals[-2]:
-                        df['divergencia'] = "bullish_divergence"
-                    elif close[-1] > close[-2] and rsi_vals[-1] < rsi_vals[-2]:
-                        df['divergencia'] = "bearish_divergence"
+            # Só a última barra sai do df (valores escalares, sem colunas novas no histórico)
+            linha = dict(zip(df.columns, df.iloc[posicao].tolist()))
+            linha.update(rsi_14=float(rsi), ema_21=float(ema), divergencia=None, ticker=ticker_usado)
+            if key == 'm15' and validas >= 5:
+                if linha['close'] < close_anterior and rsi > rsi_anterior:
+                    linha['divergencia'] = "bullish_divergence"
+                elif linha['close'] > close_anterior and rsi < rsi_anterior:
+                    linha['divergencia'] = "bearish_divergence"
 
-            dados[key] = df.iloc[-1].copy()
-            dados[key]['ticker'] = ticker_usado
+            dados[key] = linha
 
         except Exception as e:
             print(f"❌ Erro no timeframe {key}: {e}")
             continue
 
     if 'd1' not in dados or 'h4' not in dados or 'm15' not in dados:
-        print("⚠️ Dados insuficientes. Aguardando próxima verificação.")
+        print(f"⚠️ Dados insuficientes ({nome}). Aguardando próxima verificação.")
         return None
 
     w1 = dados.get('w1')
@@ -364,123 +2795,220 @@ def analisar_xauusd():
     preco_atual = m15['close']
     stop_buy = m15['low'] * 0.995 if pd.notna(m15['low']) else None
     stop_sell = m15['high'] * 1.005 if pd.notna(m15['high']) else None
-    sinal = None
     zona_info = {}
 
-    def tendencia_descricao(preco, ema, rsi):
-        if preco > ema and rsi > 50:
-            return "🟢 Bullish (momentum positivo)"
-        elif preco < ema and rsi < 50:
-            return "🔴 Bearish (momentum negativo)"
-        else:
-            return "🟡 Neutro (sem direção clara)"
-
-    w1_tendencia = tendencia_descricao(w1['close'], w1['ema_21'], w1_rsi) if w1 is not None else "N/A"
-    d1_tendencia = tendencia_descricao(d1['close'], d1['ema_21'], d1_rsi)
-    h4_tendencia = tendencia_descricao(h4['close'], h4['ema_21'], h4_rsi)
-    m15_tendencia = tendencia_descricao(m15['close'], m15['ema_21'], m15_rsi)
+    indice = indice_zonas(nome)
+    mudancas = 0
+    for key, zona in zonas_estruturais.items():
+        if key in (reaproveitadas or {}):
+            continue  # já incorporadas ao índice no ciclo em que foram calculadas
+        mudancas += indice.substituir(TIMEFRAMES_ESTRUTURAIS[key]['nome'], zona['zonas'])
+    if mudancas:
+        marcar_zonas_alteradas(nome)
+    referencias = zonas_de_referencia(indice, float(preco_atual))
 
-    d1_bullish = d1_rsi > 50 and d1['close'] > d1['ema_21']
-    d1_bearish = d1_rsi < 50 and d1['close'] < d1['ema_21']
-    h4_bullish = h4_rsi > 50 and h4['close'] > h4['ema_21']
-    h4_bearish = h4_rsi < 50 and h4['close'] < h4['ema_21']
-
-    if d1_bullish and h4_bullish and buy_zone_convergente:
-        distancia_suporte = abs(preco_atual - zonas_estruturais['H4']['suporte_recente']) / zonas_estruturais['H4']['suporte_recente'] if zonas_estruturais['H4']['suporte_recente'] else 1
-        if distancia_suporte < 0.008 and m15_rsi >= 40:
-            sinal = "🟢 COMPRA: Zona de Acumulação (W Base) Confirmada"
-            zona_info = {
-                'zona_tipo': 'W_base',
-                'confianca': 'alta' if any(p['confianca'] == 'alta' for p in h4_padroes + d1_padroes) else 'média'
-            }
-            if m15['divergencia'] == "bullish_divergence":
-                sinal += " + DIVERGÊNCIA BULLISH"
-        elif distancia_suporte >= 0.008:
-            sinal = "🟡 AGUARDAR: Preço distante da zona de suporte estrutural"
-        else:
-            sinal = "❌ NÃO COMPRAR: Momentum muito fraco (RSI < 40)"
-    elif d1_bearish and h4_bearish and sell_zone_convergente:
-        distancia_resistencia = abs(preco_atual - zonas_estruturais['H4']['resistencia_recente']) / zonas_estruturais['H4']['resistencia_recente'] if zonas_estruturais['H4']['resistencia_recente'] else 1
-        if distancia_resistencia < 0.008 and m15_rsi <= 60:
-            sinal = "🔴 VENDA: Zona de Distribuição (M Base) Confirmada"
-            zona_info = {
-                'zona_tipo': 'M_base',
-                'confianca': 'alta' if any(p['confianca'] == 'alta' for p in h4_padroes + d1_padroes) else 'média'
-            }
-            if m15['divergencia'] == "bearish_divergence":
-                sinal += " + DIVERGÊNCIA BEARISH"
-        elif distancia_resistencia >= 0.008:
-            sinal = "🟡 AGUARDAR: Preço distante da zona de resistência estrutural"
-        else:
-            sinal = "❌ NÃO VENDER: Momentum muito forte (RSI > 60)"
+    h4_zonas = zonas_estruturais.get('H4', {})
+    if ZONA_REFERENCIA == 'indice':
+        suporte = referencias.get('suporte', {}).get('price')
+        resistencia = referencias.get('resistencia', {}).get('price')
     else:
-        sinal = "⚪ AGUARDAR: Estrutura de mercado não confirmada"
+        suporte, resistencia = h4_zonas.get('suporte_recente'), h4_zonas.get('resistencia_recente')
+    codigo, tendencia = avaliar_sinais(
+        d1['close'], d1['ema_21'], d1_rsi,
+        h4['close'], h4['ema_21'], h4_rsi,
+        preco_atual, m15_rsi,
+        buy_zone_convergente, sell_zone_convergente,
+        _valor_ou_nan(suporte), _valor_ou_nan(resistencia)
+    )
+    codigo, tendencia = int(codigo), int(tendencia)
+    sinal = SINAIS_TEXTO[codigo]
+    confianca = 'alta' if any(p['confianca'] == 'alta' for p in h4_padroes + d1_padroes) else 'média'
+    if codigo == SINAL_COMPRA:
+        zona_info = {'zona_tipo': 'W_base', 'confianca': confianca, 'zona_preco': suporte}
+        if m15['divergencia'] == "bullish_divergence":
+            sinal += " + DIVERGÊNCIA BULLISH"
+    elif codigo == SINAL_VENDA:
+        zona_info = {'zona_tipo': 'M_base', 'confianca': confianca, 'zona_preco': resistencia}
+        if m15['divergencia'] == "bearish_divergence":
+            sinal += " + DIVERGÊNCIA BEARISH"
+    if zona_info.get('zona_preco') is not None:
+        # Confluência do nível recomendado (não necessariamente a zona indexada mais próxima)
+        zona_info['confluencia'] = indice.confluencia(float(zona_info['zona_preco']))
 
-    msg = f"🪙 <b>{NAME}</b> | Análise Estrutural\n"
-    msg += f"{'='*40}\n"
-    msg += "📊 <b>TENDÊNCIAS POR TIMEFRAME</b>\n"
-    if w1 is not None:
-        msg += f"• W1: {w1_tendencia} (RSI={w1_rsi:.1f})\n"
-    msg += f"• D1: {d1_tendencia} (RSI={d1_rsi:.1f})\n"
-    msg += f"• H4: {h4_tendencia} (RSI={h4_rsi:.1f})\n"
-    msg += f"• M15: {m15_tendencia} (RSI={m15_rsi:.1f})\n"
-    msg += f"\n🎯 <b>{sinal}</b>\n"
-    msg += f"💰 Preço atual: <b>{preco_atual:.2f}</b>\n"
-    
-    if buy_zone_convergente:
-        msg += f"\n🔍 <b>ZONA DE ACUMULAÇÃO (W BASE)</b>\n"
-        msg += "• Estrutura de suporte identificada\n"
-        msg += "• Alta probabilidade de reversão\n"
-    
-    if sell_zone_convergente:
-        msg += f"\n🔍 <b>ZONA DE DISTRIBUIÇÃO (M BASE)</b>\n"
-        msg += "• Estrutura de resistência identificada\n"
-        msg += "• Alta probabilidade de reversão\n"
-    
-    if "COMPRA" in sinal:
-        suporte = zonas_estruturais['H4']['suporte_recente']
-        msg += f"\n✅ <b>RECOMENDAÇÃO DE COMPRA</b>\n"
-        msg += f"• Entrar próximo a <b>{suporte:.2f}</b>\n"
-        msg += f"• Stop-loss: {stop_buy:.2f}\n"
-        msg += f"• Confiança: <b>{zona_info.get('confianca', 'média').upper()}</b>\n"
-    elif "VENDA" in sinal:
-        resistencia = zonas_estruturais['H4']['resistencia_recente']
-        msg += f"\n✅ <b>RECOMENDAÇÃO DE VENDA</b>\n"
-        msg += f"• Entrar próximo a <b>{resistencia:.2f}</b>\n"
-        msg += f"• Stop-loss: {stop_sell:.2f}\n"
-        msg += f"• Confiança: <b>{zona_info.get('confianca', 'média').upper()}</b>\n"
-    elif "AGUARDAR" in sinal:
-        msg += f"\nℹ️ <b>ESTRATÉGIA</b>\n"
-        msg += "• Não force entrada\n"
-        msg += "• Aguarde o preço retornar à zona\n"
-    
-    msg += f"\n📌 Fonte: Brandon Wendell + Análise Estrutural\n"
-    msg += f"⏱️ Atualizado: {datetime.now().strftime('%H:%M %d/%m')}"
+    with metricas.medir('bw_etapa_duracao_segundos', etapa='mensagem'):
+        msg = montar_mensagem(dados, zonas_estruturais, sinal, zona_info,
+                              buy_zone_convergente, sell_zone_convergente, stop_buy, stop_sell, nome)
 
-    enviar_telegram(msg)
-    print(f"✅ Análise concluída | Sinal: {sinal}")
-    
-    salvar_sinal({
-        'symbol': NAME,
+    registro = {
+        'symbol': nome,
         'preco': preco_atual,
         'sinal': sinal,
-        'tendencia': 'bullish' if d1_bullish and h4_bullish else 'bearish' if d1_bearish and h4_bearish else 'neutro',
+        'tendencia': {1: 'bullish', -1: 'bearish'}.get(tendencia, 'neutro'),
         'rsi_m15': m15_rsi,
         'stop_loss': stop_buy if "COMPRA" in sinal else stop_sell if "VENDA" in sinal else None,
         'zona_tipo': zona_info.get('zona_tipo', 'N/A'),
         'confianca': zona_info.get('confianca', 'N/A')
-    })
+    }
+    timeframes = {key: {
+        'ticker': linha['ticker'],
+        'preco': _json_float(linha['close']),
+        'rsi': _json_float(linha['rsi_14']),
+        'ema': _json_float(linha['ema_21']),
+        'tendencia': tendencia_descricao(linha['close'], linha['ema_21'], float(linha['rsi_14']))
+    } for key, linha in dados.items()}
+    return {'sinal': sinal, 'codigo': codigo, 'msg': msg, 'registro': registro,
+            'zonas': zonas_estruturais, 'timeframes': timeframes, 'referencias': referencias}
+
+
+def resumo_zonas(zonas_estruturais):
+    """Zonas de cada timeframe estrutural em forma serializável (para /status e /stream)."""
+    return {key: {
+        'suporte': _json_float(zona['suporte_recente']),
+        'resistencia': _json_float(zona['resistencia_recente']),
+        'padroes': [{**padrao, 'zona': _json_float(padrao['zona'])} for padrao in zona['padroes']]
+    } for key, zona in zonas_estruturais.items()}
+
+
+# ===========================
+# 🕯️ AGENDAMENTO POR FECHAMENTO DE BARRA
+# ===========================
+_ultimo_ciclo = {}  # nome -> {'assinaturas': {chave: ...}, 'zonas': {...}}
 
-    return sinal
+
+def assinatura_barras(df, so_fechadas=False):
+    """
+    Identifica o conteúdo que a análise vê: janela e última barra (inclusive
+    a em formação). Com so_fechadas, a barra em formação fica de fora: as
+    zonas de um timeframe estrutural só são recalculadas quando uma barra
+    dele fecha, não a cada tick da barra em andamento.
+    """
+    if so_fechadas:
+        df = df.iloc[:-1]
+    if df.empty:
+        return None
+    return len(df), df.index[0], df.index[-1], df.iloc[-1].to_numpy(dtype=float).tobytes()
+
+
+def proximo_fechamento(agora=None, intervalo=CHECK_INTERVAL, graca=GRACA_FECHAMENTO):
+    """Epoch do próximo fechamento de barra de `intervalo` segundos, somada a carência."""
+    agora = relogio.time() if agora is None else agora
+    return ((agora - graca) // intervalo + 1) * intervalo + graca
+
+
+def barras_fechadas(instante, graca=GRACA_FECHAMENTO):
+    """Timeframes cuja barra fecha em `instante` (H4/D1/W1 alinhados à abertura da sessão)."""
+    fechamento = pd.Timestamp(instante - graca, unit='s', tz='UTC').tz_convert(SESSAO_TZ)
+    fechados = ['M15']
+    if fechamento.minute == 0 and (fechamento.hour - SESSAO_INICIO_HORA) % 4 == 0:
+        fechados.append('H4')
+        if fechamento.hour == SESSAO_INICIO_HORA:
+            fechados.append('D1')
+            if fechamento.dayofweek == 6:  # sessão semanal abre domingo
+                fechados.append('W1')
+    return fechados
+
+
+@metricas.cronometrar('bw_ciclo_duracao_segundos')
+def analisar_watchlist(instrumentos=None):
+    """
+    Um ciclo sobre todos os instrumentos: downloads em lote por intervalo,
+    análise por instrumento e sinais salvos por símbolo. Com mais de um
+    instrumento, só COMPRA/VENDA vão para o Telegram. Retorna {nome: sinal}.
+    """
+    instrumentos = instrumentos or WATCHLIST
+    ativos = ', '.join(instrumentos) if len(instrumentos) <= 5 else f"{len(instrumentos)} ativos"
+    print(f"\n🪙 {relogio.agora().strftime('%H:%M:%S')} | Análise Estrutural: {ativos}")
+
+    baixar = baixar_timeframes_reamostrados if MODO_REAMOSTRAGEM else baixar_timeframes
+    with metricas.medir('bw_etapa_duracao_segundos', etapa='download'):
+        barras = baixar({**TIMEFRAMES_ESTRUTURAIS, **TIMEFRAMES_INDICADORES}, instrumentos=instrumentos)
+
+    # Só o que mudou desde o último ciclo é recalculado; sem mudança, nada é enviado
+    alteradas, reaproveitadas, assinaturas = {}, {}, {}
+    for nome in instrumentos:
+        por_chave = barras.get(nome, {})
+        if not por_chave:
+            # Todos os downloads falharam: não é "sem mudança"; a análise reporta a falta de dados
+            alteradas[nome], reaproveitadas[nome] = {}, {}
+            continue
+        assinaturas[nome] = {key: assinatura_barras(df, so_fechadas=key in TIMEFRAMES_ESTRUTURAIS)
+                             for key, (df, _) in por_chave.items()}
+        anterior = _ultimo_ciclo.get(nome, {'assinaturas': {}, 'zonas': {}})
+        if anterior['assinaturas'] == assinaturas[nome]:
+            metricas.incrementar('bw_ciclos_sem_mudanca_total')
+            print(f"⏭️ {nome}: nenhuma barra nova desde o último ciclo")
+            continue
+        iguais = {key for key, valor in assinaturas[nome].items() if anterior['assinaturas'].get(key) == valor}
+        alteradas[nome] = {key: valor for key, valor in por_chave.items() if key not in iguais}
+        reaproveitadas[nome] = {key: zona for key, zona in anterior['zonas'].items() if key in iguais}
+
+    with metricas.medir('bw_etapa_duracao_segundos', etapa='motor'):
+        calculado = motor_analise.executar(alteradas)
+    instalar_indicadores({chave: r['estado'] for chave, r in calculado['indicadores'].items()})
+
+    resultados = {}
+    for nome in alteradas:
+        try:
+            resultado = analisar_instrumento(nome, barras.get(nome, {}), calculado['zonas'].get(nome),
+                                             reaproveitadas[nome], calculado['indicadores'])
+        except Exception as e:
+            print(f"❌ Erro na análise de {nome}: {e}")
+            continue
+        if resultado is not None:
+            resultados[nome] = resultado
+            _ultimo_ciclo[nome] = {'assinaturas': assinaturas[nome], 'zonas': resultado['zonas']}
+    salvar_indicadores()
+    salvar_zonas()
+
+    publicacoes = {}
+    for nome, resultado in resultados.items():
+        if len(instrumentos) == 1 or resultado['codigo'] in (SINAL_COMPRA, SINAL_VENDA):
+            enviar_telegram(resultado['msg'], chave=nome, conteudo=resultado['sinal'])
+        print(f"✅ Análise concluída | {nome}: {resultado['sinal']}")
+        sinal = salvar_sinal(resultado['registro'])
+        publicacoes[nome] = {
+            **sinal,
+            'timeframes': resultado['timeframes'],
+            'zonas': resumo_zonas(resultado['zonas']),
+            'zonas_proximas': resultado['referencias']
+        }
+    # Um snapshot por ciclo (não por ativo); o /stream ainda recebe um evento por ativo
+    estado_publicado.publicar_lote(publicacoes)
+
+    return {nome: resultado['sinal'] for nome, resultado in resultados.items()}
+
+
+def analisar_xauusd():
+    return analisar_watchlist({NAME: SYMBOLS}).get(NAME)
 
 # ===========================
 # 🚀 LOOP PRINCIPAL 24/7
 # ===========================
+def iniciar_servidor_web(host='0.0.0.0', porta=PORTA_WEB):
+    try:
+        from waitress import serve
+    except ImportError:
+        print("ℹ️ waitress não instalado, usando o servidor do Flask (threaded)")
+        app.run(host=host, port=porta, debug=False, use_reloader=False, threaded=True)
+        return
+    print(f"🌐 Servidor web (waitress, {WEB_THREADS} threads, até {MAX_ASSINANTES_STREAM} no /stream) na porta {porta}")
+    serve(app, host=host, port=porta, threads=WEB_THREADS)
+
+
 def loop_monitoramento():
     print("🟢 Sistema de monitoramento iniciado...")
-    print(f"🔔 Intervalo: {CHECK_INTERVAL//60} minutos")
-    print(f"📊 Ativo: {NAME}")
+    if AGENDAR_POR_FECHAMENTO:
+        print(f"🔔 Agenda: fechamento de cada barra M15 + {GRACA_FECHAMENTO}s")
+    else:
+        print(f"🔔 Intervalo: {CHECK_INTERVAL//60} minutos")
+    print(f"📊 Ativos: {', '.join(WATCHLIST)}")
+    sincronizador_git.iniciar()
+    notificador_telegram.iniciar()
+    motor_analise.aquecer()
     criar_csv()
+    ultimo = armazem_sinais.ultimo()
+    if ultimo:
+        estado_publicado.publicar(ultimo['symbol'], ultimo)
     
     if TELEGRAM_TOKEN:
         enviar_telegram("🟢 Sistema de monitoramento XAUUSD iniciado!\nAnálise Estrutural Ativada")
@@ -489,18 +3017,39 @@ def loop_monitoramento():
 
     while True:
         try:
-            analisar_xauusd()
-            print(f"⏳ Próxima verificação em {CHECK_INTERVAL//60} minutos...")
-            time.sleep(CHECK_INTERVAL)
+            analisar_watchlist()
+            if AGENDAR_POR_FECHAMENTO:
+                # Espera até um instante absoluto: a duração do ciclo não acumula atraso
+                despertar = proximo_fechamento()
+                print(f"⏳ Próxima verificação às {datetime.fromtimestamp(despertar).strftime('%H:%M:%S')} "
+                      f"(fechamento {'/'.join(barras_fechadas(despertar))})")
+                relogio.dormir(max(0, despertar - relogio.time()))
+            else:
+                print(f"⏳ Próxima verificação em {CHECK_INTERVAL//60} minutos...")
+                relogio.dormir(CHECK_INTERVAL)
         except Exception as e:
             print(f"❌ Erro no loop: {e}")
-            time.sleep(60)
+            relogio.dormir(60)
 
 # ===========================
 # ▶️ EXECUTAR
 # ===========================
 if __name__ == "__main__":
-    web_thread = Thread(target=lambda: app.run(host='0.0.0.0', port=8080, debug=False, use_reloader=False))
+    if "--validar-reamostragem" in sys.argv:
+        relatorio_reamostragem()
+        sys.exit(0)
+    if "--reproduzir" in sys.argv:
+        inicio = time.monotonic()
+        historico = reproduzir_gravacao(sys.argv[sys.argv.index("--reproduzir") + 1])
+        print(f"\n🎞️ {len(historico)} ciclos reproduzidos em {time.monotonic() - inicio:.1f}s")
+        for instante, sinais in historico:
+            for nome, sinal in sinais.items():
+                print(f"{datetime.fromtimestamp(instante).strftime('%d/%m %H:%M')} | {nome}: {sinal}")
+        sys.exit(0)
+    if "--gravar" in sys.argv:
+        gravador_mercado = GravadorMercado(sys.argv[sys.argv.index("--gravar") + 1])
+        print(f"🎞️ Gravando dados de mercado em {gravador_mercado.diretorio}")
+    web_thread = Thread(target=iniciar_servidor_web)
     web_thread.daemon = True
     web_thread.start()
     loop_monitoramento()
@@ -0,0 +1,220 @@
+# otimizador.py - Busca em grade ou aleatória dos parâmetros de zonas e sinais sobre o histórico arquivado
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import pandas as pd
+
+import backtest
+import main
+
+# Mudam os swings/zonas: cada combinação distinta destes exige um preparar_base
+PARAMETROS_PREPARACAO = ('window', 'min_distance', 'tolerancia')
+
+ESPACO_PADRAO = {
+    'window': [2, 3, 4, 5],
+    'min_distance': [2, 3, 5],
+    'tolerancia': [0.0005, 0.001, 0.002],
+    'vol_max': [0.01, 0.015, 0.02, 0.03],
+    'distancia_max': [0.004, 0.008, 0.012, 0.016],
+    'rsi_compra_min': [30, 35, 40, 45],
+    'rsi_venda_max': [55, 60, 65, 70],
+}
+
+PREPARACAO_PADRAO = {'window': 3, 'min_distance': 3, 'tolerancia': 0.001}
+
+
+# ===========================
+# 🎲 COMBINAÇÕES
+# ===========================
+def combinacoes(espaco, amostras=None, seed=42):
+    """
+    Todas as combinações da grade, ou `amostras` delas sorteadas sem
+    reposição (busca aleatória). O sorteio é feito sobre a posição na grade,
+    então não é preciso materializar a grade inteira.
+    """
+    nomes = list(espaco)
+    valores = [list(espaco[nome]) for nome in nomes]
+    total = math.prod(len(v) for v in valores)
+    if amostras is None or amostras >= total:
+        return [dict(zip(nomes, combo)) for combo in itertools.product(*valores)]
+    resultado = []
+    for posicao in sorted(random.Random(seed).sample(range(total), amostras)):
+        combo = {}
+        for nome, opcoes in zip(reversed(nomes), reversed(valores)):
+            posicao, resto = divmod(posicao, len(opcoes))
+            combo[nome] = opcoes[resto]
+        resultado.append({nome: combo[nome] for nome in nomes})
+    return resultado
+
+
+def agrupar(lista, processos=1):
+    """
+    Tarefas (preparação, combinações): uma por janela de swings. Com menos
+    janelas que workers, cada janela é dividida (e preparada mais de uma vez)
+    para ocupar o pool.
+    """
+    grupos = {}
+    for combo in lista:
+        preparacao = {nome: combo.get(nome, PREPARACAO_PADRAO[nome]) for nome in PARAMETROS_PREPARACAO}
+        grupos.setdefault(tuple(preparacao.items()), []).append(combo)
+    partes = max(1, math.ceil(2 * processos / len(grupos))) if grupos else 1
+    tarefas = []
+    for preparacao, combos in grupos.items():
+        # Mesma vol_max em sequência: as zonas convergentes são reaproveitadas
+        combos.sort(key=lambda c: tuple(sorted((k, v) for k, v in c.items() if k not in PARAMETROS_PREPARACAO)))
+        tamanho = math.ceil(len(combos) / partes)
+        for inicio in range(0, len(combos), tamanho):
+            tarefas.append((dict(preparacao), combos[inicio:inicio + tamanho]))
+    return tarefas
+
+
+# ===========================
+# 🧮 AVALIAÇÃO (NOS WORKERS)
+# ===========================
+_historico = None
+
+
+def _inicializar(historico):
+    global _historico
+    _historico = historico
+
+
+def avaliar_grupo(preparacao, combos):
+    """
+    Prepara a base (indicadores + swings) uma vez e avalia todas as
+    combinações da janela. Zonas convergentes ficam em cache por vol_max e
+    o resultado da simulação pelo próprio vetor de sinais, então combinações
+    que geram os mesmos sinais não são simuladas de novo.
+    """
+    base = backtest.preparar_base(_historico, **preparacao)
+    zonas = {}
+    simulados = {}
+    resultados = []
+    for combo in combos:
+        parametros = {**backtest.PARAMETROS_PADRAO, **combo}
+        vol_max = parametros['vol_max']
+        if vol_max not in zonas:
+            zonas[vol_max] = backtest.zonas_convergentes(base, vol_max)
+        codigo = backtest.avaliar_base(base, parametros['distancia_max'], parametros['rsi_compra_min'],
+                                       parametros['rsi_venda_max'], vol_max, zonas=zonas[vol_max])
+        chave = (hashlib.sha1(codigo.tobytes()).digest(),
+                 parametros['fator_stop'], parametros['alvo_r'], parametros['max_barras'])
+        if chave not in simulados:
+            operacoes = backtest.simular_operacoes(base, codigo, parametros['fator_stop'], parametros['alvo_r'],
+                                                   parametros['max_barras'])
+            stats = backtest.estatisticas(operacoes)
+            stats.pop('saidas', None)
+            simulados[chave] = stats
+        resultados.append({**preparacao, **combo, **simulados[chave]})
+    return resultados
+
+
+# ===========================
+# 🏁 BUSCA
+# ===========================
+def ranquear(resultados, criterio='pnl_total_pct', min_operacoes=5):
+    """Ordena pelo critério (maior primeiro); combinações com poucas operações vão para o fim."""
+    df = pd.DataFrame(resultados)
+    if df.empty or criterio not in df:
+        return df
+    if 'operacoes' in df:
+        df['operacoes'] = df['operacoes'].fillna(0).astype(int)
+    suficiente = df['operacoes'] >= min_operacoes
+    desempate = df['max_drawdown_pct'] if 'max_drawdown_pct' in df else 0
+    df = df.assign(_suficiente=suficiente, _desempate=desempate)
+    df = df.sort_values(['_suficiente', criterio, '_desempate'], ascending=[False, False, True],
+                        na_position='last', kind='stable')
+    return df.drop(columns=['_suficiente', '_desempate']).reset_index(drop=True)
+
+
+def otimizar(historico, espaco=None, amostras=None, seed=42, processos=None, criterio='pnl_total_pct',
+             min_operacoes=5):
+    """Avalia a grade (ou `amostras` sorteadas) em paralelo e devolve o ranking em DataFrame."""
+    espaco = espaco or ESPACO_PADRAO
+    processos = processos or os.cpu_count() or 1
+    lista = combinacoes(espaco, amostras, seed)
+    tarefas = agrupar(lista, processos)
+    print(f"🔍 {len(lista)} combinações em {len(tarefas)} tarefas ({processos} processos)")
+
+    inicio = time.perf_counter()
+    resultados = []
+
+    def progresso(feitas):
+        decorrido = time.perf_counter() - inicio
+        print(f"⏳ {feitas}/{len(tarefas)} tarefas | {len(resultados)} combinações | {decorrido:.0f}s")
+
+    if processos <= 1:
+        _inicializar(historico)
+        for feitas, (preparacao, combos) in enumerate(tarefas, 1):
+            resultados += avaliar_grupo(preparacao, combos)
+            progresso(feitas)
+    else:
+        # forkserver pelo mesmo motivo do motor de análise: não herdar threads via fork
+        metodo = 'forkserver' if sys.platform != 'win32' else 'spawn'
+        with ProcessPoolExecutor(max_workers=processos, mp_context=get_context(metodo),
+                                 initializer=_inicializar, initargs=(historico,)) as pool:
+            futuros = {pool.submit(avaliar_grupo, preparacao, combos): i
+                       for i, (preparacao, combos) in enumerate(tarefas)}
+            por_tarefa = [None] * len(tarefas)
+            for feitas, futuro in enumerate(as_completed(futuros), 1):
+                por_tarefa[futuros[futuro]] = futuro.result()
+                resultados += por_tarefa[futuros[futuro]]
+                progresso(feitas)
+            # Na ordem das tarefas: empates no ranking não dependem de qual worker terminou antes
+            resultados = [r for lote in por_tarefa for r in lote]
+
+    print(f"⏱️ {len(resultados)} combinações em {time.perf_counter() - inicio:.1f}s")
+    return ranquear(resultados, criterio, min_operacoes)
+
+
+# ===========================
+# ▶️ EXECUTAR
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Otimização dos parâmetros de zonas e sinais sobre o histórico arquivado pelo ciclo ao vivo "
+                    "(CACHE_DIR/historico, só-acréscimo; ver backtest.carregar_historico)")
+    parser.add_argument("--ticker", default=main.SYMBOLS[0])
+    parser.add_argument("--inicio", help="descarta barras anteriores (ex.: 2025-01-01)")
+    parser.add_argument("--grade", help="JSON {parâmetro: [valores]} (arquivo ou texto); padrão: ESPACO_PADRAO")
+    parser.add_argument("--aleatorio", type=int, help="sorteia N combinações da grade em vez de avaliar todas")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--processos", type=int, default=os.cpu_count(), help="workers (1 = no processo)")
+    parser.add_argument("--criterio", default="pnl_total_pct", help="coluna usada no ranking (maior é melhor)")
+    parser.add_argument("--min-operacoes", type=int, default=5, help="abaixo disso a combinação vai para o fim")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--saida", default="otimizacao_resultados.csv", help="ranking completo (CSV)")
+    args = parser.parse_args()
+
+    espaco = None
+    if args.grade:
+        if os.path.exists(args.grade):
+            with open(args.grade) as f:
+                espaco = json.load(f)
+        else:
+            espaco = json.loads(args.grade)
+
+    historico = backtest.carregar_historico(args.ticker)
+    if args.inicio:
+        historico = {tf: df[df.index >= pd.Timestamp(args.inicio, tz=df.index.tz)] for tf, df in historico.items()}
+    faltando = [tf for tf in ('M15', 'D1', 'H4') if tf not in historico]
+    if faltando:
+        print(f"❌ Histórico insuficiente (arquivo + cache): faltam {', '.join(faltando)}")
+        sys.exit(1)
+    print(f"📂 Barras: {({tf: len(df) for tf, df in historico.items()})}")
+
+    ranking = otimizar(historico, espaco, args.aleatorio, args.seed, args.processos, args.criterio,
+                       args.min_operacoes)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(ranking.head(args.top).to_string())
+    ranking.to_csv(args.saida, index=False)
+    print(f"💾 Ranking salvo em {args.saida}")
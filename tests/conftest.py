@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# main lê a configuração no import: cache e banco de sinais ficam fora do repositório
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="bw_testes_"))
+os.environ.setdefault("SINAIS_DB", ":memory:")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
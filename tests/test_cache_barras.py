@@ -0,0 +1,28 @@
+# Cache de barras em disco: legível por qualquer ponto de entrada (não só por `python main.py`)
+import subprocess
+import sys
+
+import pandas as pd
+
+import benchmark
+import main
+
+
+def test_cache_em_disco_guarda_dados_simples_e_reconstroi_o_buffer(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(main, '_cache_barras', {})
+    df = main.normalizar_colunas(benchmark.gerar_ohlcv(500, '15min', seed=1))
+    chave = ('TESTE=F', '15m')
+    main._persistir_entrada(chave, {'barras': main.BufferBarras.de_dataframe(df, 400), 'periodo': '5d',
+                                    'atualizado_em': 123.0})
+
+    # Outro processo, sem importar main: só pandas/numpy são necessários para ler o arquivo
+    codigo = ("import sys, pandas as pd; d = pd.read_pickle(sys.argv[1]); "
+              "assert isinstance(d['buffer'], dict) and 'barras' not in d, d.keys()")
+    subprocess.run([sys.executable, '-c', codigo, main._arquivo_cache(*chave)], check=True)
+
+    entrada = main._carregar_entrada(chave)
+    assert entrada['periodo'] == '5d' and entrada['atualizado_em'] == 123.0
+    esperado = df.iloc[-400:][list(main.COLUNAS_BARRAS)].astype('float32')
+    esperado.index = esperado.index.as_unit('ns')
+    pd.testing.assert_frame_equal(entrada['barras'].dataframe(), esperado, check_freq=False)
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import benchmark
+import main
+
+
+def test_download_falho_no_primeiro_ciclo_nao_conta_como_sem_mudanca(monkeypatch, capsys):
+    metricas = main.Metricas()
+    monkeypatch.setattr(main, 'metricas', metricas)
+    monkeypatch.setattr(main, 'MODO_REAMOSTRAGEM', False)
+    monkeypatch.setattr(main, 'baixar_timeframes', lambda timeframes, instrumentos=None: {})
+    monkeypatch.setattr(main, '_ultimo_ciclo', {})
+
+    assert main.analisar_watchlist({'TESTE': ['TESTE=F']}) == {}
+
+    saida = capsys.readouterr().out
+    assert "Dados insuficientes (TESTE)" in saida
+    assert "nenhuma barra nova" not in saida
+    assert 'TESTE' not in main._ultimo_ciclo
+    assert ('bw_ciclos_sem_mudanca_total', ()) not in metricas._contadores
+
+
+def test_zonas_estruturais_so_recalculam_quando_a_propria_barra_fecha(monkeypatch):
+    frequencias = {'W1': 'W-MON', 'D1': '1D', 'H4': '4h', 'w1': 'W-MON', 'd1': '1D', 'h4': '4h', 'm15': '15min'}
+    base = {key: main.normalizar_colunas(benchmark.gerar_ohlcv(200, freq, seed=i))
+            for i, (key, freq) in enumerate(frequencias.items())}
+    ciclo = {'barras': base}
+
+    def baixar(timeframes, instrumentos=None):
+        return {'TESTE': {key: (df.copy(), 'TESTE=F') for key, df in ciclo['barras'].items()}}
+
+    def com_barra_em_formacao(df, fator):
+        df = df.copy()
+        df.iloc[-1, df.columns.get_loc('close')] *= fator
+        return df
+
+    metricas = main.Metricas()
+    monkeypatch.setattr(main, 'metricas', metricas)
+    monkeypatch.setattr(main, 'MODO_REAMOSTRAGEM', False)
+    monkeypatch.setattr(main, 'baixar_timeframes', baixar)
+    monkeypatch.setattr(main, '_ultimo_ciclo', {})
+    monkeypatch.setattr(main, 'enviar_telegram', lambda *args, **kwargs: None)
+    monkeypatch.setattr(main.sincronizador_git, 'enfileirar', lambda *args: None)
+
+    def reaproveitados():
+        return {dict(rotulos)['tf']: valor for (nome, rotulos), valor in metricas._contadores.items()
+                if nome == 'bw_timeframes_reaproveitados_total'}
+
+    main.analisar_watchlist({'TESTE': ['TESTE=F']})
+    assert reaproveitados() == {}
+
+    # Só as barras em formação andaram (inclusive a M15): nada estrutural é recalculado
+    ciclo['barras'] = {key: com_barra_em_formacao(df, 1.001) for key, df in base.items()}
+    main.analisar_watchlist({'TESTE': ['TESTE=F']})
+    assert reaproveitados() == {'W1': 1, 'D1': 1, 'H4': 1}
+
+    # Fecha uma barra H4: só o H4 é recalculado
+    h4 = base['H4']
+    proxima = h4.iloc[[-1]].set_axis([h4.index[-1] + pd.Timedelta(hours=4)])
+    ciclo['barras'] = {**ciclo['barras'], 'H4': pd.concat([h4, proxima])}
+    main.analisar_watchlist({'TESTE': ['TESTE=F']})
+    assert reaproveitados() == {'W1': 2, 'D1': 2, 'H4': 1}
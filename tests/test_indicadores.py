@@ -0,0 +1,73 @@
+# Motor incremental (IndicadorIncremental) x cálculo em lote (calcular_indicadores)
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(7)
+    valores = 2000 * np.exp(np.cumsum(rng.normal(0, 0.003, 300)))
+    valores[40:70] = valores[40]  # trecho plano: RSI indefinido (0/0) e depois 100
+    valores[[100, 101, 180]] = np.nan
+    indice = pd.date_range("2025-01-01", periods=len(valores), freq="15min", tz="UTC")
+    return pd.Series(valores, index=indice)
+
+
+def lote(closes):
+    df = main.calcular_indicadores(pd.DataFrame({'close': closes}))
+    return df['rsi_14'].to_numpy(), df['ema_21'].to_numpy()
+
+
+def test_atualizar_e_espiar_igual_ao_lote(closes):
+    rsi, ema = lote(closes)
+    assert np.isnan(rsi[60]) and rsi[70] == 100  # o trecho plano cobre os dois casos especiais
+    ind = main.IndicadorIncremental()
+    for i, (ts, close) in enumerate(closes.items()):
+        # Barra em formação: espiar não altera o estado
+        np.testing.assert_allclose(ind.espiar(close), (rsi[i], ema[i]), rtol=1e-10, equal_nan=True)
+        ind.atualizar(ts, close)
+        np.testing.assert_allclose((ind.rsi, ind.ema), (rsi[i], ema[i]), rtol=1e-10, equal_nan=True)
+    validas = int((~np.isnan(rsi) & ~np.isnan(ema)).sum())
+    assert ind.barras_validas == validas
+
+
+def test_reconstruir_igual_a_atualizar(closes):
+    ind = main.IndicadorIncremental()
+    for ts, close in closes.items():
+        ind.atualizar(ts, close)
+    reconstruido = main.IndicadorIncremental.reconstruir(closes.to_numpy(), closes.index[-1]).to_dict()
+    for chave, valor in ind.to_dict().items():
+        if valor is None or isinstance(valor, str):
+            assert reconstruido[chave] == valor
+        else:
+            np.testing.assert_allclose(reconstruido[chave], valor, rtol=0, equal_nan=True)
+
+
+def test_indicadores_ultima_barra_igual_ao_lote(closes):
+    rsi, ema = lote(closes)
+    df = pd.DataFrame({'close': closes})
+    main._indicadores.pop("TESTE|m15", None)
+    for fim in range(30, len(df) + 1, 17):
+        resultado = main.indicadores_ultima_barra(df.iloc[:fim], "TESTE", "m15")
+        np.testing.assert_allclose(resultado[:2], (rsi[fim - 1], ema[fim - 1]), rtol=1e-10, equal_nan=True)
+        np.testing.assert_allclose(resultado[2], rsi[fim - 2], rtol=1e-10, equal_nan=True)
+        assert resultado[3] == closes.iloc[fim - 2] or np.isnan(resultado[3])
+
+
+def test_to_dict_from_dict_continua_igual(closes):
+    parte, resto = closes.iloc[:150], closes.iloc[150:]
+    ind = main.IndicadorIncremental()
+    for ts, close in parte.items():
+        ind.atualizar(ts, close)
+    copia = main.IndicadorIncremental.from_dict(json.loads(json.dumps(ind.to_dict())))
+    assert copia.ultimo_ts == ind.ultimo_ts
+    for ts, close in resto.items():
+        ind.atualizar(ts, close)
+        copia.atualizar(ts, close)
+        np.testing.assert_allclose((copia.rsi, copia.ema), (ind.rsi, ind.ema), rtol=0, equal_nan=True)
+    assert copia.barras_validas == ind.barras_validas
@@ -0,0 +1,29 @@
+# Índice de zonas x detecção atual de cada timeframe
+import benchmark
+import main
+
+
+def conjunto(zonas, tf):
+    return sorted((float(z['price']), tf, z['type'], str(z['candle'])) for z in zonas['suportes'] + zonas['resistencias'])
+
+
+def test_substituir_acompanha_janela_deslizante():
+    df = main.normalizar_colunas(benchmark.gerar_ohlcv(900, '4h', seed=3))
+    outro = main.detectar_zonas(main.normalizar_colunas(benchmark.gerar_ohlcv(300, '1D', seed=4)))
+    indice = main.IndiceZonas()
+    indice.substituir('D1', outro)
+    for fim in range(400, 900, 7):
+        # A barra em formação muda a cada passo: swings no fim da janela podem sumir
+        janela = df.iloc[fim - 400:fim].copy()
+        janela.iloc[-1, janela.columns.get_loc('low')] *= 0.99 if fim % 2 else 1.01
+        zonas = main.detectar_zonas(janela)
+        indice.substituir('H4', zonas)
+        assert sorted(map(tuple, indice.to_list())) == sorted(conjunto(zonas, 'H4') + conjunto(outro, 'D1'))
+        assert len(indice) == len(indice.to_list())
+
+
+def test_substituir_sem_mudanca_retorna_zero():
+    zonas = main.detectar_zonas(main.normalizar_colunas(benchmark.gerar_ohlcv(300, '4h', seed=5)))
+    indice = main.IndiceZonas()
+    assert indice.substituir('H4', zonas) == len(conjunto(zonas, 'H4'))
+    assert indice.substituir('H4', zonas) == 0
@@ -0,0 +1,32 @@
+# Mensagem do Telegram: nível recomendado e a sua confluência
+import main
+
+
+def dados():
+    linha = {'close': 2000.0, 'ema_21': 1990.0, 'rsi_14': 55.0, 'low': 1995.0, 'high': 2005.0}
+    return {'d1': dict(linha), 'h4': dict(linha), 'm15': dict(linha)}
+
+
+def montar(zona_info, zonas_estruturais, sinal=main.SINAL_COMPRA):
+    return main.montar_mensagem(dados(), zonas_estruturais, main.SINAIS_TEXTO[sinal], zona_info,
+                                False, False, 1990.0, 2010.0, 'TESTE')
+
+
+def test_confluencia_e_do_nivel_recomendado():
+    indice = main.IndiceZonas()
+    indice.inserir(1980.0, 'H4', 'support', '2025-01-02')
+    indice.inserir(1980.5, 'D1', 'support', '2025-01-01')
+    indice.inserir(1995.0, 'H4', 'support', '2025-01-03')  # a mais próxima do preço, mas não a recomendada
+    zona_info = {'confianca': 'alta', 'zona_preco': 1980.0, 'confluencia': indice.confluencia(1980.0)}
+
+    msg = montar(zona_info, {'H4': {'suporte_recente': 1995.0, 'resistencia_recente': None}})
+
+    assert "Entrar próximo a <b>1980.00</b>" in msg
+    assert "Confluência: D1+H4" in msg
+
+
+def test_sem_h4_e_sem_zona_preco_nao_quebra():
+    msg = montar({'confianca': 'média'}, {'D1': {'suporte_recente': 1990.0, 'resistencia_recente': 2020.0}},
+                 main.SINAL_VENDA)
+    assert "RECOMENDAÇÃO DE VENDA" in msg
+    assert "Entrar próximo a" not in msg and "Confluência" not in msg
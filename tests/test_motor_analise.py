@@ -0,0 +1,45 @@
+# Motor de análise em processos x o mesmo cálculo no processo principal
+import numpy as np
+import pytest
+
+import benchmark
+import main
+
+
+@pytest.fixture
+def barras(monkeypatch):
+    monkeypatch.setattr(main, '_indicadores', {})
+    por_chave = {}
+    for i, (key, freq) in enumerate((('W1', 'W-MON'), ('D1', '1D'), ('H4', '4h'),
+                                     ('d1', '1D'), ('h4', '4h'), ('m15', '15min'))):
+        df = main.normalizar_colunas(benchmark.gerar_ohlcv(400, freq, seed=i))
+        por_chave[key] = (df, 'TESTE=F')
+    # m15 com estado incremental já existente: o worker só avança as barras novas
+    main.indicadores_ultima_barra(por_chave['m15'][0].iloc[:-6], 'TESTE=F', 'm15')
+    return {'TESTE': por_chave}
+
+
+def test_executar_em_processos_igual_ao_processo_principal(barras):
+    motor = main.MotorAnalise(processos=2)
+    try:
+        calculado = motor.executar(barras)
+    finally:
+        motor.encerrar()
+
+    for key in main.TIMEFRAMES_ESTRUTURAIS:
+        df, _ = barras['TESTE'][key]
+        zonas = main.detectar_zonas(df)
+        resultado = calculado['zonas']['TESTE'][key]
+        assert main.montar_zonas(df.index, *resultado['arrays']) == zonas
+        assert resultado['padroes'] == main.detectar_padroes_zona(df, zonas, key)
+
+    for key in ('d1', 'h4', 'm15'):
+        df, ticker = barras['TESTE'][key]
+        resultado = calculado['indicadores'][(ticker, key)]
+        esperado = main.indicadores_ultima_barra(df, ticker, key)
+        np.testing.assert_allclose(resultado['valores'], esperado, equal_nan=True)
+        assert resultado['estado'] == main.estado_indicador(ticker, key)
+
+
+def test_sem_processos_o_ciclo_calcula_no_processo(barras):
+    assert main.MotorAnalise(processos=0).executar(barras) == {'zonas': {}, 'indicadores': {}}
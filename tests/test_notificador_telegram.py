@@ -0,0 +1,92 @@
+# NotificadorTelegram contra um servidor HTTP local no lugar da API do Telegram
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import main
+
+
+class ApiFalsa(BaseHTTPRequestHandler):
+    def do_POST(self):
+        corpo = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        servidor = self.server
+        servidor.pedidos.append((time.monotonic(), self.path, corpo['text'][0]))
+        status, resposta = servidor.respostas.pop(0) if servidor.respostas else (200, {"ok": True})
+        dados = json.dumps(resposta).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ApiFalsa)
+    servidor.pedidos, servidor.respostas = [], []
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+
+
+def notificador(api, **kwargs):
+    opcoes = {'taxa': 100, 'rajada': 10, 'janela_lote': 0.2, **kwargs}
+    return main.NotificadorTelegram(token="TESTE", chat_id="1",
+                                    base_url=f"http://127.0.0.1:{api.server_address[1]}", **opcoes)
+
+
+def test_relatorios_do_ciclo_vao_em_uma_mensagem(api):
+    telegram = notificador(api)
+    for nome in ("XAUUSD", "EURUSD", "BTCUSD"):
+        assert telegram.enviar(f"relatório {nome}", chave=nome)
+    telegram.parar(timeout=10)
+    assert len(api.pedidos) == 1
+    _, caminho, texto = api.pedidos[0]
+    assert caminho == "/botTESTE/sendMessage"
+    assert texto == "relatório XAUUSD\n\nrelatório EURUSD\n\nrelatório BTCUSD"
+
+
+def test_mesmo_conteudo_da_mesma_chave_nao_e_reenviado(api):
+    telegram = notificador(api)
+    assert telegram.enviar("COMPRA às 10:00", chave="XAUUSD", conteudo="COMPRA")
+    assert not telegram.enviar("COMPRA às 10:15", chave="XAUUSD", conteudo="COMPRA")
+    assert telegram.enviar("VENDA às 10:30", chave="XAUUSD", conteudo="VENDA")
+    telegram.parar(timeout=10)
+    assert [texto for _, _, texto in api.pedidos] == ["COMPRA às 10:00\n\nVENDA às 10:30"]
+
+
+def test_429_respeita_retry_after(api):
+    api.respostas.append((429, {"ok": False, "parameters": {"retry_after": 1}}))
+    telegram = notificador(api)
+    telegram.enviar("sinal")
+    telegram.parar(timeout=10)
+    assert len(api.pedidos) == 2
+    assert api.pedidos[1][0] - api.pedidos[0][0] >= 0.9
+
+
+def test_erro_do_pedido_nao_repete_e_libera_a_chave(api):
+    api.respostas.append((400, {"ok": False, "description": "Bad Request"}))
+    telegram = notificador(api)
+    telegram.enviar("<b>quebrado", chave="XAUUSD", conteudo="COMPRA")
+    telegram.parar(timeout=10)
+    assert len(api.pedidos) == 1
+    # Não entregue: o mesmo relatório volta a ser elegível
+    assert telegram.enviar("<b>quebrado", chave="XAUUSD", conteudo="COMPRA")
+    telegram.parar(timeout=10)
+    assert len(api.pedidos) == 2
+
+
+def test_balde_limita_a_taxa(api):
+    telegram = notificador(api, taxa=5, rajada=1, janela_lote=0)
+    inicio = time.monotonic()
+    for i in range(4):
+        telegram._entregar(f"mensagem {i}")
+    assert time.monotonic() - inicio >= 3 / 5 * 0.9
+    assert len(api.pedidos) == 4
@@ -0,0 +1,68 @@
+# SincronizadorGit contra um repositório bare local (sem GitHub)
+import shutil
+import subprocess
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git não instalado")
+
+
+def git(*args, cwd):
+    return subprocess.run(['git', *args], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+
+
+@pytest.fixture
+def repos(tmp_path):
+    remoto, trabalho = tmp_path / "remoto.git", tmp_path / "trabalho"
+    git('init', '--bare', '-b', 'main', str(remoto), cwd=tmp_path)
+    git('clone', str(remoto), str(trabalho), cwd=tmp_path)
+    return remoto, trabalho
+
+
+def sincronizador(remoto, trabalho, linhas, **kwargs):
+    def preparar():
+        with open(trabalho / "sinais.csv", "w") as f:
+            f.write("timestamp,symbol\n" + "".join(linhas))
+    return main.SincronizadorGit(arquivo="sinais.csv", repo_dir=str(trabalho), remoto=str(remoto),
+                                 branch="main", preparar=preparar, **kwargs)
+
+
+def test_agrupa_sinais_da_janela_em_um_commit(repos):
+    remoto, trabalho = repos
+    linhas = []
+    sync = sincronizador(remoto, trabalho, linhas, janela=60, max_linhas=3)
+    sync.iniciar()
+    for i in range(3):
+        linhas.append(f"2025-01-01 00:{i:02d},XAUUSD\n")
+        sync.enfileirar(linhas[-1], f"sinal {i}")
+    sync.parar(timeout=30)
+
+    assert git('rev-list', '--count', 'main', cwd=remoto) == "1"
+    assert git('log', '-1', '--format=%s', 'main', cwd=remoto) == "📊 3 sinais | último: sinal 2"
+    assert git('show', 'main:sinais.csv', cwd=remoto).count("XAUUSD") == 3
+
+
+def test_csv_sem_mudanca_nao_gera_commit(repos):
+    remoto, trabalho = repos
+    linhas = ["2025-01-01 00:00,XAUUSD\n"]
+    sync = sincronizador(remoto, trabalho, linhas)
+    sync.sincronizar([(linhas[0], "primeiro")])
+    sync.sincronizar([(None, "de novo")])
+    assert git('rev-list', '--count', 'main', cwd=remoto) == "1"
+
+
+def test_push_que_falhou_e_reenviado(repos, monkeypatch):
+    remoto, trabalho = repos
+    monkeypatch.setattr(main.time, "sleep", lambda segundos: None)
+    linhas = ["2025-01-01 00:00,XAUUSD\n"]
+    sync = sincronizador(remoto, trabalho, linhas, max_tentativas=2)
+    sync.remoto = str(remoto) + "-inexistente"
+    sync.sincronizar([(linhas[0], "sem rede")])
+    assert sync._push_pendente
+
+    sync.remoto = str(remoto)
+    assert sync._push()
+    assert not sync._push_pendente
+    assert git('log', '-1', '--format=%s', 'main', cwd=remoto) == "sem rede"
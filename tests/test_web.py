@@ -0,0 +1,66 @@
+# /status (ETag) e /stream (SSE com limite de assinantes) pelo cliente de teste do Flask
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def estado(monkeypatch):
+    estado = main.EstadoPublicado(max_assinantes=2)
+    monkeypatch.setattr(main, "estado_publicado", estado)
+    return estado
+
+
+def test_status_responde_304_com_o_mesmo_etag(estado):
+    estado.publicar("XAUUSD", {"sinal": "COMPRA", "preco": 2000.0, "timestamp": "2025-01-01 10:00"})
+    cliente = main.app.test_client()
+    resposta = cliente.get('/status')
+    assert json.loads(resposta.data)['last_signal'] == "COMPRA"
+    assert cliente.get('/status', headers={'If-None-Match': resposta.headers['ETag']}).status_code == 304
+    estado.publicar("XAUUSD", {"sinal": "VENDA", "preco": 1990.0, "timestamp": "2025-01-01 10:15"})
+    assert cliente.get('/status', headers={'If-None-Match': resposta.headers['ETag']}).status_code == 200
+
+
+def test_stream_entrega_eventos_publicados(estado):
+    resposta = main.app.test_client().get('/stream', buffered=False)
+    corpo = iter(resposta.response)
+    assert next(corpo).startswith(b"retry:")
+    estado.publicar("XAUUSD", {"sinal": "COMPRA", "preco": 2000.0, "timestamp": "2025-01-01 10:00"})
+    evento = next(corpo).decode()
+    assert evento.startswith("event: sinal\n")
+    assert json.loads(evento.split("data: ", 1)[1])['instrument'] == "XAUUSD"
+    resposta.close()
+    assert estado.assinantes == 0
+
+
+def test_stream_acima_do_limite_recebe_503_e_a_vaga_volta_ao_fechar(estado):
+    cliente = main.app.test_client()
+    abertas = [cliente.get('/stream', buffered=False) for _ in range(2)]
+    assert all(r.status_code == 200 for r in abertas)
+    recusada = cliente.get('/stream', buffered=False)
+    assert recusada.status_code == 503
+    assert recusada.headers['Retry-After'] == '30'
+    assert cliente.get('/status').status_code == 200
+
+    abertas[0].close()  # sem ter lido nenhum evento
+    assert estado.assinantes == 1
+    assert cliente.get('/stream', buffered=False).status_code == 200
+
+
+def test_limite_padrao_deixa_threads_livres():
+    assert main.MAX_ASSINANTES_STREAM < main.WEB_THREADS
+
+
+def test_publicar_lote_serializa_uma_vez_e_emite_um_evento_por_ativo():
+    chamadas = []
+    estado = main.EstadoPublicado(extras=lambda: chamadas.append(1) or {})
+    fila = estado.assinar()
+    estado.publicar_lote({f"ATIVO{i}": {"sinal": "AGUARDAR", "preco": 100.0 + i, "timestamp": "2025-01-01 10:00"}
+                          for i in range(50)})
+    assert len(chamadas) == 1
+    eventos = [json.loads(fila.get_nowait())['instrument'] for _ in range(50)]
+    assert eventos == [f"ATIVO{i}" for i in range(50)] and fila.empty()
+    corpo, etag = estado.snapshot()
+    assert len(json.loads(corpo)['instruments']) == 50 and etag